@@ -0,0 +1,246 @@
+# async_server.py
+import asyncio
+import base64
+import os
+import signal
+import socket
+import time
+from config import CONFIG
+from models import Client
+from outbox import Outbox
+from metrics import METRICS
+from server import ChatServer
+from utils import log_message, print_colored
+
+class AsyncOutbox(Outbox):
+    """Outbox drained by an event-loop task instead of a writer thread"""
+    def __init__(self, client):
+        super().__init__(client)
+        self.event = asyncio.Event()
+
+    def start(self):
+        self.writer = asyncio.get_running_loop().create_task(self.run())
+
+    def wake(self):
+        self.event.set()
+
+    async def run(self):
+        stream = self.client.connection
+        try:
+            while True:
+                with self.ready:
+                    batch = self.take_batch()
+                if not batch:
+                    if self.closed:
+                        break
+                    self.event.clear()
+                    await self.event.wait()
+                    continue
+                if self.client.framing:
+                    stream.writelines(self.client.wire_frames(batch))
+                    await stream.drain()
+                else:
+                    # Legacy clients read one message per recv, so keep sends separate as write_frames does
+                    for frame in batch:
+                        stream.write(frame)
+                        await stream.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            stream.close()
+
+    def close(self, timeout=0):
+        # The task flushes and closes the stream itself; it cannot be joined here
+        with self.ready:
+            self.closed = True
+            self.wake()
+
+class AsyncClient(Client):
+    outbox_class = AsyncOutbox
+
+    def abort(self):
+        self.connection.transport.abort()
+
+    def close(self, timeout=0):
+        self.outbox.close()
+        if not timeout:
+            self.abort()
+
+class AsyncChatServer(ChatServer):
+    """ChatServer that serves every connection from a single event loop"""
+    client_class = AsyncClient
+
+    def __init__(self):
+        super().__init__()
+        self.loop = None
+        self.stopping = None  # Set to end serve()
+        self.handshaking = 0  # Connections waiting for their handshake
+
+    def start(self):
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            print_colored(f"Server error: {e}", "red")
+            log_message(f"Server error: {e}", 'error')
+
+    def stop(self):
+        """Stop the accept loop; shutdown runs once serve() returns"""
+        self.running = False
+        self.stopping.set()
+
+    def wake_accept_loop(self):
+        self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def serve(self):
+        handed_off = False
+        try:
+            if not (self.take_over_sockets() if self.take_over else self.bind_socket()):
+                return
+
+            self.loop = asyncio.get_running_loop()
+            self.stopping = asyncio.Event()
+            self.loop.add_signal_handler(signal.SIGINT, self.stop)
+            self.loop.add_signal_handler(signal.SIGTERM, self.stop)
+
+            self.socket.setblocking(False)
+            server = await asyncio.start_server(
+                self.handle_stream, sock=self.socket,
+                ssl=self.transport.server_ssl_context(),
+                ssl_handshake_timeout=CONFIG['HANDSHAKE_TIMEOUT'] if self.transport.name == 'tls' else None
+            )
+            self.announce_start()
+            if self.predecessor:
+                await self.adopt_clients()
+
+            async with server:
+                await self.stopping.wait()
+                if self.successor:
+                    handed_off = await self.hand_off()
+        finally:
+            if not handed_off:
+                # Close client streams while the loop can still flush them
+                writers = [client.outbox.writer for client in self.clients.values()]
+                self.shutdown()
+                if writers:
+                    await asyncio.wait(writers, timeout=CONFIG['OUTBOX_FLUSH_TIMEOUT'])
+
+    async def handle_stream(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        METRICS.inc('chat_connections_accepted_total')
+        try:
+            self.handshaking += 1
+            try:
+                handshake = await asyncio.wait_for(reader.read(CONFIG['BUFFER_SIZE']),
+                                                   CONFIG['HANDSHAKE_TIMEOUT'])
+                if not handshake:
+                    writer.close()  # Closed without saying who it is
+                    return
+                client = self.register_client(writer, addr, handshake)
+            finally:
+                self.handshaking -= 1
+            if client:
+                client.reader = asyncio.current_task()
+                await self.handle_stream_messages(client, reader)
+
+        except Exception as e:
+            log_message(f"Error handling client connection: {e}", 'error')
+            writer.close()
+
+    async def handle_stream_messages(self, client, reader):
+        while self.running:
+            try:
+                data = await reader.read(CONFIG['BUFFER_SIZE'])
+                if not data:
+                    break
+
+                self.dispatch_frames(client, client.decoder.feed(data))
+
+            except Exception as e:
+                log_message(f"Error handling message from {client.username}: {e}", 'error')
+                break
+
+        if self.successor:
+            return  # The client goes to the new process as it is
+        self.remove_client(client.username, client=client)
+
+    async def hand_off(self):
+        """Pause reading instead of waking reader threads, and pass duplicates of the sockets.
+
+        The streams close once their writers have flushed; the duplicate
+        descriptors keep the connections open for the new process.
+        """
+        if self.chatbot:
+            self.chatbot.stop()
+        deadline = time.monotonic() + CONFIG['HANDSHAKE_TIMEOUT']
+        while self.handshaking and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+        clients = [client for client in self.clients.values() if client.detached is None]
+        for client in clients:
+            client.connection.transport.pause_reading()
+        # Readers already woken by data take it from their stream before they are cancelled
+        for _ in range(2):
+            await asyncio.sleep(0)
+        for client in clients:
+            if client.reader:
+                client.reader.cancel()
+        self.flush_presence()
+
+        fds, closed = {}, {}
+        for client in clients:
+            fds[client] = os.dup(client.connection.get_extra_info('socket').fileno())
+            client.handed_off = True
+            client.outbox.close()
+            closed[client] = asyncio.ensure_future(client.connection.wait_closed())
+        if closed:
+            await asyncio.wait(closed.values(), timeout=CONFIG['OUTBOX_FLUSH_TIMEOUT'])
+        handed = []
+        for client, future in closed.items():
+            if future.done() and future.exception() is None:
+                handed.append((client, fds[client]))
+            else:
+                # Not flushed in time: this process closes it when it exits, and the client reconnects
+                future.cancel()
+                os.close(fds[client])
+        return self.send_to_successor(handed)
+
+    async def adopt_clients(self):
+        # Everyone is back in their room before anyone's messages are read
+        adopted = []
+        for info, fd in self.inherited:
+            reader, writer = await asyncio.open_connection(sock=socket.socket(fileno=fd))
+            adopted.append((self.restore_client(info, writer), reader, base64.b64decode(info['pending'])))
+        for client, reader, pending in adopted:
+            client.reader = self.loop.create_task(self.handle_adopted_client(client, reader, pending))
+        self.finish_take_over()
+
+    async def handle_adopted_client(self, client, reader, pending):
+        if pending:
+            self.dispatch_frames(client, client.decoder.feed(pending))
+        await self.handle_stream_messages(client, reader)
+
+    def start_heartbeat(self):
+        """Tick the heartbeat wheel from a task on the loop rather than a thread"""
+        if self.create_heartbeat_wheel():
+            self.heartbeat_task = self.loop.create_task(self.run_heartbeat())
+
+    async def run_heartbeat(self):
+        while self.running:
+            await asyncio.sleep(CONFIG['HEARTBEAT_TICK'])
+            self.check_heartbeats()
+
+    def start_presence(self):
+        self.presence_task = self.loop.create_task(self.run_presence())
+
+    async def run_presence(self):
+        while self.running:
+            await asyncio.sleep(CONFIG['PRESENCE_INTERVAL'])
+            self.flush_presence()
+
+    def broadcast_chatbot_response(self, chatbot_response, room=None):
+        """Replies arrive on chatbot worker threads; broadcast them from the loop"""
+        self.loop.call_soon_threadsafe(super().broadcast_chatbot_response, chatbot_response, room)
+
+    def handle_bus_event(self, event):
+        """Bus events arrive on reader threads; deliver them from the loop"""
+        self.loop.call_soon_threadsafe(super().handle_bus_event, event)
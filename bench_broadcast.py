@@ -0,0 +1,99 @@
+# bench_broadcast.py
+"""Microbenchmark: cost of one broadcast against room size.
+
+Compares the old per-recipient `to_json().encode()` + send loop with the
+encode-once broadcast_messages pipeline, over local socket pairs. Queued
+broadcasts are timed until every client's writer has drained its outbox.
+
+Usage: python bench_broadcast.py [--sizes 1 10 100 1000] [--rounds 200]
+"""
+import argparse
+import selectors
+import socket
+import threading
+import time
+from config import CONFIG
+from models import Client, Message
+from protocol import FRAMING_LENGTH_PREFIX, encode_message
+from registry import ClientRegistry
+from server import ChatServer
+from spawn import BENCH_CONFIG
+
+def drain(sockets, stop):
+    """Read and discard everything the server side writes"""
+    selector = selectors.DefaultSelector()
+    for sock in sockets:
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+    while not stop.is_set():
+        for key, _ in selector.select(timeout=0.1):
+            try:
+                while key.fileobj.recv(262144):
+                    pass
+            except BlockingIOError:
+                pass
+    selector.close()
+
+def per_recipient_broadcast(server, message, exclude=None):
+    """The original loop: one serialization and one send per recipient"""
+    for username, client in server.clients.items():
+        if username != exclude:
+            client.connection.sendall(encode_message(message, client.framing))
+
+def time_broadcasts(broadcast, server, rounds, batch):
+    start = time.perf_counter()
+    for i in range(rounds):
+        messages = [Message('chat', f'benchmark line {i}.{j}', 'bench') for j in range(batch)]
+        if batch == 1:
+            broadcast(server, messages[0])
+        else:
+            broadcast(server, messages)
+    for client in server.clients.values():
+        while client.outbox.depth():
+            time.sleep(0.0001)
+    return (time.perf_counter() - start) / rounds
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=4,
+                        help='Messages per batched broadcast_messages call')
+    args = parser.parse_args()
+
+    # Measure delivery, not the overflow policy, the bot or history writes
+    CONFIG.update(BENCH_CONFIG)
+    CONFIG['OUTBOX_SIZE'] = args.rounds * args.batch
+
+    server = ChatServer()
+    print(f"{'room':>6} {'per-recipient':>15} {'encode-once':>13} "
+          f"{'batched x' + str(args.batch):>13}  (usec per message)")
+
+    for size in args.sizes:
+        pairs = [socket.socketpair() for _ in range(size)]
+        server.clients = ClientRegistry()
+        for i, (ours, _) in enumerate(pairs):
+            client = Client(ours, None, f"user{i}", FRAMING_LENGTH_PREFIX)
+            client.start()
+            server.clients.add(client)
+        stop = threading.Event()
+        drainer = threading.Thread(target=drain, args=([theirs for _, theirs in pairs], stop))
+        drainer.start()
+
+        try:
+            old = time_broadcasts(per_recipient_broadcast, server, args.rounds, 1)
+            once = time_broadcasts(ChatServer.broadcast_message, server, args.rounds, 1)
+            batched = time_broadcasts(ChatServer.broadcast_messages, server,
+                                      args.rounds, args.batch) / args.batch
+        finally:
+            stop.set()
+            drainer.join()
+            for client in server.clients.values():
+                client.close()
+            for _, theirs in pairs:
+                theirs.close()
+
+        print(f"{size:>6} {old * 1e6:>15.1f} {once * 1e6:>13.1f} {batched * 1e6:>13.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# bench_client.py
+"""Benchmark: inbound messages per second a client can decode and draw.
+
+A thread plays the server over a socket pair, sending a burst of binary
+chat frames as fast as the client reads them, so the client is the
+bottleneck. The old receive loop (three prints per message) is compared
+with the Renderer drawing each message at once and in frame-limited
+batches. Output goes to a pipe drained by 'cat', line buffered like a
+terminal; '--sink terminal' draws on the real one instead.
+
+Usage: python bench_client.py [--count 50000] [--fps 30 60] [--sink pipe]
+"""
+import argparse
+import io
+import socket
+import subprocess
+import sys
+import threading
+import time
+from client import ChatClient
+from models import Message
+from protocol import FRAMING_BINARY, add_definitions
+from render import Renderer
+from utils import format_message
+
+class PrintEach:
+    """The receive loop's drawing before the Renderer: clear, print, re-echo the prompt"""
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.lines = 0
+        self.dropped = 0
+        self.frames = 0
+
+    def add(self, msg):
+        print('\r' + ' ' * (len(self.prompt() or '') + 2), end='\r')
+        print(format_message(msg))
+        if self.prompt() is not None:
+            print(f"> {self.prompt()}", end='', flush=True)
+        self.lines += 1
+        self.frames += 1
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+class BenchClient(ChatClient):
+    def reconnect(self):
+        return False  # The end of the burst is the end of the run
+
+def make_stream(count, size):
+    """Wire bytes of a handshake reply and count chat messages from 50 senders"""
+    frames = [Message('handshake', FRAMING_BINARY, 'Server').to_frame(FRAMING_BINARY)]
+    for i in range(count):
+        msg = Message('chat', 'x' * size, f'user{i % 50}', room='lobby')
+        frames.append(msg.to_frame(FRAMING_BINARY))
+    return b''.join(add_definitions(frames, set()))
+
+def run(make_renderer, stream, count, out):
+    """Receive and draw the whole stream; returns (msgs/sec, CPU us per message, renderer)"""
+    server, sock = socket.socketpair()
+    client = BenchClient()
+    client.connection.sock = sock
+    client.connection.username = 'bench'
+    client.current_input = 'typing a reply'
+    client.renderer = make_renderer(client.prompt_line)
+    sender = threading.Thread(target=lambda: (server.sendall(stream), server.close()))
+
+    saved, sys.stdout = sys.stdout, out
+    try:
+        start = time.perf_counter()
+        cpu = time.process_time()
+        sender.start()
+        client.renderer.start()
+        client.renderer.add(client.connection.finish_login())
+        client.receive_messages()
+        client.renderer.stop()
+        out.flush()
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu
+    finally:
+        sys.stdout = saved
+        sender.join()
+        sock.close()
+    return count / elapsed, cpu / count * 1e6, client.renderer
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=50000)
+    parser.add_argument('--size', type=int, default=60, help='Content bytes per message')
+    parser.add_argument('--fps', type=int, nargs='+', default=[30, 60])
+    parser.add_argument('--scrollback', type=int, default=None, help='Defaults to CLIENT_SCROLLBACK')
+    parser.add_argument('--sink', choices=['pipe', 'terminal'], default='pipe')
+    args = parser.parse_args()
+
+    stream = make_stream(args.count, args.size)
+    if args.sink == 'pipe':
+        cat = subprocess.Popen(['cat'], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+        out = io.TextIOWrapper(cat.stdin, line_buffering=True)
+    else:
+        cat, out = None, sys.stdout
+
+    runs = [('print each', PrintEach),
+            ('render at once', lambda prompt: Renderer(fps=0, scrollback=args.scrollback, prompt=prompt))]
+    for fps in args.fps:
+        runs.append((f"render {fps}fps",
+                     lambda prompt, fps=fps: Renderer(fps=fps, scrollback=args.scrollback, prompt=prompt)))
+
+    results = []
+    for name, make_renderer in runs:
+        rate, cpu, renderer = run(make_renderer, stream, args.count, out)
+        results.append(f"{name:>14} {rate:>10.0f} {cpu:>8.2f} "
+                       f"{renderer.frames:>8} {renderer.lines:>8} {renderer.dropped:>8}")
+
+    if cat:
+        out.close()
+        cat.wait()
+    print(f"{args.count} messages of {args.size} bytes, drawn to {args.sink}")
+    print(f"{'':>14} {'msgs/sec':>10} {'cpu us':>8} {'writes':>8} {'drawn':>8} {'skipped':>8}")
+    print('\n'.join(results))
+
+if __name__ == "__main__":
+    main()
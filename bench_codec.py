@@ -0,0 +1,61 @@
+# bench_codec.py
+"""Benchmark: encode/decode cost and size of the JSON and binary message formats.
+
+Encoding starts from a fresh Message each time, so the per-message frame
+cache does not hide the work; decoding turns payloads back into Messages.
+
+Usage: python bench_codec.py [--count 100000] [--content-size 60]
+"""
+import argparse
+import time
+from models import Message
+from protocol import HEADER, SENDERS, encode_binary
+
+def make_messages(count, content_size):
+    messages = []
+    for i in range(count):
+        if i % 10 == 0:
+            messages.append(Message('dm', 'x' * content_size, f'user{i % 50}', f'user{i % 7}'))
+        else:
+            messages.append(Message('chat', 'x' * content_size, f'user{i % 50}', room='lobby'))
+    return messages
+
+def fresh(messages):
+    return [Message(m.type, m.content, m.sender, m.recipient, m.room, m.created) for m in messages]
+
+def time_it(func, items):
+    start = time.perf_counter()
+    results = [func(item) for item in items]
+    return time.perf_counter() - start, results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--content-size', type=int, default=60)
+    args = parser.parse_args()
+
+    messages = make_messages(args.count, args.content_size)
+
+    # The JSON format carries a formatted timestamp, so encoding has to build it
+    json_encode, json_payloads = time_it(lambda m: m.to_json().encode(), fresh(messages))
+    json_decode, _ = time_it(lambda p: Message.from_json(p.decode()), json_payloads)
+
+    binary_encode, binary_payloads = time_it(encode_binary, fresh(messages))
+    # A receiver has already learned every sender id from define frames
+    names = {}
+    for definition in SENDERS.definitions:
+        Message.from_wire(definition[HEADER.size:], names)
+    binary_decode, decoded = time_it(lambda p: Message.from_wire(p, names), binary_payloads)
+    assert decoded[1].sender == messages[1].sender and decoded[0].recipient == messages[0].recipient
+
+    json_size = sum(map(len, json_payloads)) / args.count
+    binary_size = sum(map(len, binary_payloads)) / args.count
+    print(f"{args.count} messages, {args.content_size}-byte content")
+    print(f"{'format':>8} {'encode us':>10} {'decode us':>10} {'bytes/msg':>10}")
+    for name, encode, decode, size in (('json', json_encode, json_decode, json_size),
+                                       ('binary', binary_encode, binary_decode, binary_size)):
+        print(f"{name:>8} {encode / args.count * 1e6:>10.2f} "
+              f"{decode / args.count * 1e6:>10.2f} {size:>10.1f}")
+
+if __name__ == "__main__":
+    main()
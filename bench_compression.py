@@ -0,0 +1,117 @@
+# bench_compression.py
+"""Benchmark: bytes on the wire and CPU cost of deflating large payloads.
+
+Each kind of message is encoded in both framings with and without
+compression, from a fresh Message each time so the frame cache does not
+hide the work. 'stream' is what one deflate stream per connection would
+send (the context carried across frames instead of the preset dictionary),
+for comparison. The broadcast lines compare compressing a frame once for a
+whole room with compressing it again for every recipient.
+
+Usage: python bench_compression.py [--count 5000] [--room 100]
+"""
+import argparse
+import random
+import time
+import zlib
+from config import CONFIG
+from models import Message
+from protocol import FRAMING_BINARY, FRAMING_LENGTH_PREFIX, HEADER, SENDERS, encode_message
+
+WORDS = ("the be to of and a in that have it for not on with he as you do at this but his by "
+         "from they we say her she or an will my one all would there their what so up out if "
+         "about who get which go me when make can like time no just him know take people into "
+         "year your good some could them see other than then now look only come its over think "
+         "also back after use two how our work first well way even new want because any these "
+         "give day most us server message chat room tonight weekend python question answer").split()
+
+def sentence(rng, length):
+    """Chat-like text of about length characters"""
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return ' '.join(words).capitalize() + '.'
+
+def make_messages(kind, count, rng):
+    if kind == 'short chat':
+        return [Message('chat', sentence(rng, 40), f'user{i % 50}', room='lobby') for i in range(count)]
+    if kind == 'long chat':
+        return [Message('chat', sentence(rng, 300), f'user{i % 50}', room='lobby') for i in range(count)]
+    # A 150-token bot reply is roughly 600 characters
+    return [Message('chat', sentence(rng, 600), 'Chatbot', room='lobby') for i in range(count)]
+
+def fresh(messages):
+    return [Message(m.type, m.content, m.sender, m.recipient, m.room, m.created, i + 1)
+            for i, m in enumerate(messages)]
+
+def time_it(func, items):
+    start = time.perf_counter()
+    results = [func(item) for item in items]
+    return time.perf_counter() - start, results
+
+def stream_size(frames):
+    """Bytes one per-connection deflate stream (sync flush per frame) would send"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return sum(len(HEADER.pack(0)) + len(compressor.compress(frame[HEADER.size:]))
+               + len(compressor.flush(zlib.Z_SYNC_FLUSH)) for frame in frames)
+
+def bench_kind(kind, messages, names):
+    count = len(messages)
+    print(f"\n{kind} ({sum(len(m.content) for m in messages) // count} characters)")
+    print(f"{'framing':>8} {'deflate':>8} {'encode us':>10} {'decode us':>10} {'bytes/msg':>10} {'stream':>8}")
+    for framing in (FRAMING_LENGTH_PREFIX, FRAMING_BINARY):
+        for compress in (False, True):
+            encode, frames = time_it(lambda m: encode_message(m, framing, compress), fresh(messages))
+            decode, decoded = time_it(lambda f: Message.from_wire(f[HEADER.size:], names), frames)
+            assert decoded[-1].content == messages[-1].content
+            stream = f"{stream_size(frames) / count:>8.1f}" if not compress else f"{'':>8}"
+            print(f"{framing:>8} {'on' if compress else 'off':>8} {encode / count * 1e6:>10.2f} "
+                  f"{decode / count * 1e6:>10.2f} {sum(map(len, frames)) / count:>10.1f} {stream}")
+
+def bench_broadcast(messages, room):
+    """CPU to produce frames for a room: compress once and share, or once per recipient"""
+    once = per_recipient = 0.0
+    for message in fresh(messages):
+        start = time.perf_counter()
+        for _ in range(room):
+            message.to_frame(FRAMING_BINARY, True)
+        once += time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(room):
+            encode_message(message, FRAMING_BINARY, True)
+        per_recipient += time.perf_counter() - start
+    count = len(messages)
+    print(f"\nBroadcasting bot replies to {room} clients (binary, deflate on)")
+    print(f"  compressed once:          {once / count * 1e6:10.1f} us per broadcast")
+    print(f"  compressed per recipient: {per_recipient / count * 1e6:10.1f} us per broadcast")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=5000)
+    parser.add_argument('--room', type=int, default=100, help='Recipients per broadcast')
+    parser.add_argument('--threshold', type=int, default=CONFIG['COMPRESSION_THRESHOLD'])
+    args = parser.parse_args()
+    CONFIG['COMPRESSION_THRESHOLD'] = args.threshold
+
+    rng = random.Random(1)
+    corpus = {kind: make_messages(kind, args.count, rng)
+              for kind in ('short chat', 'long chat', 'bot reply')}
+    # A receiver has already learned every sender id from define frames
+    for messages in corpus.values():
+        encode_message(messages[0], FRAMING_BINARY)
+        for message in messages:
+            SENDERS.id_for(message.sender)
+    names = {}
+    for definition in SENDERS.definitions:
+        Message.from_wire(definition[HEADER.size:], names)
+
+    print(f"{args.count} messages per kind, compression threshold {args.threshold} bytes")
+    for kind, messages in corpus.items():
+        bench_kind(kind, messages, names)
+    bench_broadcast(corpus['bot reply'][:max(1, args.count // 10)], args.room)
+
+if __name__ == "__main__":
+    main()
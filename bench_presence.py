@@ -0,0 +1,140 @@
+# bench_presence.py
+"""Benchmark: a reconnect storm against the batched presence notices.
+
+Connects --users clients, then drops and reconnects all of them at once,
+as after a network blip (sessions are off, so every drop is a real leave
+and every reconnect a real join). Reports what the storm cost the clients
+in messages and bytes, and the server in CPU time, for each
+PRESENCE_INTERVAL given. A tiny interval is close to sending one notice
+per join or leave. One observer stays connected throughout and compares
+a full '/users' reply with the delta it gets after the storm.
+
+Usage: python bench_presence.py [--users 3000] [--intervals 0.5 0.001] [--mode asyncio]
+"""
+import argparse
+import asyncio
+import os
+import time
+from config import CONFIG, find_available_port
+from connection import ChatConnection
+from models import Message
+from protocol import FRAMING_BINARY
+from spawn import spawn_server
+
+class StormUser:
+    def __init__(self, username, totals):
+        self.username = username
+        self.totals = totals  # Shared {'messages': n, 'bytes': n}
+        self.connection = None
+        self.reader = None
+        self.writer = None
+        self.task = None
+        self.replies = asyncio.Queue()  # Command replies, for the observer
+        self.welcomed = asyncio.Event()
+
+    async def connect(self, port):
+        self.connection = ChatConnection((FRAMING_BINARY,), compression=False)
+        self.welcomed.clear()
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', port)
+        self.writer.write(self.connection.handshake(self.username))
+        self.task = asyncio.create_task(self.receive())
+
+    async def receive(self):
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    return
+                self.totals['bytes'] += len(data)
+                for msg in self.connection.feed(data):
+                    self.totals['messages'] += 1
+                    if msg.type == 'status' and msg.content.startswith('Welcome'):
+                        self.welcomed.set()
+                    elif msg.type == 'command':
+                        self.replies.put_nowait(len(data))
+                if self.connection.replies:
+                    self.writer.write(self.connection.data_to_send())
+        except (ConnectionError, OSError):
+            pass
+
+    async def users(self):
+        """Send '/users' (a delta once we hold a roster token); returns the size of the read holding the reply"""
+        command = f"users {self.connection.roster_token}" if self.connection.roster_token else 'users'
+        self.writer.write(self.connection.encode(Message('command', command, self.username)))
+        return await asyncio.wait_for(self.replies.get(), 10)
+
+    async def close(self):
+        self.writer.close()
+        self.task.cancel()
+
+async def connect_all(users, port, concurrency, timeout):
+    """Connect everyone, at most concurrency logins in flight; returns how many were welcomed"""
+    semaphore = asyncio.Semaphore(concurrency)
+    async def connect(user):
+        async with semaphore:
+            await user.connect(port)
+            try:
+                await asyncio.wait_for(user.welcomed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+    await asyncio.gather(*(connect(user) for user in users))
+    return sum(user.welcomed.is_set() for user in users)
+
+def cpu_seconds(pid):
+    """User plus system CPU time a process has used"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+async def storm(args, interval):
+    port = find_available_port()
+    proc = spawn_server(SERVER_MODE=args.mode, SERVER_PORT=port, MAX_CONNECTIONS=8192,
+                        SESSION_TTL=None, PRESENCE_INTERVAL=interval)
+    try:
+        await asyncio.sleep(1.0)
+        totals = {'messages': 0, 'bytes': 0}
+        observer = StormUser('observer', {'messages': 0, 'bytes': 0})
+        await observer.connect(port)
+        users = [StormUser(f"storm{i}", totals) for i in range(args.users)]
+        await connect_all(users, port, args.concurrency, args.timeout)
+        await asyncio.sleep(args.settle + 2 * interval)
+        full_size = await observer.users()
+
+        totals['messages'] = totals['bytes'] = 0
+        cpu = cpu_seconds(proc.pid)
+        started = time.perf_counter()
+        for user in users:
+            await user.close()
+        welcomed = await connect_all(users, port, args.concurrency, args.timeout)
+        reconnected = time.perf_counter() - started
+        await asyncio.sleep(args.settle + 2 * interval)
+        cpu = cpu_seconds(proc.pid) - cpu
+        delta_size = await observer.users()
+
+        print(f"interval {interval:>6}s: {welcomed}/{args.users} back in {reconnected:.2f}s, "
+              f"{totals['messages'] / args.users:8.1f} msgs and {totals['bytes'] / args.users / 1024:8.1f} KB "
+              f"per user, server CPU {cpu:.2f}s")
+        print(f"{'':>17}/users: {full_size} bytes in full, {delta_size} bytes as a delta after the storm")
+        for user in users + [observer]:
+            await user.close()
+    finally:
+        proc.terminate()
+        proc.wait()
+
+async def main_async(args):
+    print(f"{args.users} users, {args.mode} server")
+    for interval in args.intervals:
+        await storm(args, interval)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=3000)
+    parser.add_argument('--intervals', type=float, nargs='+', default=[CONFIG['PRESENCE_INTERVAL'], 0.001])
+    parser.add_argument('--mode', choices=['threaded', 'asyncio'], default='asyncio')
+    parser.add_argument('--concurrency', type=int, default=200, help='Connects in flight at once')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Seconds to wait for each welcome')
+    parser.add_argument('--settle', type=float, default=1.0, help='Seconds to let notices drain')
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
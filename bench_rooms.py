@@ -0,0 +1,58 @@
+# bench_rooms.py
+"""Benchmark: per-message fan-out cost with many small rooms as total users grow.
+
+Clients are registered without sockets or writers, so the numbers isolate
+the broadcast path itself: picking recipients, encoding and queueing.
+
+Usage: python bench_rooms.py [--users 100 1000 5000] [--room-size 10]
+"""
+import argparse
+import time
+from config import CONFIG
+from models import Client, Message
+from protocol import FRAMING_LENGTH_PREFIX
+from server import ChatServer
+
+def populate(server, users, room_size):
+    for i in range(users):
+        client = Client(None, None, f"user{i}", FRAMING_LENGTH_PREFIX)
+        server.clients.add(client)
+        server.rooms.join(client, f"room{i // room_size}")
+
+def time_broadcasts(server, rooms, rounds, single_room):
+    start = time.perf_counter()
+    for i in range(rounds):
+        room = f"room{i % rooms}"
+        message = Message('chat', f'benchmark line {i}', 'bench', room=room)
+        server.broadcast_message(message, room=None if single_room else room)
+    elapsed = (time.perf_counter() - start) / rounds
+
+    # Throw the queued frames away between runs
+    for client in server.clients.values():
+        client.outbox.frames.clear()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--room-size', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=500)
+    args = parser.parse_args()
+
+    CONFIG['OUTBOX_SIZE'] = args.rounds
+    CONFIG['CHATBOT_BACKEND'] = None
+    CONFIG['HISTORY_FILE'] = None
+    CONFIG['METRICS_PORT'] = None
+
+    print(f"{'users':>6} {'rooms':>6} {'one global room':>16} {'per-room':>10}  (usec per message)")
+    for users in args.users:
+        server = ChatServer()
+        populate(server, users, args.room_size)
+        rooms = -(-users // args.room_size)
+
+        global_room = time_broadcasts(server, rooms, args.rounds, single_room=True)
+        per_room = time_broadcasts(server, rooms, args.rounds, single_room=False)
+        print(f"{users:>6} {rooms:>6} {global_room * 1e6:>16.1f} {per_room * 1e6:>10.1f}")
+
+if __name__ == "__main__":
+    main()
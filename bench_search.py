@@ -0,0 +1,145 @@
+# bench_search.py
+"""Benchmark: searching the server log through the index versus rescanning it.
+
+Writes a synthetic chat.log in the server's log format (chat lines from
+--users senders, connects, disconnects, warnings, the odd multi-line
+message), indexes it, then answers word, sender, level and time-range
+queries both ways: through LogIndex, and by reading the whole log as an
+operator's grep would. Every answer is checked against the scan. It then
+appends to the log, rotates it, and checks the incremental update picks
+up exactly the new lines. Exit status 1 if any answer differs.
+
+Usage: python bench_search.py [--lines 200000] [--users 500] [--limit 50]
+"""
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from logsearch import LineParser, LogIndex, parse_query
+
+VOCABULARY = ('hello there anyone around tonight spam buy cheap pills click link '
+              'meeting lunch deploy server broken fixed thanks lol ok sure great '
+              'weather football match score release notes bug report crash').split()
+
+def write_log(path, lines, users, start, mode='w'):
+    """Write lines log records, one a second from start; returns the time after the last and the lines written"""
+    rng = random.Random(start)
+    with open(path, mode) as f:
+        when = start
+        written = f.tell()
+        for _ in range(lines):
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when)) + f",{rng.randrange(1000):03d}"
+            user = f"user{int(rng.paretovariate(1.2)) % users}"
+            roll = rng.random()
+            if roll < 0.85:
+                text = ' '.join(rng.choices(VOCABULARY, k=rng.randint(2, 12)))
+                if roll < 0.01:
+                    text += '\n' + ' '.join(rng.choices(VOCABULARY, k=3))  # A message with a newline in it
+                f.write(f"{stamp} - INFO - Message from {user}: {text}\n")
+            elif roll < 0.92:
+                f.write(f"{stamp} - INFO - Client connected: {user} from ('127.0.0.1', {rng.randrange(65536)})\n")
+            elif roll < 0.99:
+                f.write(f"{stamp} - INFO - Client disconnected: {user}\n")
+            else:
+                f.write(f"{stamp} - WARNING - No heartbeat from {user} for 91s\n")
+            when += 1
+    with open(path, 'rb') as f:
+        f.seek(written)
+        return when, f.read().count(b'\n')
+
+def scan(paths, query, limit):
+    """Answer a query by reading every log line, as grep would"""
+    keys, since, until = parse_query(query)
+    keys = {key.decode() for key in keys}
+    parser = LineParser()
+    found = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            for line in f:
+                line = line.rstrip(b'\n').decode('utf-8', 'replace')
+                when, line_keys = parser.parse(line)
+                if keys <= line_keys and (since is None or when >= since) and (until is None or when < until):
+                    found.append(line)
+    return found[-limit:]
+
+def grep(word, paths):
+    # Into a pipe: GNU grep writing to /dev/null stops at the first match
+    subprocess.run(['grep', '-h', '--', word] + paths, stdout=subprocess.PIPE)
+
+def timed(function, *args, repeat=1):
+    """Result of the last call and the fastest call's time in ms"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def compare(index, paths, queries, limit, repeat):
+    ok = True
+    print(f"{'query':>44} {'matches':>8} {'index ms':>9} {'scan ms':>9} {'grep ms':>9}")
+    for query in queries:
+        expected, scan_ms = timed(scan, paths, query, limit)
+        found, index_ms = timed(index.search, query, limit, repeat=repeat)
+        # grep finds the first word only, and cannot do senders or times at all
+        plain = [token for token in query.split() if ':' not in token]
+        grep_ms = timed(grep, plain[0], paths)[1] if plain else float('nan')
+        status = '' if found == expected else '  MISMATCH'
+        ok = ok and found == expected
+        print(f"{query:>44} {len(found):>8} {index_ms:>9.3f} {scan_ms:>9.1f} {grep_ms:>9.1f}{status}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20, help='Index lookups per query; the fastest counts')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        log = os.path.join(directory, 'chat.log')
+        start = int(time.mktime((2024, 10, 28, 12, 0, 0, 0, 0, -1)))
+        end, _ = write_log(log, args.lines, args.users, start)
+        print(f"{args.lines} log lines, {os.path.getsize(log) / 1048576:.1f} MB")
+
+        index = LogIndex(os.path.join(directory, 'index'), log)
+        added, build_ms = timed(index.update)
+        segments = len(index.snapshot().segments)
+        print(f"initial index: {added} lines in {build_ms:.0f} ms, {segments} segments")
+
+        middle = time.strftime('%Y-%m-%dT%H:%M', time.localtime((start + end) // 2))
+        queries = ['spam pills', 'from:user3', 'from:user3 click link', 'level:warning',
+                   'crash', 'release notes bug', f'since:{middle}', f'crash until:{middle}',
+                   f'from:user1 since:{middle} until:{middle}', 'nosuchword', 'from:user7 lol']
+        ok = compare(index, [log], queries, args.limit, args.repeat)
+
+        # The server keeps writing: append, then rotate as RotatingFileHandler does
+        end, written = write_log(log, 1000, args.users, end, 'a')
+        added, update_ms = timed(index.update)
+        ok = ok and added == written
+        print(f"after 1000 more records: +{added}/{written} lines in {update_ms:.1f} ms")
+        end, written = write_log(log, 500, args.users, end, 'a')
+        os.rename(log, log + '.1')
+        end, more = write_log(log, 500, args.users, end)
+        written += more
+        added, update_ms = timed(index.update)
+        ok = ok and added == written
+        segments = len(index.snapshot().segments)
+        print(f"after 500 more, a rotation and 500 in the new file: +{added}/{written} lines "
+              f"in {update_ms:.1f} ms, {segments} segments")
+        ok = compare(index, [log + '.1', log], queries[:6], args.limit, args.repeat) and ok
+    finally:
+        shutil.rmtree(directory)
+
+    print("PASS: every answer matches a full scan" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
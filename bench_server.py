@@ -0,0 +1,96 @@
+# bench_server.py
+"""Load benchmark: connections held and messages/sec for each server mode.
+
+Usage: python bench_server.py [--users 500] [--senders 20] [--duration 10]
+"""
+import argparse
+import asyncio
+import time
+from config import find_available_port
+from protocol import FRAMING_LENGTH_PREFIX, encode_frame
+from spawn import spawn_server
+
+async def open_user(port, username):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f"{username} {FRAMING_LENGTH_PREFIX}".encode())
+    await writer.drain()
+    await reader.read(2048)  # handshake ack and welcome
+    return reader, writer
+
+async def count_deliveries(reader, counter):
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            break
+        # Count envelopes rather than reads, since TCP may coalesce frames
+        counter[0] += data.count(b'"timestamp"')
+
+async def send_chat(writer, username, interval, deadline):
+    sent = 0
+    while time.perf_counter() < deadline:
+        payload = '{"type": "chat", "content": "load test", "sender": "%s"}' % username
+        writer.write(encode_frame(payload.encode()))
+        await writer.drain()
+        sent += 1
+        await asyncio.sleep(interval)
+    return sent
+
+async def run_load(port, users, senders, duration, interval, prefix="user"):
+    connections = []
+    for i in range(users):
+        try:
+            connections.append(await open_user(port, f"{prefix}{i}"))
+        except OSError:
+            break
+    held = len(connections)
+
+    counter = [0]
+    readers = [asyncio.create_task(count_deliveries(reader, counter))
+               for reader, _ in connections]
+    await asyncio.sleep(0.5)  # let join broadcasts settle
+    counter[0] = 0
+
+    start = time.perf_counter()
+    deadline = start + duration
+    sent = await asyncio.gather(*[
+        send_chat(writer, f"{prefix}{i}", interval, deadline)
+        for i, (_, writer) in enumerate(connections[:senders])
+    ])
+    await asyncio.sleep(1.0)  # drain in-flight fan-out
+    elapsed = time.perf_counter() - start
+
+    for task in readers:
+        task.cancel()
+    for _, writer in connections:
+        writer.close()
+    return held, sum(sent) / elapsed, counter[0] / elapsed
+
+def bench_mode(mode, args):
+    port = find_available_port()
+    proc = spawn_server(SERVER_MODE=mode, SERVER_PORT=port)
+    try:
+        time.sleep(1.0)
+        held, sent_rate, delivered_rate = asyncio.run(
+            run_load(port, args.users, args.senders, args.duration, args.interval)
+        )
+    finally:
+        proc.terminate()
+        proc.wait()
+    print(f"{mode:>8}: held {held:5d}/{args.users} connections, "
+          f"{sent_rate:9.1f} msgs/sec in, {delivered_rate:11.1f} msgs/sec delivered")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--senders', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--interval', type=float, default=0.01,
+                        help='Pause between messages from each sender')
+    parser.add_argument('--modes', nargs='+', default=['threaded', 'asyncio'])
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        bench_mode(mode, args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# bench_transport.py
+"""Transport benchmark: connect rate and chat throughput over TCP, TLS and Unix sockets.
+
+A throwaway self-signed certificate is made with the openssl command line
+tool. TLS connects are measured twice: with a fresh client each time (full
+handshake) and with one client reusing its session (resumed handshake).
+
+Usage: python bench_transport.py [--connects 200] [--messages 20000] [--mode asyncio]
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from config import CONFIG, find_available_port
+from connection import ChatConnection
+from protocol import FRAMING_BINARY
+from spawn import spawn_server
+from transport import create_transport
+
+def make_certificate(openssl, directory):
+    """Self-signed certificate for 127.0.0.1 and localhost; returns (cert, key) paths"""
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run([
+        openssl, 'req', '-x509', '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+        '-nodes', '-days', '1', '-subj', '/CN=localhost',
+        '-addext', 'subjectAltName=IP:127.0.0.1,DNS:localhost',
+        '-keyout', key, '-out', cert
+    ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert, key
+
+def connect_rate(port, count, prefix, shared_transport=None):
+    """Connects (transport handshake plus chat login) per second, and how many resumed TLS"""
+    resumed = 0
+    start = time.perf_counter()
+    for i in range(count):
+        connection = ChatConnection(transport=shared_transport)
+        connection.connect('127.0.0.1', port)
+        connection.login(f"{prefix}{i}")
+        resumed += bool(getattr(connection.sock, 'session_reused', False))
+        connection.close()
+    return count / (time.perf_counter() - start), resumed
+
+def throughput(port, messages, size):
+    """One sender to one receiver as fast as the server relays; returns (msgs/sec, MB/sec)"""
+    receiver = ChatConnection((FRAMING_BINARY,))
+    receiver.connect('127.0.0.1', port)
+    receiver.login('receiver')
+    sender = ChatConnection((FRAMING_BINARY,))
+    sender.connect('127.0.0.1', port)
+    sender.login('sender')
+    time.sleep(0.3)  # Join notices
+
+    done = threading.Event()
+    def receive():
+        received = 0
+        while received < messages:
+            msg = receiver.next_message()
+            if msg is None:
+                break
+            if msg.sender == 'sender':
+                received += 1
+        done.set()
+    threading.Thread(target=receive, daemon=True).start()
+
+    text = 'x' * size
+    start = time.perf_counter()
+    for _ in range(messages):
+        sender.chat(text)
+    done.wait(60)
+    elapsed = time.perf_counter() - start
+    sender.close()
+    receiver.close()
+    return messages / elapsed, messages * size / elapsed / 1e6
+
+def bench_transport(name, args, cert, key, unix_path):
+    port = find_available_port()
+    # Sessions would cost more than the transport too
+    proc = spawn_server(SERVER_MODE=args.mode, SERVER_PORT=port, SESSION_TTL=None,
+                        OUTBOX_SIZE=args.messages + 100, TRANSPORT=name, TLS_CERT_FILE=cert,
+                        TLS_KEY_FILE=key, UNIX_SOCKET_PATH=unix_path)
+    try:
+        time.sleep(1.0)
+        CONFIG['TRANSPORT'] = name
+        rate, _ = connect_rate(port, args.connects, 'full')
+        line = f"{name:>5}: {rate:8.1f} connects/sec"
+        if name == 'tls':
+            rate, resumed = connect_rate(port, args.connects, 'resumed', create_transport())
+            line += f" ({rate:.1f}/sec resumed, {resumed}/{args.connects} reused the session)"
+        msg_rate, mb_rate = throughput(port, args.messages, args.size)
+        print(f"{line}\n       {msg_rate:8.1f} msgs/sec, {mb_rate:6.2f} MB/sec of content")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--connects', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--size', type=int, default=200, help='Content bytes per message')
+    parser.add_argument('--mode', choices=['threaded', 'asyncio'], default='asyncio')
+    parser.add_argument('--transports', nargs='+', default=['tcp', 'tls', 'unix'])
+    parser.add_argument('--openssl', default=shutil.which('openssl'),
+                        help='openssl binary used to make the test certificate')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = make_certificate(args.openssl, directory)
+        # The benchmark clients trust only the throwaway certificate
+        CONFIG['TLS_CA_FILE'] = cert
+        CONFIG['UNIX_SOCKET_PATH'] = os.path.join(directory, 'chat.sock')
+        print(f"{args.mode} server, {args.size}-byte messages")
+        for name in args.transports:
+            bench_transport(name, args, cert, key, CONFIG['UNIX_SOCKET_PATH'])
+
+if __name__ == "__main__":
+    main()
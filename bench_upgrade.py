@@ -0,0 +1,155 @@
+# bench_upgrade.py
+"""Benchmark: hot upgrades under load, checking that no client notices.
+
+Starts a server with UPGRADE_SOCKET set, connects --users clients that
+chat steadily, and replaces the server with 'server.py --upgrade' style
+successors --restarts times while they do. Every client stays connected
+throughout, and every chat line must reach every other client exactly
+once; the run fails (exit status 1) if a connection drops or a message
+is lost. Reports how long each handover took and the worst delivery
+latency around it.
+
+Usage: python bench_upgrade.py [--users 100] [--rate 2] [--restarts 3] [--mode threaded]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from config import find_available_port
+from connection import ChatConnection
+from models import Message
+from protocol import FRAMING_BINARY
+from spawn import spawn_server
+
+class LoadUser:
+    def __init__(self, username, stats):
+        self.username = username
+        self.stats = stats  # Shared counters and latencies
+        self.connection = ChatConnection((FRAMING_BINARY,))
+        self.reader = None
+        self.writer = None
+        self.task = None
+        self.welcomed = asyncio.Event()
+        self.sent = 0
+
+    async def connect(self, port):
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', port)
+        self.writer.write(self.connection.handshake(self.username))
+        self.task = asyncio.create_task(self.receive())
+        await asyncio.wait_for(self.welcomed.wait(), 30)
+
+    async def receive(self):
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                for msg in self.connection.feed(data):
+                    if msg.type == 'status' and msg.content.startswith('Welcome'):
+                        self.welcomed.set()
+                    elif msg.type == 'chat' and msg.sender.startswith('load'):
+                        self.stats['received'] += 1
+                        self.stats['latencies'].append(time.perf_counter() - float(msg.content.split()[1]))
+                if self.connection.replies:
+                    self.writer.write(self.connection.data_to_send())
+        except (ConnectionError, OSError):
+            pass
+        if not self.stats['stopping']:
+            self.stats['dropped'] += 1
+
+    def chat(self):
+        self.sent += 1
+        text = f"{self.sent} {time.perf_counter():.6f}"
+        self.writer.write(self.connection.encode(Message('chat', text, self.username)))
+
+    async def close(self):
+        self.writer.close()
+        await asyncio.gather(self.task, return_exceptions=True)
+
+def start_server(args, port, upgrade_socket, log, take_over=False):
+    return spawn_server(take_over, log, SERVER_MODE=args.mode, SERVER_PORT=port,
+                        PORT_FALLBACK=False, UPGRADE_SOCKET=upgrade_socket)
+
+async def chat_load(users, rate, stop):
+    """Each user chats rate times a second, spread out, until stop is set"""
+    interval = 1.0 / rate
+    while not stop.is_set():
+        started = time.perf_counter()
+        for user in users:
+            user.chat()
+            await asyncio.sleep(interval / len(users))
+        await asyncio.sleep(max(interval - (time.perf_counter() - started), 0))
+
+def window_max(latencies, start, end):
+    return max(latencies[start:end], default=0.0)
+
+async def main_async(args, directory):
+    port = find_available_port()
+    upgrade_socket = os.path.join(directory, 'upgrade.sock')
+    log = open(os.path.join(directory, 'server.log'), 'w')
+    stats = {'received': 0, 'dropped': 0, 'stopping': False, 'latencies': []}
+    server = start_server(args, port, upgrade_socket, log)
+    try:
+        await asyncio.sleep(1.0)
+        users = [LoadUser(f"load{i}", stats) for i in range(args.users)]
+        await asyncio.gather(*(user.connect(port) for user in users))
+        print(f"{args.users} users on a {args.mode} server, {args.rate} chat lines/sec each")
+
+        stop = asyncio.Event()
+        load = asyncio.create_task(chat_load(users, args.rate, stop))
+        await asyncio.sleep(args.interval)
+        steady = window_max(stats['latencies'], 0, len(stats['latencies']))
+        print(f"  worst latency before any restart: {steady * 1000:.1f} ms")
+        for restart in range(1, args.restarts + 1):
+            before = len(stats['latencies'])
+            started = time.perf_counter()
+            successor = start_server(args, port, upgrade_socket, log, take_over=True)
+            # The old process exits once the successor has taken everything over
+            while server.poll() is None:
+                await asyncio.sleep(0.01)
+            handover = time.perf_counter() - started
+            status, server = server.returncode, successor
+            await asyncio.sleep(args.interval)
+            worst = window_max(stats['latencies'], before, len(stats['latencies']))
+            print(f"  restart {restart}: old process gone {handover * 1000:.0f} ms after the new one started "
+                  f"(exit status {status}), "
+                  f"worst latency around it {worst * 1000:.1f} ms, dropped so far {stats['dropped']}")
+        stop.set()
+        await load
+        await asyncio.sleep(args.settle)
+
+        sent = sum(user.sent for user in users)
+        expected = sent * (args.users - 1)
+        stats['stopping'] = True
+        for user in users:
+            await user.close()
+        print(f"  {sent} chat lines sent, {stats['received']}/{expected} deliveries received, "
+              f"{stats['dropped']} connections dropped")
+        return stats['dropped'] == 0 and stats['received'] == expected
+    finally:
+        server.terminate()
+        server.wait()
+        log.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=2.0, help='Chat lines per second per user')
+    parser.add_argument('--restarts', type=int, default=3)
+    parser.add_argument('--interval', type=float, default=2.0, help='Seconds of load between restarts')
+    parser.add_argument('--settle', type=float, default=2.0, help='Seconds to let the last deliveries arrive')
+    parser.add_argument('--mode', choices=['threaded', 'asyncio'], default='threaded')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        ok = asyncio.run(main_async(args, directory))
+        if not ok:
+            with open(os.path.join(directory, 'server.log')) as f:
+                print(f.read()[-3000:])
+    print("PASS: no connection dropped, no message lost" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
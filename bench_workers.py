@@ -0,0 +1,63 @@
+# bench_workers.py
+"""Benchmark: message throughput as the number of server worker processes grows.
+
+Load comes from several client processes so the generator is not the
+bottleneck. Scaling needs at least as many free cores as workers plus
+load generators; on fewer cores the extra workers only add bus traffic.
+
+Usage: python bench_workers.py [--workers 1 2 4] [--users 400] [--loadgens 4]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import time
+from bench_server import run_load
+from config import find_available_port
+from spawn import spawn_server
+
+def generate_load(job):
+    port, index, args = job
+    return asyncio.run(run_load(port, args.users // args.loadgens,
+                                args.senders // args.loadgens, args.duration,
+                                args.interval, prefix=f"load{index}-"))
+
+def bench_workers(workers, args):
+    port = find_available_port()
+    proc = spawn_server(SERVER_MODE=args.mode, SERVER_PORT=port, SERVER_WORKERS=workers)
+    try:
+        time.sleep(1.0 + 0.5 * workers)
+        with multiprocessing.Pool(args.loadgens) as pool:
+            results = pool.map(generate_load, [(port, i, args) for i in range(args.loadgens)])
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    held = sum(result[0] for result in results)
+    sent_rate = sum(result[1] for result in results)
+    delivered_rate = sum(result[2] for result in results)
+    return held, sent_rate, delivered_rate
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--users', type=int, default=400)
+    parser.add_argument('--senders', type=int, default=40)
+    parser.add_argument('--loadgens', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--interval', type=float, default=0.005,
+                        help='Pause between messages from each sender')
+    parser.add_argument('--mode', default='asyncio', choices=['threaded', 'asyncio'])
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, {args.mode} workers")
+    baseline = None
+    for workers in args.workers:
+        held, sent_rate, delivered_rate = bench_workers(workers, args)
+        baseline = baseline or delivered_rate
+        print(f"{workers:>3} workers: held {held:5d} connections, "
+              f"{sent_rate:9.1f} msgs/sec in, {delivered_rate:11.1f} msgs/sec delivered "
+              f"({delivered_rate / baseline:.2f}x)")
+
+if __name__ == "__main__":
+    main()
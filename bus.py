@@ -0,0 +1,156 @@
+# bus.py
+import json
+import queue
+import socket
+import threading
+from config import CONFIG
+from protocol import FrameDecoder, encode_frame
+from utils import log_message
+
+WRITE_BATCH = 256  # Most queued events sent to a peer in one sendall
+
+class WorkerBus:
+    """Relays events between worker processes over a full mesh of Unix sockets.
+
+    Every pair of workers shares one socketpair, so an event reaches each
+    peer in a single hop. Events are length-prefixed JSON. Presence
+    (which users are connected to other workers, and in which room) is
+    tracked here and then, like all other events, passed to on_event(event)
+    on the reader thread for that peer.
+
+    Sending never blocks the publisher: each peer has a bounded queue
+    drained by its own writer thread, so a stalled worker only fills its
+    own queue, and BUS_OVERFLOW_POLICY decides what happens then.
+    """
+    def __init__(self, index, peers, on_event):
+        self.index = index
+        self.peers = peers  # worker index -> connected Unix socket
+        self.queues = {worker: queue.Queue(maxsize=CONFIG['BUS_QUEUE_SIZE']) for worker in peers}
+        self.overflowing = set()  # Peers whose queue filled up since it last drained
+        self.on_event = on_event
+        self.lock = threading.Lock()
+        self.presence = {}  # username -> (worker index, room) for users on other workers
+        self.relayed = 0
+        self.received = 0
+        self.dropped = 0
+
+    def start(self):
+        for worker, sock in self.peers.items():
+            threading.Thread(target=self.read_peer, args=(worker, sock), daemon=True,
+                             name=f"bus-{worker}").start()
+            threading.Thread(target=self.write_peer, args=(worker, sock), daemon=True,
+                             name=f"bus-writer-{worker}").start()
+
+    def publish(self, event, worker=None):
+        """Queue event for one worker, or for every peer when worker is None"""
+        frame = encode_frame(json.dumps(event).encode())
+        targets = list(self.queues) if worker is None else (worker,)
+        for target in targets:
+            events = self.queues.get(target)
+            if events is None:
+                continue
+            try:
+                events.put_nowait(frame)
+            except queue.Full:
+                self.overflow(target)
+
+    def overflow(self, worker):
+        """A peer is not keeping up: drop the event, or cut the peer off the bus"""
+        self.dropped += 1
+        if CONFIG['BUS_OVERFLOW_POLICY'] == 'disconnect':
+            log_message(f"Worker {worker} is not reading bus events; disconnecting it", 'warning')
+            self.disconnect_peer(worker)
+        elif worker not in self.overflowing:
+            self.overflowing.add(worker)
+            log_message(f"Worker {worker} is not reading bus events; dropping them until it catches up",
+                        'warning')
+
+    def disconnect_peer(self, worker):
+        """Stop sending to a peer; both readers see the connection end and forget its users"""
+        events = self.queues.pop(worker, None)
+        if events is None:
+            return
+        with events.mutex:
+            events.queue.clear()
+        events.put_nowait(None)  # Wakes the writer to exit
+        try:
+            self.peers[worker].shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def write_peer(self, worker, sock):
+        """Send one peer's queued events, as many as are waiting in one sendall"""
+        events = self.queues.get(worker)
+        if events is None:
+            return
+        try:
+            while True:
+                frames = [events.get()]
+                while len(frames) < WRITE_BATCH:
+                    try:
+                        frames.append(events.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in frames:
+                    break
+                sock.sendall(b''.join(frames))
+                self.relayed += len(frames)
+                if events.empty():
+                    self.overflowing.discard(worker)
+        except OSError:
+            pass
+
+    def read_peer(self, worker, sock):
+        decoder = FrameDecoder()
+        try:
+            while True:
+                frames = decoder.read_from(sock)
+                if frames is None:
+                    break
+                for frame in frames:
+                    self.received += 1
+                    event = json.loads(frame)
+                    if event['op'] == 'presence':
+                        self.update_presence(worker, event['username'], event['room'])
+                    self.on_event(event)
+        except (OSError, ValueError) as e:
+            log_message(f"Bus connection to worker {worker} failed: {e}", 'error')
+
+        # A worker that went away takes its users with it
+        log_message(f"Worker {worker} left the bus", 'warning')
+        with self.lock:
+            gone = [name for name, entry in self.presence.items() if entry[0] == worker]
+            for name in gone:
+                del self.presence[name]
+        for name in gone:
+            self.on_event({'op': 'presence', 'username': name, 'room': None})
+
+    def update_presence(self, worker, username, room):
+        with self.lock:
+            if room is None:
+                self.presence.pop(username, None)
+            else:
+                self.presence[username] = (worker, room)
+
+    def worker_for(self, username):
+        """Index of the worker a remote user is connected to, or None"""
+        entry = self.presence.get(username)
+        return entry[0] if entry else None
+
+    def room_counts(self):
+        counts = {}
+        for worker, room in list(self.presence.values()):
+            counts[room] = counts.get(room, 0) + 1
+        return counts
+
+    def close(self):
+        for worker in list(self.queues):
+            events = self.queues.pop(worker)
+            with events.mutex:
+                events.queue.clear()
+            events.put_nowait(None)
+        for sock in self.peers.values():
+            try:
+                sock.close()
+            except OSError:
+                pass
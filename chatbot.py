@@ -0,0 +1,314 @@
+# chatbot.py
+import importlib.util
+import queue
+import threading
+import time
+from collections import OrderedDict
+from config import CONFIG
+from metrics import METRICS
+from utils import log_message, print_colored
+
+METRICS.histogram('chat_bot_call_seconds', 'Duration of chatbot backend calls (one per batch)')
+
+# Set your OpenAI API key here
+OPENAI_API_KEY = 'YOUR_OPENAI_API_KEY'
+
+class OpenAIBackend:
+    """Completions from the OpenAI API; one request serves a whole batch"""
+    def __init__(self):
+        # The package takes longer to import than the rest of the server takes to start,
+        # so only check it is installed now and import it on the first call
+        if importlib.util.find_spec('openai') is None:
+            raise ImportError("the openai package is not installed")
+        self.openai = None
+
+    def complete(self, prompts, timeout):
+        if self.openai is None:
+            import openai
+            openai.api_key = OPENAI_API_KEY
+            self.openai = openai
+        response = self.openai.Completion.create(
+            engine="text-davinci-003",
+            prompt=prompts,
+            max_tokens=150,
+            request_timeout=timeout
+        )
+        replies = [None] * len(prompts)
+        for choice in response.choices:
+            replies[choice.index] = choice.text.strip()
+        return replies
+
+class StubBackend:
+    """Local backend that needs no network, for testing and benchmarks"""
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def complete(self, prompts, timeout):
+        if self.delay:
+            time.sleep(min(self.delay, timeout))
+        return [f"You said: {prompt}" for prompt in prompts]
+
+BACKENDS = {
+    'openai': OpenAIBackend,
+    'stub': StubBackend
+}
+
+class CircuitBreaker:
+    """Stops calling a failing backend until a cooldown has passed.
+
+    After the cooldown the circuit is half-open: one call goes through as
+    a probe, and only its success closes the circuit; a failure reopens it
+    for another cooldown.
+    """
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False  # A half-open probe call is in progress
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call could go ahead now; takes nothing, so prompts can queue for the probe"""
+        with self.lock:
+            return self.opened_at is None or self.half_open()
+
+    def start_call(self):
+        """Claim the right to call the backend; while half-open only the probe gets it"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if not self.half_open():
+                return False
+            self.probing = True
+            return True
+
+    def half_open(self):
+        # Caller holds the lock
+        return not self.probing and time.monotonic() - self.opened_at >= self.cooldown
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.probing = False
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    log_message("Chatbot circuit opened after repeated failures", 'warning')
+                self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+def normalize_prompt(prompt):
+    """Cache key: case-folded, whitespace collapsed, trailing punctuation trimmed"""
+    key = ' '.join(prompt.casefold().split())
+    return key.rstrip('!?.') or key
+
+class ResponseCache:
+    """LRU cache of bot replies whose entries also expire after a TTL"""
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, reply)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, reply):
+        if self.size <= 0:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, reply)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+class ChatbotPool:
+    """Bounded queue of bot prompts served by a fixed number of worker threads.
+
+    Workers take up to CHATBOT_BATCH_SIZE queued prompts per backend call and
+    hand each reply to on_response(reply, context), so chat handling never
+    waits on the bot.
+    Replies are cached by normalized prompt, and a prompt that is already
+    being answered waits for that reply instead of making another call.
+    """
+    def __init__(self, backend, on_response):
+        self.backend = backend
+        self.on_response = on_response
+        self.requests = queue.Queue(maxsize=CONFIG['CHATBOT_QUEUE_SIZE'])
+        self.batch_size = CONFIG['CHATBOT_BATCH_SIZE']
+        self.timeout = CONFIG['CHATBOT_TIMEOUT']
+        self.breaker = CircuitBreaker(CONFIG['CHATBOT_FAILURE_THRESHOLD'],
+                                      CONFIG['CHATBOT_COOLDOWN'])
+        self.cache = ResponseCache(CONFIG['CHATBOT_CACHE_SIZE'], CONFIG['CHATBOT_CACHE_TTL'])
+        self.in_flight = {}  # normalized prompt -> contexts (rooms) waiting for its reply
+        self.lock = threading.Lock()
+        self.workers = [
+            threading.Thread(target=self.run, daemon=True, name=f"chatbot-{i}")
+            for i in range(CONFIG['CHATBOT_WORKERS'])
+        ]
+
+        # Metrics
+        self.submitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self.failed = 0
+        self.completed = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.coalesced = 0
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, prompt, context=None):
+        """Answer from cache, join an identical in-flight prompt, or queue a new call.
+
+        Returns False if the prompt was rejected because the queue is full or
+        the circuit is open.
+        """
+        key = normalize_prompt(prompt)
+        with self.lock:
+            reply = self.cache.get(key)
+            if reply is None:
+                if key in self.in_flight:
+                    self.in_flight[key].append(context)
+                    self.coalesced += 1
+                    return True
+
+                self.cache_misses += 1
+                if not self.breaker.allow():
+                    self.rejected += 1
+                    return False
+                try:
+                    self.requests.put_nowait((time.monotonic(), key, prompt))
+                except queue.Full:
+                    self.rejected += 1
+                    return False
+                self.in_flight[key] = [context]
+                self.submitted += 1
+                return True
+
+            self.cache_hits += 1
+
+        # Broadcast outside the lock so workers are not held up
+        self.on_response(reply, context)
+        return True
+
+    def next_batch(self):
+        """Block for one request, then take whatever else is already queued"""
+        request = self.requests.get()
+        if request is None:
+            return None
+        batch = [request]
+        while len(batch) < self.batch_size:
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # Keep the stop marker for this worker's next call
+                self.requests.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                break
+
+            # Replies to prompts that waited past the timeout would arrive out of context
+            now = time.monotonic()
+            fresh = [(key, prompt) for queued_at, key, prompt in batch
+                     if now - queued_at < self.timeout]
+            self.expired += len(batch) - len(fresh)
+            self.finish([key for queued_at, key, prompt in batch
+                         if now - queued_at >= self.timeout])
+            if not fresh:
+                continue
+            if not self.breaker.start_call():
+                self.finish([key for key, prompt in fresh])
+                continue
+
+            started = time.perf_counter()
+            try:
+                replies = self.backend.complete([prompt for key, prompt in fresh], self.timeout)
+            except Exception as e:
+                METRICS.observe('chat_bot_call_seconds', time.perf_counter() - started)
+                self.failed += len(fresh)
+                self.finish([key for key, prompt in fresh])
+                self.breaker.record_failure()
+                log_message(f"Error getting chatbot response: {e}", 'error')
+                continue
+
+            METRICS.observe('chat_bot_call_seconds', time.perf_counter() - started)
+            self.breaker.record_success()
+            self.completed += len(fresh)
+            for (key, prompt), reply in zip(fresh, replies):
+                waiters = self.finish([key], reply)
+                if reply:
+                    for context in waiters:
+                        self.on_response(reply, context)
+
+    def finish(self, keys, reply=None):
+        """Release in-flight prompts, caching the reply; returns the waiting contexts"""
+        waiters = []
+        with self.lock:
+            for key in keys:
+                waiters.extend(self.in_flight.pop(key, ()))
+                if reply:
+                    self.cache.put(key, reply)
+        return waiters
+
+    def stop(self):
+        for _ in self.workers:
+            try:
+                self.requests.put_nowait(None)
+            except queue.Full:
+                break
+
+    def stats(self):
+        return {
+            'queued': self.requests.qsize(),
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'expired': self.expired,
+            'failed': self.failed,
+            'completed': self.completed,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'coalesced': self.coalesced,
+            'cache_size': len(self.cache.entries),
+            'circuit_open': self.breaker.is_open
+        }
+
+def create_chatbot_pool(on_response):
+    """Build the pool for CONFIG['CHATBOT_BACKEND'], or None when the bot is disabled"""
+    backend_name = CONFIG['CHATBOT_BACKEND']
+    if not backend_name:
+        return None
+    try:
+        backend = BACKENDS[backend_name]()
+    except ImportError as e:
+        print_colored(f"Chatbot disabled: {e}", "yellow")
+        log_message(f"Chatbot backend {backend_name} unavailable: {e}", 'warning')
+        return None
+    pool = ChatbotPool(backend, on_response)
+    pool.start()
+    return pool
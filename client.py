@@ -1,11 +1,12 @@
 # client.py
-import socket
 import threading
 import json
 import time
 from config import CONFIG, COMMANDS
+from connection import ChatConnection, backoff_delays
 from models import Message
-from utils import format_message, print_colored
+from render import Renderer
+from utils import print_colored
 import sys
 from colorama import init
 
@@ -13,10 +14,15 @@ init()
 
 class ChatClient:
     def __init__(self):
-        self.socket = None
+        self.connection = ChatConnection()  # Socket, framing and codec
         self.username = None
         self.running = True
         self.server_ip = None
+        self.renderer = Renderer(prompt=self.prompt_line)  # Draws incoming messages in batches
+
+    def prompt_line(self):
+        """Input to redraw below incoming messages, or None before the prompt is shown"""
+        return getattr(self, 'current_input', None)
 
     def get_connection_details(self):
         while True:
@@ -54,23 +60,8 @@ class ChatClient:
         self.get_connection_details()
 
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
             print_colored("\nAttempting to connect to server...", "yellow")
-            max_retries = 3
-            retry_count = 0
-
-            while retry_count < max_retries:
-                try:
-                    self.socket.connect((self.server_ip, CONFIG['SERVER_PORT']))
-                    break
-                except ConnectionRefusedError:
-                    retry_count += 1
-                    print_colored(f"Connection attempt {retry_count}/{max_retries} failed. Retrying...", "red")
-                    if retry_count < max_retries:
-                        time.sleep(2)
-
-            if retry_count == max_retries:
+            if not self.retry(lambda: self.connection.connect(self.server_ip, CONFIG['SERVER_PORT'])):
                 raise Exception("Could not connect to server after multiple attempts")
 
             print_colored("\nConnected to server successfully!", "green")
@@ -81,11 +72,8 @@ class ChatClient:
                     break
                 print_colored("Invalid username. Username cannot be empty or contain spaces.", "red")
 
-            self.socket.send(self.username.encode())
-
             # Wait for initial server response
-            response = self.socket.recv(CONFIG['BUFFER_SIZE'])
-            initial_msg = Message.from_json(response.decode())
+            initial_msg = self.connection.login(self.username)
 
             if initial_msg.type == 'status' and 'already taken' in initial_msg.content:
                 print_colored(initial_msg.content, "red")
@@ -98,6 +86,7 @@ class ChatClient:
             print_colored("Type /quit to exit\n", "blue")
 
             # Start receiver thread
+            self.renderer.start()
             threading.Thread(target=self.receive_messages).start()
             # Start sender thread
             self.send_messages()
@@ -107,22 +96,56 @@ class ChatClient:
             print_colored(f"Make sure the server is running at {self.server_ip}:{CONFIG['SERVER_PORT']}", "yellow")
             self.disconnect()
 
+    def retry(self, attempt):
+        """Call attempt until it returns a result, backing off with jitter between failures"""
+        max_retries = CONFIG['RECONNECT_ATTEMPTS']
+        delays = backoff_delays(max_retries, CONFIG['RECONNECT_BASE_DELAY'], CONFIG['RECONNECT_MAX_DELAY'])
+        for retry_count in range(1, max_retries + 1):
+            try:
+                return attempt()
+            except OSError:
+                if retry_count == max_retries or not self.running:
+                    return None
+                delay = next(delays)
+                print_colored(f"Connection attempt {retry_count}/{max_retries} failed. "
+                              f"Retrying in {delay:.1f}s...", "red")
+                time.sleep(delay)
+
+    def reconnect(self):
+        """Reconnect after losing the server; the session brings back missed messages"""
+        print_colored("\nConnection lost. Reconnecting...", "yellow")
+        msg = self.retry(self.connection.reconnect)
+        if msg is None or (msg.type == 'status' and 'already taken' in msg.content):
+            if msg is not None:
+                print_colored(msg.content, "red")
+            return False
+        self.renderer.add(msg)
+        return True
+
+    def send_message(self, msg):
+        self.connection.send(msg)
+
     def receive_messages(self):
         while self.running:
             try:
-                data = self.socket.recv(CONFIG['BUFFER_SIZE'])
-                if not data:
+                msg = self.connection.next_message()
+                if msg is None:
+                    if self.running and self.reconnect():
+                        continue
                     break
 
                 try:
-                    msg = Message.from_json(data.decode())
-                    print('\r' + ' ' * (len(getattr(self, 'current_input', '')) + 2), end='\r')
-                    print(format_message(msg))
-                    if hasattr(self, 'current_input'):
-                        print(f"> {self.current_input}", end='', flush=True)
+                    self.renderer.add(msg)
                 except Exception as e:
                     print(f"\nError processing message: {e}")
 
+            except OSError:
+                # Connection reset and the like: the server may be back soon
+                if self.running and self.reconnect():
+                    continue
+                if self.running:
+                    self.disconnect()
+                break
             except Exception as e:
                 if self.running:
                     print_colored(f"\nError receiving message: {e}", "red")
@@ -143,10 +166,14 @@ class ChatClient:
                     self.handle_command(message[1:])
                 else:
                     msg = Message('chat', message, self.username)
-                    self.socket.send(msg.to_json().encode())
+                    self.send_message(msg)
 
                 self.current_input = ''  # Reset current_input after sending
 
+            except OSError:
+                # The receiver is reconnecting; keep the prompt alive
+                if self.running:
+                    print_colored("Not connected; message not sent.", "red")
             except Exception as e:
                 if self.running:
                     print_colored(f"\nError sending message: {e}", "red")
@@ -156,6 +183,11 @@ class ChatClient:
     def handle_command(self, command):
         if command == 'quit':
             print_colored("\nDisconnecting from chat...", "yellow")
+            try:
+                # Tell the server not to hold the session for a reconnect
+                self.send_message(Message('command', 'quit', self.username))
+            except OSError:
+                pass
             self.disconnect()
             return
 
@@ -165,12 +197,16 @@ class ChatClient:
                 print_colored(f"/{cmd}: {desc}", "yellow")
             return
 
+        if command == 'users':
+            self.connection.users()
+            return
+
         if command.startswith('dm '):
             try:
                 _, recipient, *content = command.split()
                 if content:
                     msg = Message('dm', ' '.join(content), self.username, recipient)
-                    self.socket.send(msg.to_json().encode())
+                    self.send_message(msg)
                 else:
                     print_colored("Error: Message content is required for DM", "red")
             except ValueError:
@@ -178,15 +214,12 @@ class ChatClient:
             return
 
         msg = Message('command', command, self.username)
-        self.socket.send(msg.to_json().encode())
+        self.send_message(msg)
 
     def disconnect(self):
         self.running = False
-        if self.socket:
-            try:
-                self.socket.close()
-            except:
-                pass
+        self.connection.close()
+        self.renderer.stop()
         print_colored("\nDisconnected from server.", "yellow")
         sys.exit(0)
 
@@ -1,15 +1,93 @@
 # config.py
 import socket
+import struct
+import sys
+import time
+
+BOOT_STARTED = time.perf_counter()  # Every entry point imports this module first
 
 CONFIG = {
-    'SERVER_PORT': 12000,
+    'SERVER_PORT': 12000,       # 0 lets the kernel pick a free port (shown at startup)
+    'PORT_FALLBACK': True,      # If SERVER_PORT is busy, try the range below; False fails instead
     'PORT_RANGE_START': 12000,
     'PORT_RANGE_END': 12100,    # Will try ports 12000-12100 if default is busy
     'MAX_CONNECTIONS': 10,
     'BUFFER_SIZE': 2048,
+    'MAX_FRAME_SIZE': 1048576,  # Largest length-prefixed message accepted, in bytes
+    'COMPRESSION_THRESHOLD': 256,  # Payload bytes from which clients that offer it get deflate (None disables)
     'SOCKET_TIMEOUT': 1.0,    # Server socket timeout in seconds
-    'CLIENT_TIMEOUT': 60.0,   # Client socket timeout in seconds
-    'LOG_FILE': 'chat.log'
+    'HANDSHAKE_TIMEOUT': 10.0,  # Seconds a new connection has to send its username
+    'HEARTBEAT_INTERVAL': 30.0,  # Idle seconds before the server pings a client
+    'HEARTBEAT_TIMEOUT': 90.0,  # Silent seconds before a client is disconnected (None disables)
+    'HEARTBEAT_TICK': 1.0,      # Resolution of the heartbeat timer wheel in seconds
+    'SESSION_TTL': 120.0,       # Seconds a dropped client's session waits for it to reconnect (None disables)
+    'SESSION_BUFFER_SIZE': 500,  # Messages kept per session for replay on reconnect
+    'RECONNECT_ATTEMPTS': 8,    # Client connection attempts before giving up
+    'RECONNECT_BASE_DELAY': 0.5,  # Client backoff: random wait up to base * 2**attempt seconds...
+    'RECONNECT_MAX_DELAY': 30.0,  # ...but never more than this
+    'CLIENT_RENDER_FPS': 30,    # Most times a second the client redraws for new messages (None draws each at once)
+    'CLIENT_SCROLLBACK': 1000,  # Lines the client keeps; a flood of more between redraws skips the oldest
+    'LOG_FILE': 'chat.log',
+    'LOG_MODE': 'queue',          # 'queue' (background batched writer) or 'sync'
+    'LOG_QUEUE_SIZE': 10000,      # Records buffered for the writer before dropping
+    'LOG_BATCH_SIZE': 512,        # Most records written per flush
+    'LOG_SAMPLE_THRESHOLD': 0.8,  # Queue fill ratio at which info records are sampled
+    'LOG_SAMPLE_RATE': 10,        # Keep 1 in N info records while sampling
+    'LOG_ROTATION': 'size',       # 'size', 'time' or None
+    'LOG_MAX_BYTES': 10485760,    # Rotate after this many bytes ('size')
+    'LOG_ROTATE_WHEN': 'midnight',  # Rotation interval ('time'), as for TimedRotatingFileHandler
+    'LOG_BACKUP_COUNT': 5,        # Rotated files to keep
+    'OUTBOX_SIZE': 256,           # Frames queued per client before the overflow policy applies
+    'OUTBOX_POLICY': 'drop_oldest',  # 'drop_oldest', 'disconnect' or 'coalesce'
+    'OUTBOX_MAX_BYTES': 1048576,  # Backlog a coalescing outbox may hold before disconnecting
+    'OUTBOX_FLUSH_TIMEOUT': 2.0,  # Seconds to flush queued messages when closing
+    'SERVER_MODE': 'threaded',  # 'threaded' (thread per client) or 'asyncio' (single event loop)
+    'SERVER_WORKERS': 1,        # Processes sharing the port via SO_REUSEPORT (Linux)
+    'BUS_QUEUE_SIZE': 10000,    # Events queued for each other worker before the overflow policy applies
+    'BUS_OVERFLOW_POLICY': 'drop',  # 'drop' (that worker misses them) or 'disconnect' (cut it off the bus)
+    'TRANSPORT': 'tcp',         # 'tcp', 'tls' (needs the certificate below) or 'unix' (same host only)
+    'TLS_CERT_FILE': 'chat_cert.pem',  # Server certificate chain (PEM)
+    'TLS_KEY_FILE': 'chat_key.pem',    # Server private key (PEM)
+    'TLS_CA_FILE': None,        # Certificates clients trust for the server; None uses the system store
+    'TLS_VERIFY': True,         # Clients check the server certificate and host name
+    'UNIX_SOCKET_PATH': 'chat.sock',  # Socket file for the 'unix' transport
+    'UPGRADE_SOCKET': None,     # Socket file a new process takes over through ('server.py --upgrade'); None disables
+    'UPGRADE_TIMEOUT': 30.0,    # Seconds either process waits for the other during a hot upgrade
+    'METRICS_HOST': '127.0.0.1',  # Prometheus /metrics endpoint; keep it local
+    'METRICS_PORT': 9464,       # None disables it; workers use consecutive ports
+    'RATE_LIMITS': {              # Per user, as (messages per second, burst); omit a kind to leave it unlimited
+        'chat': (5.0, 20),
+        'dm': (2.0, 10),
+        'command': (2.0, 10),
+        'bot': (0.5, 3),          # Chat lines passed on to the chatbot
+    },
+    'GLOBAL_RATE_LIMITS': {       # Whole server (each worker process), same form
+        'chat': (2000.0, 4000),
+        'bot': (5.0, 20),
+    },
+    'CHATBOT_BACKEND': 'openai',  # 'openai', 'stub' (local, no network) or None to disable
+    'CHATBOT_WORKERS': 4,         # Concurrent backend calls
+    'CHATBOT_QUEUE_SIZE': 100,    # Pending prompts before new ones are rejected
+    'CHATBOT_BATCH_SIZE': 8,      # Prompts sent to the backend in one request
+    'CHATBOT_TIMEOUT': 10.0,      # Seconds a prompt may wait or run before it is abandoned
+    'CHATBOT_FAILURE_THRESHOLD': 5,  # Consecutive failures that open the circuit breaker
+    'CHATBOT_COOLDOWN': 30.0,     # Seconds the circuit stays open before retrying
+    'CHATBOT_CACHE_SIZE': 1024,   # Cached replies, keyed by normalized prompt (0 disables)
+    'CHATBOT_CACHE_TTL': 300.0,   # Seconds a cached reply stays valid
+    'DEFAULT_ROOM': 'lobby',      # Room every client starts in and returns to on /leave
+    'PRESENCE_INTERVAL': 0.5,     # Seconds join/leave notices are batched before going out
+    'PRESENCE_MAX_NAMES': 10,     # Names listed in one notice; the rest are counted
+    'PRESENCE_LOG_SIZE': 10000,   # Roster changes kept for '/users' deltas
+    'HISTORY_FILE': 'chat_history.db',  # SQLite message history, or None to disable
+    'HISTORY_QUEUE_SIZE': 10000,  # Messages waiting to be written before new ones are dropped
+    'HISTORY_BATCH_SIZE': 256,    # Most messages inserted per transaction
+    'HISTORY_FLUSH_INTERVAL': 0.2,  # Seconds the writer waits for a batch to fill
+    'HISTORY_DEFAULT_LIMIT': 20,  # Messages /history shows without a count
+    'HISTORY_MAX_FETCH': 200,     # Most messages one history query returns
+    'HISTORY_REPLAY_ON_JOIN': 10,  # Recent room messages sent on join (0 disables)
+    'SEARCH_INDEX_DIR': 'chat_index',  # Index over LOG_FILE that logsearch.py searches, or None to disable
+    'SEARCH_INDEX_INTERVAL': 5.0,  # Seconds between index updates while the server runs
+    'SEARCH_MAX_RESULTS': 50      # Most log lines one search prints
 }
 
 # Command prefix
@@ -20,17 +98,36 @@ COMMANDS = {
     'help': 'Show available commands',
     'users': 'List all connected users',
     'dm': 'Send private message (/dm username message)',
+    'join': 'Join or create a room (/join room)',
+    'leave': 'Leave the current room and return to the lobby',
+    'rooms': 'List rooms and how many users are in each',
+    'history': 'Show recent messages (/history [n] for this room, /history username [n] for DMs, '
+               '/history from:username [n] for what someone said in any room)',
     'quit': 'Exit the chat'
 }
 
+SIOCGIFADDR = 0x8915  # Linux ioctl: an interface's IPv4 address
+
 def get_local_ip():
-    """Get the local IP address of the machine"""
+    """Get the local IP address of the machine.
+
+    Reads the addresses of the local interfaces rather than routing a
+    socket towards the internet, so it is instant and works offline.
+    """
+    if sys.platform.startswith('linux'):
+        import fcntl
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            for _, name in socket.if_nameindex():
+                try:
+                    request = struct.pack('256s', name.encode()[:15])
+                    address = socket.inet_ntoa(fcntl.ioctl(s.fileno(), SIOCGIFADDR, request)[20:24])
+                except OSError:
+                    continue  # Interface without an IPv4 address
+                if not address.startswith('127.'):
+                    return address
+        return "127.0.0.1"
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        local_ip = s.getsockname()[0]
-        s.close()
-        return local_ip
+        return socket.gethostbyname(socket.gethostname())
     except:
         return "127.0.0.1"
 
@@ -46,6 +143,14 @@ def is_port_available(port):
         sock.close()
     return available
 
+def candidate_ports():
+    """Ports the server tries to listen on, in order"""
+    port = CONFIG['SERVER_PORT']
+    if port == 0 or not CONFIG['PORT_FALLBACK']:
+        return [port]
+    fallback = range(CONFIG['PORT_RANGE_START'], CONFIG['PORT_RANGE_END'] + 1)
+    return [port] + [p for p in fallback if p != port]
+
 def find_available_port():
     """Find an available port in the configured range"""
     for port in range(CONFIG['PORT_RANGE_START'], CONFIG['PORT_RANGE_END'] + 1):
@@ -0,0 +1,214 @@
+# connection.py
+import random
+import threading
+from collections import deque
+from config import CONFIG
+from models import Message
+from protocol import (CONTROL_TYPES, FEATURE_COMPRESSION, FEATURE_HEARTBEAT, FEATURE_SESSION,
+                      FRAMING_BINARY, FRAMING_LENGTH_PREFIX, RESUME_PREFIX, SUPPORTED_FRAMINGS,
+                      add_definitions, encode_message, make_decoder, parse_roster)
+from transport import create_transport
+
+def backoff_delays(attempts, base, cap):
+    """Waits between connection attempts: exponential backoff with full jitter.
+
+    Each wait is random between 0 and base * 2**attempt (at most cap), so
+    clients dropped together do not all come back at the same moment.
+    """
+    for attempt in range(attempts - 1):
+        yield random.uniform(0, min(cap, base * 2 ** attempt))
+
+class ChatConnection:
+    """Headless chat client: handshake, framing and message codec with no UI.
+
+    The protocol side (handshake, feed, encode) does no I/O, so asyncio
+    code can drive it with its own streams; connect, login, send and
+    next_message wrap it around a blocking socket. Pings from the server
+    are answered automatically: next_message sends the pong itself, other
+    callers write out data_to_send() after each feed.
+
+    The server may issue a session token; reconnect() then resumes the
+    session and the server replays what was sent since the last message
+    received here.
+    """
+    def __init__(self, framings=SUPPORTED_FRAMINGS, transport=None, compression=True):
+        self.framings = framings  # Offered to the server, in order of preference
+        self.compression = compression  # Whether to offer FEATURE_COMPRESSION
+        self.transport = transport or create_transport()  # TCP, TLS or Unix socket
+        self.username = None
+        self.address = None
+        self.sock = None
+        self.session = None     # Token for resuming after a dropped connection
+        self.last_seq = 0       # Sequence number of the last message received
+        self.roster = None      # Names online as of roster_token, from '/users' replies
+        self.roster_token = None
+        self.pending = deque()  # Decoded messages not yet returned by next_message
+        self.send_lock = threading.Lock()  # Receiving thread sends pongs beside the sender
+        self.reset()
+
+    def reset(self):
+        """Forget the state of the current connection, keeping the session"""
+        self.framing = None
+        self.compress = False   # Whether the server accepted compression
+        self.decoder = None
+        self.negotiated = False
+        self.names = {}         # Sender ids defined by the server (binary framing)
+        self.defined = set()    # Sender ids already defined to the server
+        self.replies = []       # Pongs owed to the server
+
+    # Protocol
+
+    def handshake(self, username):
+        """First bytes to send: the username and the framings we understand"""
+        self.username = username
+        features = self.framings + (FEATURE_HEARTBEAT, FEATURE_SESSION)
+        if self.compression:
+            features += (FEATURE_COMPRESSION,)
+        if self.session:
+            features += (f"{RESUME_PREFIX}{self.session}:{self.last_seq}",)
+        return f"{username} {' '.join(features)}".encode()
+
+    def feed(self, data):
+        """Decode bytes received from the server into Messages"""
+        if self.decoder is None:
+            if data.startswith(b'{'):
+                # Older server: bare JSON, one message per recv
+                self.decoder = make_decoder()
+                self.negotiated = True
+            else:
+                self.decoder = make_decoder(FRAMING_LENGTH_PREFIX)
+        return self.decode(self.decoder.feed(data))
+
+    def decode(self, frames):
+        messages = []
+        for frame in frames:
+            # Define frames only update the sender names and yield no message
+            msg = Message.from_wire(frame, self.names)
+            if msg is None:
+                continue
+            if not self.negotiated:
+                # The framing, then any optional features the server accepted
+                accepted = msg.content.split() if msg.type == 'handshake' else []
+                if not accepted or accepted[0] not in SUPPORTED_FRAMINGS:
+                    raise ConnectionError("Unexpected handshake reply from server")
+                self.framing = accepted[0]
+                self.compress = FEATURE_COMPRESSION in accepted[1:]
+                self.negotiated = True
+                continue
+            if msg.type in CONTROL_TYPES:
+                if msg.type == 'ping':
+                    self.replies.append(Message('pong', msg.content, self.username))
+                elif msg.type == 'session':
+                    self.session = msg.content
+                continue
+            if msg.seq is not None:
+                self.last_seq = msg.seq
+            if msg.type == 'command':
+                self.apply_roster(msg)
+            messages.append(msg)
+        return messages
+
+    def apply_roster(self, msg):
+        """Keep the roster from a '/users' reply; a reply with only changes reads as the full list"""
+        reply = parse_roster(msg.content)
+        if reply is None:
+            return
+        since, users, token = reply
+        if since is None:
+            self.roster = set(users)
+        elif self.roster is not None and since == self.roster_token:
+            for change in users:
+                if change[0] == '+':
+                    self.roster.add(change[1:])
+                else:
+                    self.roster.discard(change[1:])
+        else:
+            return
+        self.roster_token = token
+        msg.content = f"Online users: {', '.join(sorted(self.roster))}"
+
+    def data_to_send(self):
+        """Wire bytes of any pongs owed since the last call"""
+        replies, self.replies = self.replies, []
+        return b''.join(self.encode(msg) for msg in replies)
+
+    def encode(self, msg):
+        """Wire bytes for msg in the negotiated framing"""
+        frames = [encode_message(msg, self.framing, self.compress)]
+        if self.framing == FRAMING_BINARY:
+            frames = add_definitions(frames, self.defined)
+        return b''.join(frames)
+
+    # Blocking socket helpers
+
+    def connect(self, host, port, timeout=None):
+        self.address = (host, port)
+        self.sock = self.transport.connect(self.address, timeout)
+        return self.sock
+
+    def login(self, username):
+        """Send the handshake and return the server's first message (welcome or rejection)"""
+        self.sock.sendall(self.handshake(username))
+        return self.finish_login()
+
+    def finish_login(self):
+        while not self.negotiated:
+            data = self.sock.recv(CONFIG['BUFFER_SIZE'])
+            if not data:
+                raise ConnectionError("Server closed the connection during the handshake")
+            self.pending.extend(self.feed(data))
+        return self.next_message()
+
+    def reconnect(self, timeout=None):
+        """Connect again and log in, resuming the session if the server still holds it.
+
+        Returns the server's first message, as login does.
+        """
+        # Under the lock so nothing else is sent before the handshake
+        with self.send_lock:
+            self.close()
+            self.reset()
+            self.sock = self.transport.connect(self.address, timeout)
+            self.sock.sendall(self.handshake(self.username))
+        msg = self.finish_login()
+        if msg is None:
+            raise ConnectionError("Server closed the connection during the handshake")
+        return msg
+
+    def next_message(self):
+        """Return the next Message from the server, or None once it disconnects"""
+        while not self.pending:
+            frames = self.decoder.read_from(self.sock)
+            if frames is None:
+                return None
+            self.pending.extend(self.decode(frames))
+            if self.replies:
+                with self.send_lock:
+                    self.sock.sendall(self.data_to_send())
+        return self.pending.popleft()
+
+    def send(self, msg):
+        with self.send_lock:
+            if not self.negotiated:
+                raise ConnectionError("Not connected to the server")
+            self.sock.sendall(self.encode(msg))
+
+    def chat(self, text):
+        self.send(Message('chat', text, self.username))
+
+    def dm(self, recipient, text):
+        self.send(Message('dm', text, self.username, recipient))
+
+    def command(self, command):
+        self.send(Message('command', command, self.username))
+
+    def users(self):
+        """Ask who is online, for only the changes if we have an earlier reply"""
+        self.command(f"users {self.roster_token}" if self.roster_token else 'users')
+
+    def close(self):
+        if self.sock:
+            try:
+                self.transport.close(self.sock)
+            except OSError:
+                pass
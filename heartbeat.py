@@ -0,0 +1,33 @@
+# heartbeat.py
+import math
+
+class TimerWheel:
+    """Hashed timing wheel: schedule items for a later tick, collect them when it passes.
+
+    Scheduling is O(1) and advancing only touches the slots whose time has
+    come, so checking thousands of connections costs nothing until one of
+    them is due. Delays are rounded up to whole ticks, so items are never
+    returned early, and capped at the length of the wheel.
+    """
+    def __init__(self, tick, horizon, now=0.0):
+        self.tick = tick
+        self.slots = [[] for _ in range(int(math.ceil(horizon / tick)) + 2)]
+        self.current = int(now / tick)  # Absolute tick of the last advance
+
+    def schedule(self, item, delay):
+        ticks = min(max(int(math.ceil(delay / self.tick)), 1), len(self.slots) - 1)
+        self.slots[(self.current + ticks) % len(self.slots)].append(item)
+
+    def advance(self, now):
+        """Return every item due at or before now, in the order they fell due"""
+        target = int(now / self.tick)
+        due = []
+        # A stall longer than the wheel only needs one lap to collect everything
+        steps = min(target - self.current, len(self.slots))
+        for step in range(1, steps + 1):
+            slot = (self.current + step) % len(self.slots)
+            if self.slots[slot]:
+                due.extend(self.slots[slot])
+                self.slots[slot] = []
+        self.current = max(self.current, target)
+        return due
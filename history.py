@@ -0,0 +1,146 @@
+# history.py
+import queue
+import sqlite3
+import threading
+from config import CONFIG
+from models import Message
+from utils import log_message
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    type TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    recipient TEXT,
+    room TEXT,
+    dm_pair TEXT,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_room ON messages (room, id);
+CREATE INDEX IF NOT EXISTS messages_sender ON messages (sender, id);
+CREATE INDEX IF NOT EXISTS messages_dm_pair ON messages (dm_pair, id);
+CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp);
+"""
+
+COLUMNS = "timestamp, type, sender, recipient, room, content"
+
+def dm_pair(a, b):
+    """Order-independent key for a DM conversation"""
+    return '\n'.join(sorted((a, b)))
+
+class HistoryStore:
+    """Append-only message history in SQLite, written in batches.
+
+    record() only queues the message; a writer thread inserts whatever has
+    accumulated in one transaction. Reads go through the indexes and fetch
+    at most HISTORY_MAX_FETCH rows, so memory use does not grow with the
+    size of the history.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.pending = queue.Queue(maxsize=CONFIG['HISTORY_QUEUE_SIZE'])
+        self.dropped = 0
+
+        self.reader = sqlite3.connect(path, check_same_thread=False)
+        self.reader.execute("PRAGMA journal_mode=WAL")
+        self.reader.executescript(SCHEMA)
+        self.read_lock = threading.Lock()
+
+        self.writer = threading.Thread(target=self.run, daemon=True, name="history-writer")
+        self.writer.start()
+
+    def record(self, message):
+        """Queue a chat or DM message for the next batch"""
+        pair = dm_pair(message.sender, message.recipient) if message.type == 'dm' else None
+        row = (message.timestamp, message.type, message.sender, message.recipient,
+               message.room, message.content, pair)
+        try:
+            self.pending.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        db = sqlite3.connect(self.path)
+        db.execute("PRAGMA synchronous=NORMAL")
+        while True:
+            rows = [self.pending.get()]
+            # Let a batch build up briefly instead of committing every message
+            try:
+                while len(rows) < CONFIG['HISTORY_BATCH_SIZE']:
+                    rows.append(self.pending.get(timeout=CONFIG['HISTORY_FLUSH_INTERVAL']))
+            except queue.Empty:
+                pass
+
+            # Flush requests are Events and the stop marker is None; both ride the queue
+            # so they are handled after every message recorded before them
+            markers = [row for row in rows if not isinstance(row, tuple)]
+            rows = [row for row in rows if isinstance(row, tuple)]
+            if rows:
+                try:
+                    with db:
+                        db.executemany(
+                            f"INSERT INTO messages ({COLUMNS}, dm_pair) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            rows
+                        )
+                except sqlite3.Error as e:
+                    log_message(f"Error writing message history: {e}", 'error')
+            for marker in markers:
+                if marker is not None:
+                    marker.set()
+            if None in markers:
+                break
+        db.close()
+
+    def flush(self, timeout=2.0):
+        """Wait until everything recorded so far is committed"""
+        done = threading.Event()
+        try:
+            self.pending.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def query(self, where, params, limit):
+        limit = max(1, min(limit, CONFIG['HISTORY_MAX_FETCH']))
+        with self.read_lock:
+            rows = self.reader.execute(
+                f"SELECT {COLUMNS} FROM messages WHERE {where} ORDER BY id DESC LIMIT ?",
+                (*params, limit)
+            ).fetchall()
+
+        messages = []
+        for timestamp, type, sender, recipient, room, content in reversed(rows):
+            msg = Message(type, content, sender, recipient, room)
+            msg.timestamp = timestamp
+            messages.append(msg)
+        return messages
+
+    def recent(self, room, limit):
+        """Last messages in a room, oldest first"""
+        return self.query("room = ? AND dm_pair IS NULL", (room,), limit)
+
+    def conversation(self, a, b, limit):
+        """Last DMs between two users, oldest first"""
+        return self.query("dm_pair = ?", (dm_pair(a, b),), limit)
+
+    def by_sender(self, sender, limit):
+        """Last room messages a user sent, in any room, oldest first; their DMs stay private"""
+        return self.query("sender = ? AND dm_pair IS NULL", (sender,), limit)
+
+    def close(self, timeout=2.0):
+        """Commit what is still queued and stop the writer"""
+        try:
+            self.pending.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.writer.join(timeout)
+        with self.read_lock:
+            self.reader.close()
+
+def create_history_store():
+    """Open the store at CONFIG['HISTORY_FILE'], or None when history is disabled"""
+    path = CONFIG['HISTORY_FILE']
+    if not path:
+        return None
+    return HistoryStore(path)
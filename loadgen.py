@@ -0,0 +1,321 @@
+# loadgen.py
+"""Load generator: simulated users driving a chat server, with latency and throughput results.
+
+Every simulated user holds a connection and reads everything it is sent;
+--senders of them also send a mix of chat lines, DMs and commands. Chat and
+DM content carries the send time, so receivers measure delivery latency;
+command latency is the time to the server's reply. Results, including the
+server's resident memory, are written as JSON for comparison between runs.
+
+Usage: python loadgen.py --users 2000 --senders 100 --duration 30 --output results.json
+       python loadgen.py --spawn asyncio --users 500   (start a server just for this run)
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import deque
+from config import CONFIG, find_available_port
+from connection import ChatConnection
+from models import Message
+from protocol import FRAMING_BINARY, FRAMING_LENGTH_PREFIX
+from spawn import spawn_server
+from transport import create_transport
+
+MARKER = 'lg:'  # Prefix of generated content: lg:<send time ns>:<padding>
+COMMANDS = ('users', 'rooms')  # Commands answered with exactly one reply
+
+class LatencyHistogram:
+    """Log-linear histogram of latencies in microseconds (about 3% resolution).
+
+    Memory stays constant however many samples are recorded.
+    """
+    SUB_BUCKETS = 32
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.max = 0
+
+    def bucket(self, value):
+        if value < self.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - 6  # Keep the top 6 bits, i.e. 32 sub-buckets per power of two
+        return (shift << 6) | (value >> shift)
+
+    def lower_bound(self, bucket):
+        if bucket < self.SUB_BUCKETS:
+            return bucket
+        shift, top = bucket >> 6, bucket & 63
+        return top << shift
+
+    def record(self, micros):
+        micros = max(int(micros), 0)
+        key = self.bucket(micros)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.count += 1
+        self.max = max(self.max, micros)
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        target = self.count * p / 100
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen >= target:
+                return self.lower_bound(key)
+        return self.max
+
+    def summary(self):
+        def ms(micros):
+            return None if micros is None else round(micros / 1000, 3)
+        return {
+            'count': self.count,
+            'p50_ms': ms(self.percentile(50)),
+            'p99_ms': ms(self.percentile(99)),
+            'p999_ms': ms(self.percentile(99.9)),
+            'max_ms': ms(self.max if self.count else None)
+        }
+
+class Stats:
+    def __init__(self):
+        self.sent = {'chat': 0, 'dm': 0, 'command': 0}
+        self.received = 0
+        self.latency = {kind: LatencyHistogram() for kind in self.sent}
+        self.connect_errors = 0
+        self.disconnects = 0
+        self.measuring = False
+
+class SimulatedUser:
+    def __init__(self, index, args, stats):
+        self.index = index
+        self.username = f"{args.prefix}{index}"
+        self.args = args
+        self.stats = stats
+        framings = (FRAMING_BINARY, FRAMING_LENGTH_PREFIX) if args.framing == 'bin1' else (FRAMING_LENGTH_PREFIX,)
+        self.connection = ChatConnection(framings, compression=args.compression == 'on')
+        self.reader = None
+        self.writer = None
+        self.commands = deque()  # Send times of commands waiting for their reply
+
+    async def connect(self, host, port):
+        if self.args.transport == 'unix':
+            self.reader, self.writer = await asyncio.open_unix_connection(CONFIG['UNIX_SOCKET_PATH'])
+        else:
+            ssl = self.args.transport_impl.client_ssl_context()
+            self.reader, self.writer = await asyncio.open_connection(
+                host, port, ssl=ssl, server_hostname=host if ssl else None)
+        self.writer.write(self.connection.handshake(self.username))
+        while not self.connection.negotiated:
+            data = await self.reader.read(CONFIG['BUFFER_SIZE'])
+            if not data:
+                raise ConnectionError("closed during handshake")
+            self.connection.feed(data)
+        if self.args.rooms > 1:
+            self.writer.write(self.connection.encode(
+                Message('command', f"join room{self.index % self.args.rooms}", self.username)))
+
+    async def receive(self):
+        stats = self.stats
+        while True:
+            data = await self.reader.read(65536)
+            if not data:
+                stats.disconnects += 1
+                return
+            now = time.perf_counter_ns()
+            for msg in self.connection.feed(data):
+                if not stats.measuring:
+                    continue
+                if msg.content.startswith(MARKER):
+                    stats.received += 1
+                    sent_at = int(msg.content.split(':', 2)[1])
+                    stats.latency['dm' if msg.type == 'dm' else 'chat'].record((now - sent_at) / 1000)
+                elif msg.type == 'command' and self.commands:
+                    stats.received += 1
+                    stats.latency['command'].record((now - self.commands.popleft()) / 1000)
+            if self.connection.replies:
+                self.writer.write(self.connection.data_to_send())
+
+    def next_message(self, kind, population):
+        now = time.perf_counter_ns()
+        if kind == 'command':
+            self.commands.append(now)
+            return Message('command', random.choice(COMMANDS), self.username)
+        content = f"{MARKER}{now}:{'x' * self.args.size}"
+        if kind == 'dm':
+            return Message('dm', content, self.username, f"{self.args.prefix}{random.randrange(population)}")
+        return Message('chat', content, self.username)
+
+    async def drive(self, deadline, mix, population):
+        kinds, weights = zip(*mix.items())
+        interval = 1 / self.args.rate
+        # Spread senders out so they do not all fire on the same tick
+        await asyncio.sleep(random.random() * interval)
+        while time.perf_counter() < deadline:
+            kind = random.choices(kinds, weights)[0]
+            self.writer.write(self.connection.encode(self.next_message(kind, population)))
+            self.stats.sent[kind] += 1
+            await self.writer.drain()
+            await asyncio.sleep(interval)
+
+def parse_mix(text):
+    """'chat=80,dm=15,command=5' -> {'chat': 80.0, ...}"""
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in ('chat', 'dm', 'command'):
+            raise argparse.ArgumentTypeError(f"unknown message kind {kind!r}")
+        mix[kind] = float(weight)
+    return mix
+
+def process_rss_kb(pid):
+    """Resident memory of a process and its direct children (worker processes), in KB"""
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    total = 0
+    for each in pids:
+        try:
+            with open(f"/proc/{each}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total or None
+
+async def sample_rss(pid, samples):
+    while True:
+        rss = process_rss_kb(pid)
+        if rss:
+            samples.append(rss)
+        await asyncio.sleep(0.5)
+
+async def run(args, port, server_pid):
+    stats = Stats()
+    users = [SimulatedUser(i, args, stats) for i in range(args.users)]
+
+    # Connect in bounded batches so the accept backlog is not overrun
+    connected = []
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+    async def connect(user):
+        async with semaphore:
+            try:
+                await user.connect(args.host, port)
+                connected.append(user)
+            except (OSError, ConnectionError):
+                stats.connect_errors += 1
+
+    connect_start = time.perf_counter()
+    await asyncio.gather(*[connect(user) for user in users])
+    connect_time = time.perf_counter() - connect_start
+
+    rss_samples = []
+    tasks = [asyncio.create_task(user.receive()) for user in connected]
+    if server_pid:
+        tasks.append(asyncio.create_task(sample_rss(server_pid, rss_samples)))
+    await asyncio.sleep(args.settle)  # Join notices and room changes
+    stats.measuring = True
+
+    start = time.perf_counter()
+    senders = connected[:args.senders]
+    await asyncio.gather(*[user.drive(start + args.duration, args.mix, len(connected))
+                           for user in senders])
+    await asyncio.sleep(args.drain)  # In-flight fan-out
+    elapsed = time.perf_counter() - start
+
+    for task in tasks:
+        task.cancel()
+    for user in connected:
+        user.writer.close()
+
+    sent = sum(stats.sent.values())
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings': {key: value for key, value in vars(args).items()
+                     if key not in ('output', 'transport_impl')},
+        'connections': {
+            'requested': args.users,
+            'connected': len(connected),
+            'errors': stats.connect_errors,
+            'disconnected': stats.disconnects,
+            'connect_seconds': round(connect_time, 3)
+        },
+        'sent': stats.sent,
+        'received': stats.received,
+        'throughput': {
+            'sent_per_sec': round(sent / elapsed, 1),
+            'delivered_per_sec': round(stats.received / elapsed, 1)
+        },
+        'latency': {kind: histogram.summary() for kind, histogram in stats.latency.items()},
+        'server_rss_kb': {
+            'start': rss_samples[0] if rss_samples else None,
+            'peak': max(rss_samples) if rss_samples else None,
+            'end': rss_samples[-1] if rss_samples else None
+        }
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=CONFIG['SERVER_PORT'])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--senders', type=int, default=50, help='Users that send as well as receive')
+    parser.add_argument('--rate', type=float, default=10.0, help='Messages per second per sender')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('chat=80,dm=15,command=5'))
+    parser.add_argument('--size', type=int, default=40, help='Padding bytes in each chat/DM')
+    parser.add_argument('--rooms', type=int, default=1, help='Spread users over this many rooms')
+    parser.add_argument('--framing', choices=['bin1', 'lp1'], default='bin1')
+    parser.add_argument('--transport', choices=['tcp', 'tls', 'unix'], default=CONFIG['TRANSPORT'])
+    parser.add_argument('--compression', choices=['on', 'off'], default='on',
+                        help='Offer deflate for large payloads')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--settle', type=float, default=1.0, help='Seconds between connecting and sending')
+    parser.add_argument('--drain', type=float, default=1.0, help='Seconds to wait for deliveries after sending')
+    parser.add_argument('--connect-concurrency', type=int, default=100)
+    parser.add_argument('--prefix', default='load', help='Username prefix')
+    parser.add_argument('--server-pid', type=int, help='Sample this process for server RSS')
+    parser.add_argument('--spawn', choices=['threaded', 'asyncio'],
+                        help='Start a server in this mode for the run (bot and history off)')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes for --spawn')
+    parser.add_argument('--output', default='loadgen_results.json')
+    args = parser.parse_args()
+    args.transport_impl = create_transport(args.transport)
+
+    port, server_pid, proc = args.port, args.server_pid, None
+    if args.spawn:
+        port = args.port = find_available_port()
+        proc = spawn_server(SERVER_MODE=args.spawn, SERVER_PORT=port, SERVER_WORKERS=args.workers,
+                            TRANSPORT=args.transport)
+        server_pid = proc.pid
+        time.sleep(1.0 + 0.5 * args.workers)
+
+    try:
+        results = asyncio.run(run(args, port, server_pid))
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{results['connections']['connected']}/{args.users} users connected, "
+          f"{results['throughput']['sent_per_sec']} msgs/sec sent, "
+          f"{results['throughput']['delivered_per_sec']} msgs/sec delivered")
+    for kind, summary in results['latency'].items():
+        if summary['count']:
+            print(f"{kind:>8}: p50 {summary['p50_ms']} ms, p99 {summary['p99_ms']} ms, "
+                  f"p999 {summary['p999_ms']} ms ({summary['count']} samples)")
+    rss = results['server_rss_kb']
+    if rss['peak']:
+        print(f"server RSS: {rss['start']} KB at start, {rss['peak']} KB peak")
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,503 @@
+# logsearch.py
+"""Search the server log without rescanning it.
+
+LogIndex tails CONFIG['LOG_FILE'] from the byte offset it reached last
+time, following it across rotations, and keeps an inverted index in
+CONFIG['SEARCH_INDEX_DIR']:
+
+  entries.dat   every indexed log line, appended as it is read
+  entries.idx   where each line starts in entries.dat (uint64 per line)
+  times.idx     time of each line, never decreasing (uint32 per line)
+  seg-N.seg     immutable segments mapping words, users and levels to line numbers
+  state.json    log position, line count and live segments, replaced atomically
+
+Each update writes what it read to a new segment and folds it into the
+one before while they are of similar size, so a lookup visits only a
+few. Lookups binary search the memory-mapped segments and intersect
+their postings; a time range becomes a range of line numbers by
+bisecting times.idx. Matching lines come from entries.dat, so the log
+itself is never read again.
+
+The index holds every logged line, DMs included, so chat clients cannot
+query it; it is searched here by whoever can read the log files.
+
+Usage: python logsearch.py spam from:alice level:warning since:2h until:2024-10-30T18:00
+"""
+import argparse
+import array
+import bisect
+import glob
+import json
+import mmap
+import os
+import re
+import shutil
+import stat
+import struct
+import sys
+import threading
+import time
+from config import CONFIG
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # No lock between processes; run one indexer at a time
+
+SEGMENT_MAGIC = b'CLX1'
+SEGMENT_HEADER = struct.Struct('=4sIIII')  # magic, keys, first line, end line, postings offset
+KEY_ENTRY = struct.Struct('=IIII')  # key offset, key length, first posting, postings
+SEGMENT_LINES = 65536  # Lines read before a segment is written mid-update
+MERGE_FACTOR = 2       # A segment absorbs the next while it is at most this many times bigger
+READ_SIZE = 1048576
+MAX_TERM_LENGTH = 64   # Longer words are indexed (and searched) by their start
+
+# '2024-10-30 10:36:15,164 - INFO - Message from alice: hi', as written by utils.log_message
+RECORD = re.compile(r'(\d{4}-\d\d-\d\d \d\d:\d\d):(\d\d),\d{3} - ([A-Z]+) - ')
+# The user a record is about: the sender of a message, or a client connecting or leaving
+USER = re.compile(r'(?:Message from|Client \w+:|No heartbeat from|Disconnected slow client) (\S+?)[:;]?(?:\s|$)')
+WORD = re.compile(r'\w+')
+RELATIVE = re.compile(r'(\d+)([smhdw])$')
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+def words(text):
+    return [word[:MAX_TERM_LENGTH] for word in WORD.findall(text.lower())]
+
+def parse_time(value, end=False):
+    """Seconds since the epoch for '30m', '2h' or '7d' ago, '2024-10-30' or '2024-10-30T10:36[:15]'.
+
+    With end, a date or minute means the end of it.
+    """
+    match = RELATIVE.match(value)
+    if match:
+        return int(time.time()) - int(match.group(1)) * UNITS[match.group(2)]
+    for fmt, field in (('%Y-%m-%d', 2), ('%Y-%m-%dT%H:%M', 4), ('%Y-%m-%dT%H:%M:%S', 5)):
+        try:
+            fields = list(time.strptime(value, fmt))
+        except ValueError:
+            continue
+        if end:
+            fields[field] += 1  # mktime carries into the next month, hour, ...
+        fields[8] = -1
+        return int(time.mktime(tuple(fields)))
+    raise ValueError(f"Unrecognised time '{value}'")
+
+def parse_query(text):
+    """'words from:user level:error since:TIME until:TIME' -> (keys, since, until).
+
+    A line matches when it has every key and its time is in [since, until).
+    """
+    keys, since, until = set(), None, None
+    for token in text.split():
+        field, _, value = token.partition(':')
+        if value and field == 'from':
+            keys.add('u:' + value)
+        elif value and field == 'level':
+            keys.add('l:' + value.lower())
+        elif value and field == 'since':
+            since = parse_time(value)
+        elif value and field == 'until':
+            until = parse_time(value, end=True)
+        else:
+            keys.update('w:' + word for word in words(token))
+    if not keys and since is None and until is None:
+        raise ValueError("Nothing to search for")
+    return sorted(key.encode() for key in keys), since, until
+
+class LineParser:
+    """Time and index keys of each log line.
+
+    A line that does not start a record continues the one before (a
+    message with a newline in it) and takes its time, level and user.
+    """
+    def __init__(self, last=(0, None, None)):
+        self.last = list(last)  # time, level, user of the latest record
+        self.minutes = {}       # 'YYYY-MM-DD HH:MM' -> seconds since the epoch
+
+    def parse(self, text):
+        match = RECORD.match(text)
+        if match:
+            minute, second, level = match.groups()
+            message = text[match.end():]
+            user = USER.match(message)
+            # Records are queued by many threads, so their times can step back a little
+            self.last = [max(self.minute_time(minute) + int(second), self.last[0]),
+                         level.lower(), user and user.group(1)]
+        else:
+            message = text
+        when, level, user = self.last
+        keys = {'w:' + word for word in words(message)}
+        if level:
+            keys.add('l:' + level)
+        if user:
+            keys.add('u:' + user)
+        return when, keys
+
+    def minute_time(self, minute):
+        seconds = self.minutes.get(minute)
+        if seconds is None:
+            if len(self.minutes) > 10000:
+                self.minutes.clear()
+            seconds = self.minutes[minute] = int(time.mktime(time.strptime(minute, '%Y-%m-%d %H:%M')))
+        return seconds
+
+def map_file(path, size):
+    """Read-only map of the first size bytes of a file"""
+    if not size:
+        return b''
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+def write_segment(path, postings, first, end):
+    """Write key -> chunks of ascending line numbers as a segment file"""
+    keys = sorted(postings)
+    table = array.array('I')
+    blob = bytearray()
+    base = SEGMENT_HEADER.size + KEY_ENTRY.size * len(keys)
+    position = 0
+    for key in keys:
+        count = sum(len(chunk) for chunk in postings[key])
+        table.extend((base + len(blob), len(key), position, count))
+        blob += key
+        position += count
+    blob += bytes(-(base + len(blob)) % 4)  # Postings are read as an aligned uint32 array
+
+    with open(path + '.tmp', 'wb') as f:
+        f.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, len(keys), first, end, base + len(blob)))
+        f.write(table)
+        f.write(blob)
+        for key in keys:
+            for chunk in postings[key]:
+                f.write(chunk)
+    os.replace(path + '.tmp', path)
+
+class Segment:
+    """A memory-mapped segment: sorted keys, each with its line numbers"""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.first, self.end, postings = SEGMENT_HEADER.unpack_from(self.map)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"{path} is not a log index segment")
+        view = memoryview(self.map)
+        self.table = view[SEGMENT_HEADER.size:SEGMENT_HEADER.size + self.count * KEY_ENTRY.size].cast('I')
+        self.postings = view[postings:].cast('I')
+
+    def key(self, index):
+        offset = self.table[4 * index]
+        return self.map[offset:offset + self.table[4 * index + 1]]
+
+    def lines(self, index):
+        start = self.table[4 * index + 2]
+        return self.postings[start:start + self.table[4 * index + 3]]
+
+    def lookup(self, key):
+        """Line numbers holding key, ascending, or None"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.key(low) == key:
+            return self.lines(low)
+        return None
+
+    def items(self):
+        for index in range(self.count):
+            yield self.key(index), self.lines(index)
+
+def contains(lines, line):
+    index = bisect.bisect_left(lines, line)
+    return index < len(lines) and lines[index] == line
+
+class Snapshot:
+    """The index as of one state.json, memory-mapped for lookups"""
+    def __init__(self, directory, state):
+        self.state = state
+        self.count = state['lines']
+        self.size = state['data_size']
+        self.segments = [Segment(os.path.join(directory, name)) for name, _, _ in state['segments']]
+        self.data = map_file(os.path.join(directory, 'entries.dat'), self.size)
+        self.starts = memoryview(map_file(os.path.join(directory, 'entries.idx'), self.count * 8)).cast('Q')
+        self.times = memoryview(map_file(os.path.join(directory, 'times.idx'), self.count * 4)).cast('I')
+
+    def line(self, number):
+        end = self.starts[number + 1] if number + 1 < self.count else self.size
+        return bytes(self.data[self.starts[number]:end]).decode('utf-8', 'replace').rstrip('\n')
+
+    def find(self, keys, since, until, limit):
+        """Numbers of the newest lines (at most limit) with every key, in [since, until), newest first"""
+        low = 0 if since is None else bisect.bisect_left(self.times, since)
+        high = self.count if until is None else bisect.bisect_left(self.times, until)
+        if not keys:
+            return list(range(high - 1, max(low, high - limit) - 1, -1))
+
+        found = []
+        for segment in reversed(self.segments):
+            if segment.first >= high:
+                continue
+            if segment.end <= low or len(found) >= limit:
+                break
+            postings = [segment.lookup(key) for key in keys]
+            if None in postings:
+                continue
+            postings.sort(key=len)
+            shortest, others = postings[0], postings[1:]
+            index = bisect.bisect_left(shortest, high) - 1
+            while index >= 0 and len(found) < limit:
+                line = shortest[index]
+                if line < low:
+                    break
+                if all(contains(lines, line) for lines in others):
+                    found.append(line)
+                index -= 1
+        return found
+
+def new_state():
+    return {'version': 1, 'generation': 0, 'log': None, 'lines': 0, 'data_size': 0,
+            'segments': [], 'next_segment': 0, 'last': [0, None, None]}
+
+def load_state(directory):
+    try:
+        with open(os.path.join(directory, 'state.json')) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    if state.get('version') != 1:
+        raise ValueError(f"{directory} holds an index this version cannot read; rebuild it")
+    return state
+
+class IndexWriter:
+    """One update: reads what the log gained and commits it in segments"""
+    def __init__(self, directory, log_file):
+        self.directory = directory
+        self.log_file = log_file
+        self.state = load_state(directory) or new_state()
+        self.parser = LineParser(self.state['last'])
+        self.postings = {}  # key -> array of line numbers, for the segment being built
+        self.data = bytearray()
+        self.starts = array.array('Q')
+        self.times = array.array('I')
+        self.added = 0
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def run(self):
+        for path, info, offset in self.sources():
+            self.read(path, info, offset)
+        self.commit()
+        return self.added
+
+    def sources(self):
+        """(path, stat, offset) of each file still to read, oldest first.
+
+        Rotated backups count: the file read last time may have been
+        renamed, and others rotated out after it.
+        """
+        files = []
+        for path in glob.glob(glob.escape(self.log_file) + '.*') + [self.log_file]:
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            if stat.S_ISREG(info.st_mode):
+                files.append((info.st_mtime_ns, path == self.log_file, path, info))
+        files.sort()
+
+        log = self.state['log']
+        if log is None:
+            return [(path, info, 0) for _, _, path, info in files]
+        for index, (_, _, path, info) in enumerate(files):
+            if (info.st_dev, info.st_ino) == (log['dev'], log['ino']):
+                offset = log['offset'] if info.st_size >= log['offset'] else 0  # Truncated: start over
+                return [(path, info, offset)] + [(path, info, 0) for _, _, path, info in files[index + 1:]]
+        # The file read last time is gone; lines written to it since are lost
+        return [(path, info, 0) for _, current, path, info in files if current]
+
+    def read(self, path, info, offset):
+        """Index complete lines from offset on; a rotated file's unterminated last line too"""
+        current = path == self.log_file
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            tail = b''
+            while True:
+                chunk = f.read(READ_SIZE)
+                if not chunk:
+                    break
+                lines = (tail + chunk).split(b'\n')
+                tail = lines.pop()
+                for line in lines:
+                    self.add(line)
+                offset += len(chunk)
+                self.state['log'] = {'path': path, 'dev': info.st_dev, 'ino': info.st_ino,
+                                     'offset': offset - len(tail)}
+                if len(self.times) >= SEGMENT_LINES:
+                    self.commit()
+            if tail and not current:
+                self.add(tail)
+            self.state['log'] = {'path': path, 'dev': info.st_dev, 'ino': info.st_ino,
+                                 'offset': offset - (len(tail) if current else 0)}
+
+    def add(self, line):
+        number = self.state['lines'] + len(self.times)
+        when, keys = self.parser.parse(line.decode('utf-8', 'replace'))
+        for key in keys:
+            key = key.encode()
+            lines = self.postings.get(key)
+            if lines is None:
+                lines = self.postings[key] = array.array('I')
+            lines.append(number)
+        self.starts.append(self.state['data_size'] + len(self.data))
+        self.data += line + b'\n'
+        self.times.append(when)
+
+    def commit(self):
+        """Append the lines read so far, write their segment and merge; then publish the new state"""
+        state = self.state
+        removed = []
+        if self.times:
+            for name, size, data in (('entries.dat', state['data_size'], self.data),
+                                     ('entries.idx', state['lines'] * 8, self.starts),
+                                     ('times.idx', state['lines'] * 4, self.times)):
+                with open(self.path(name), 'ab') as f:
+                    f.truncate(size)  # Drop whatever an interrupted update left past the state
+                    f.write(data)
+            first, end = state['lines'], state['lines'] + len(self.times)
+            name = self.segment_name()
+            write_segment(self.path(name), {key: [lines] for key, lines in self.postings.items()}, first, end)
+            state['segments'].append([name, first, end])
+            state['lines'] = end
+            state['data_size'] += len(self.data)
+            removed = self.merge()
+            self.added += len(self.times)
+            self.postings = {}
+            self.data = bytearray()
+            self.starts = array.array('Q')
+            self.times = array.array('I')
+
+        state['last'] = self.parser.last
+        state['generation'] += 1
+        with open(self.path('state.json.tmp'), 'w') as f:
+            json.dump(state, f)
+        os.replace(self.path('state.json.tmp'), self.path('state.json'))
+        for name in removed:
+            try:
+                os.remove(self.path(name))
+            except OSError:
+                pass  # Still mapped somewhere that cannot delete open files
+
+    def segment_name(self):
+        name = f"seg-{self.state['next_segment']:06d}.seg"
+        self.state['next_segment'] += 1
+        return name
+
+    def merge(self):
+        """Fold the newest segment into the one before while they are of similar size.
+
+        Segment sizes stay roughly geometric, so there are only about
+        log2(lines) of them; returns the files merged away.
+        """
+        segments = self.state['segments']
+        removed = []
+        while len(segments) >= 2:
+            (older, first, middle), (newer, _, end) = segments[-2:]
+            if middle - first > MERGE_FACTOR * (end - middle):
+                break
+            postings = {}
+            for segment in (Segment(self.path(older)), Segment(self.path(newer))):
+                for key, lines in segment.items():
+                    postings.setdefault(key, []).append(lines)
+            name = self.segment_name()
+            write_segment(self.path(name), postings, first, end)
+            segments[-2:] = [[name, first, end]]
+            removed += [older, newer]
+        return removed
+
+class LogIndex:
+    """Inverted index over a log file, kept in directory (see the module docstring)"""
+    def __init__(self, directory, log_file):
+        self.directory = directory
+        self.log_file = log_file
+        self.update_lock = threading.Lock()
+        self.current = None  # Latest Snapshot handed out
+
+    def update(self, wait=True):
+        """Index what the log gained since the last update.
+
+        Returns how many lines were added, or None without waiting when
+        wait is False and another thread or process is updating already.
+        """
+        if not self.update_lock.acquire(wait):
+            return None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, 'lock'), 'a') as lock:
+                if fcntl:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+                    except BlockingIOError:
+                        return None
+                return IndexWriter(self.directory, self.log_file).run()
+        finally:
+            self.update_lock.release()
+
+    def snapshot(self):
+        """The index as of the latest update, reusing the last one if nothing changed"""
+        for _ in range(3):
+            state = load_state(self.directory) or new_state()
+            current = self.current
+            if current and current.state == state:
+                return current
+            try:
+                self.current = Snapshot(self.directory, state)
+            except FileNotFoundError:
+                continue  # An update merged those segments away meanwhile
+            return self.current
+        raise RuntimeError("The search index kept changing while being opened")
+
+    def search(self, query, limit):
+        """The newest log lines (at most limit) matching query, oldest first"""
+        keys, since, until = parse_query(query)
+        snapshot = self.snapshot()
+        return [snapshot.line(number) for number in reversed(snapshot.find(keys, since, until, limit))]
+
+def create_log_index():
+    """Index of CONFIG['LOG_FILE'] in CONFIG['SEARCH_INDEX_DIR'], or None when search is disabled"""
+    if not CONFIG['SEARCH_INDEX_DIR'] or not CONFIG['LOG_FILE']:
+        return None
+    return LogIndex(CONFIG['SEARCH_INDEX_DIR'], CONFIG['LOG_FILE'])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('query', nargs='+', help='Words, from:user, level:name, since:TIME, until:TIME')
+    parser.add_argument('--limit', type=int, default=CONFIG['SEARCH_MAX_RESULTS'])
+    parser.add_argument('--log', default=CONFIG['LOG_FILE'])
+    parser.add_argument('--index', default=CONFIG['SEARCH_INDEX_DIR'] or 'chat_index')
+    parser.add_argument('--no-update', action='store_true', help='Search the index as it is')
+    parser.add_argument('--rebuild', action='store_true', help='Index the log again from scratch')
+    args = parser.parse_args()
+
+    if args.rebuild:
+        shutil.rmtree(args.index, ignore_errors=True)
+    index = LogIndex(args.index, args.log)
+    if not args.no_update:
+        started = time.perf_counter()
+        added = index.update()
+        print(f"Indexed {added} new lines in {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+
+    started = time.perf_counter()
+    try:
+        lines = index.search(' '.join(args.query), args.limit)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(2)
+    elapsed = time.perf_counter() - started
+    for line in lines:
+        print(line)
+    print(f"{len(lines)} lines in {elapsed * 1000:.2f} ms", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# metrics.py
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils import log_message
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MIN_SHARDS_BEFORE_PRUNE = 64  # New shards before dead threads' ones are folded in without a scrape
+
+class Metrics:
+    """Counters and histograms cheap enough to update on every message.
+
+    Each thread increments its own plain dict, so the hot path takes no
+    lock; a scrape sums the per-thread shards. Shards of threads that have
+    exited are folded into a retired total at each scrape, and whenever the
+    shard list doubles, so they do not pile up when nothing scrapes.
+    Gauges come from collector callbacks run at scrape time.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.shards = []   # (thread, shard dict) pairs
+        self.retired = {}  # Totals from threads that have exited
+        self.prune_at = MIN_SHARDS_BEFORE_PRUNE  # Shard count at which dead ones are next retired
+        self.definitions = {}  # name -> (kind, help, label name or buckets)
+        self.collectors = []   # (name, help, kind, callback)
+
+    def counter(self, name, help, label=None):
+        self.definitions[name] = ('counter', help, label)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        self.definitions[name] = ('histogram', help, buckets)
+
+    def collector(self, name, help, callback, kind='gauge', label=None):
+        """Report callback() at scrape time: a number, or a dict of label value -> number"""
+        self.collectors.append((name, help, kind, label, callback))
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = {}
+            with self.lock:
+                self.shards.append((threading.current_thread(), shard))
+                if len(self.shards) >= self.prune_at:
+                    self.retire()
+            return shard
+
+    def retire(self):
+        """Fold the shards of finished threads into the retired totals; caller holds the lock"""
+        live = []
+        for thread, shard in self.shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                for key, value in list(shard.items()):
+                    self.retired[key] = self.retired.get(key, 0) + value
+        self.shards = live
+        self.prune_at = max(MIN_SHARDS_BEFORE_PRUNE, 2 * len(live))
+
+    def inc(self, name, label=None, amount=1):
+        shard = self.shard()
+        key = (name, label)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, value):
+        shard = self.shard()
+        buckets = self.definitions[name][2]
+        key = (name, bisect.bisect_left(buckets, value))
+        shard[key] = shard.get(key, 0) + 1
+        key = (name, 'sum')
+        shard[key] = shard.get(key, 0) + value
+
+    def totals(self):
+        """Sum every shard, retiring those of finished threads"""
+        with self.lock:
+            self.retire()
+            live = list(self.shards)
+            totals = dict(self.retired)
+        for thread, shard in live:
+            # Copying a dict is atomic under the GIL, so a concurrent inc cannot break this
+            for key, value in list(shard.items()):
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        totals = self.totals()
+        lines = []
+        for name, (kind, help, extra) in self.definitions.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'counter':
+                values = {label: value for (metric, label), value in totals.items() if metric == name}
+                if not values:
+                    if extra is None:
+                        lines.append(f"{name} 0")
+                    continue
+                for label, value in sorted(values.items(), key=lambda item: str(item[0])):
+                    lines.append(sample(name, extra, label, value))
+            else:
+                cumulative = 0
+                for index, bound in enumerate(extra):
+                    cumulative += totals.get((name, index), 0)
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+                cumulative += totals.get((name, len(extra)), 0)
+                lines.append(f'{name}_bucket{{le="+Inf"}} {cumulative}')
+                lines.append(f"{name}_sum {totals.get((name, 'sum'), 0)}")
+                lines.append(f"{name}_count {cumulative}")
+
+        for name, help, kind, label, callback in self.collectors:
+            try:
+                value = callback()
+            except Exception as e:
+                log_message(f"Metrics collector {name} failed: {e}", 'error')
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if isinstance(value, dict):
+                for label_value, number in sorted(value.items()):
+                    lines.append(sample(name, label, label_value, number))
+            else:
+                lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+def sample(name, label, value, number):
+    if label is None or value is None:
+        return f"{name} {number}"
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'{name}{{{label}="{value}"}} {number}'
+
+METRICS = Metrics()
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = METRICS.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would flood the console
+
+def start_metrics_server(host, port):
+    """Serve /metrics from a daemon thread; None if the port is unavailable"""
+    try:
+        httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        log_message(f"Metrics endpoint disabled, could not bind {host}:{port}: {e}", 'warning')
+        return None
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True, name="metrics").start()
+    return httpd
@@ -1,45 +1,212 @@
+import itertools
 import json
-from datetime import datetime
+import socket
+import time
+from outbox import Outbox, SlowConsumerError
+from protocol import (FRAMING_BINARY, TAG_DEFLATE, add_definitions, decode_binary,
+                      encode_message, inflate, make_decoder, send_frames)
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+SEQUENCE = itertools.count(1)  # Server-wide numbering of messages sent to clients
+
+def continue_sequence(start):
+    """Number messages from start, carrying on from the server this process took over from"""
+    global SEQUENCE
+    SEQUENCE = itertools.count(start)
+
+def next_sequence():
+    return next(SEQUENCE)
 
 class Message:
-    def __init__(self, type, content, sender, recipient=None):
+    __slots__ = ('type', 'content', 'sender', 'recipient', 'room',
+                 'created', 'formatted', 'encoded', 'seq')
+
+    def __init__(self, type, content, sender, recipient=None, room=None, created=None, seq=None):
         self.type = type
         self.content = content
         self.sender = sender
         self.recipient = recipient
-        self.timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.room = room
+        self.created = time.time() if created is None else created  # Epoch seconds
+        self.formatted = None  # Display timestamp, built on first use
+        self.encoded = {}  # framing (or (framing, True) compressed) -> wire bytes shared by every recipient
+        self.seq = seq  # Set by the server when the message is first sent
 
-    def to_json(self):
-        """Convert message to JSON string with proper encoding"""
+    @property
+    def timestamp(self):
+        if self.formatted is None:
+            self.formatted = time.strftime(TIMESTAMP_FORMAT, time.localtime(self.created))
+        return self.formatted
+
+    @timestamp.setter
+    def timestamp(self, value):
+        """Adopt a display timestamp received as text (JSON or history)"""
+        self.formatted = value
+        self.created = None
+
+    @property
+    def epoch_ms(self):
+        if self.created is None:
+            try:
+                self.created = time.mktime(time.strptime(self.formatted, TIMESTAMP_FORMAT))
+            except (TypeError, ValueError):
+                self.created = time.time()
+        return int(self.created * 1000)
+
+    def to_frame(self, framing=None, compress=False):
+        """Encode the message for a framing once and reuse the bytes afterwards"""
+        key = (framing, True) if compress else framing
+        frame = self.encoded.get(key)
+        if frame is None:
+            frame = self.encoded[key] = encode_message(self, framing, compress)
+        return frame
+
+    def to_dict(self):
         data = {
             'type': self.type,
             'content': self.content,
             'sender': self.sender,
             'recipient': self.recipient,
+            'room': self.room,
             'timestamp': self.timestamp
         }
-        return json.dumps(data)  # Remove newline addition
+        if self.seq is not None:
+            data['seq'] = self.seq
+        return data
+
+    def to_json(self):
+        """Convert message to JSON string with proper encoding"""
+        return json.dumps(self.to_dict())  # Remove newline addition
+
+    @staticmethod
+    def from_dict(data):
+        msg = Message(
+            type=data.get('type', 'chat'),
+            content=data.get('content', ''),
+            sender=data.get('sender', 'unknown'),
+            recipient=data.get('recipient'),
+            room=data.get('room'),
+            seq=data.get('seq')
+        )
+        if data.get('timestamp'):
+            msg.timestamp = data['timestamp']
+        return msg
 
     @staticmethod
     def from_json(json_str):
         """Parse JSON string to Message object with proper handling"""
         try:
             json_str = json_str.strip()
-            data = json.loads(json_str)
-            msg = Message(
-                type=data.get('type', 'chat'),
-                content=data.get('content', ''),
-                sender=data.get('sender', 'unknown')
-            )
-            msg.timestamp = data.get('timestamp', datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-            msg.recipient = data.get('recipient')
-            return msg
+            return Message.from_dict(json.loads(json_str))
         except json.JSONDecodeError as e:
             print(f"Error decoding message: {e}")
             return Message('error', 'Invalid message format', 'System')
+
+    @staticmethod
+    def from_wire(payload, names):
+        """Decode a frame payload in JSON (plain or deflated) or binary form.
+
+        names maps the connection's sender ids to names; binary define frames
+        update it and return None.
+        """
+        if payload[:1] == b'{':
+            return Message.from_json(payload.decode())
+        if payload[0] == TAG_DEFLATE:
+            return Message.from_json(inflate(payload[1:]).decode())
+        fields = decode_binary(payload, names)
+        if fields is None:
+            return None
+        type, content, sender, recipient, room, epoch_ms, seq = fields
+        return Message(type, content, sender, recipient, room, epoch_ms / 1000, seq)
+
 class Client:
-    def __init__(self, connection, address, username):
+    outbox_class = Outbox
+
+    def __init__(self, connection, address, username, framing=None, transport=None):
         self.connection = connection
+        self.send_frames = transport.send_frames if transport else send_frames
         self.address = address
         self.username = username
-        self.buffer = ""  # Add buffer for incomplete messages
+        self.framing = framing  # None for legacy clients that send bare JSON
+        self.compress = False  # Whether large frames to this client are deflated
+        self.room = None  # Set by RoomManager
+        self.decoder = make_decoder(framing)  # Reassembles incomplete messages
+        self.names = {}      # Sender ids this client has defined (binary framing)
+        self.defined = set()  # Sender ids this client has been sent a define frame for
+        self.outbox = self.outbox_class(self)  # Frames waiting for the writer
+        self.heartbeat = False  # Whether the client answers pings
+        self.last_seen = time.monotonic()  # When anything was last read from it
+        self.pinged = 0.0  # When it was last pinged
+        self.buckets = {}  # Message kind -> TokenBucket, created on first use
+        self.throttled = set()  # Kinds the client has been told it is sending too fast
+        self.session = None  # Session the client can resume after losing the connection
+        self.detached = None  # When the connection was lost, while the session waits
+        self.replaced_by = None  # Client that resumed this one's session
+        self.reader = None  # Thread (or task) reading from the connection
+        self.handed_off = False  # Connection passed to a new server process, which must keep it open
+
+    def start(self):
+        """Start the writer that drains this client's outbox"""
+        self.outbox.start()
+
+    def send_message(self, message):
+        """Queue message for this client's writer"""
+        self.send_messages([message])
+
+    def send_messages(self, messages, record=True):
+        """Queue several messages; the writer batches them into one syscall.
+
+        Each message gets its sequence number before it is first encoded,
+        so every recipient sees the same one. With a session, record=True
+        also keeps the messages for replay after a reconnect.
+        """
+        for message in messages:
+            if message.seq is None:
+                message.seq = next(SEQUENCE)
+        frames = [message.to_frame(self.framing, self.compress) for message in messages]
+        session = self.session
+        if session is None:
+            queued = self.outbox.put(frames)
+        else:
+            # Buffer and queue under one lock so the buffer is in the order the client receives
+            with self.outbox.ready:
+                successor = self.replaced_by
+                if successor is None:
+                    if record:
+                        session.record(messages)
+                    queued = self.outbox.put(frames)
+            if successor is not None:
+                successor.send_messages(messages, record)
+                return
+        if not queued:
+            raise SlowConsumerError(f"{self.username} is too slow to keep up")
+
+    def wire_frames(self, frames):
+        """Frames as they go on the wire; called only from the writer"""
+        if self.framing == FRAMING_BINARY:
+            return add_definitions(frames, self.defined)
+        return frames
+
+    def write_frames(self, frames):
+        """Write frames to the socket; called only from the writer"""
+        if self.framing:
+            self.send_frames(self.connection, self.wire_frames(frames))
+        else:
+            # Legacy clients read one message per recv, so keep sends separate
+            for frame in frames:
+                self.connection.sendall(frame)
+
+    def abort(self):
+        """Shut the socket down so a blocked recv returns"""
+        if self.handed_off:
+            return  # Shutting down would end the connection for the new process too
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self, timeout=0):
+        """Close the connection, first flushing queued messages for up to timeout seconds"""
+        self.outbox.close(timeout)
+        self.abort()
+        self.connection.close()
@@ -0,0 +1,110 @@
+# outbox.py
+import threading
+from collections import deque
+from config import CONFIG
+from protocol import IOV_MAX
+
+OVERFLOW_POLICIES = ('drop_oldest', 'disconnect', 'coalesce')
+
+class SlowConsumerError(ConnectionError):
+    """Raised when a client's outbox overflows under the 'disconnect' policy"""
+
+class Outbox:
+    """Bounded queue of encoded frames drained by a dedicated writer thread.
+
+    Senders only append to the queue, so a client with a full TCP window
+    delays its own messages instead of everyone else's.
+    """
+    def __init__(self, client):
+        self.client = client
+        self.frames = deque()
+        self.queued_bytes = 0
+        self.capacity = CONFIG['OUTBOX_SIZE']
+        self.policy = CONFIG['OUTBOX_POLICY']
+        self.ready = threading.Condition()
+        self.closed = False
+        self.writer = None
+
+        # Metrics
+        self.high_water = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.evicted = False
+
+    def start(self):
+        self.writer = threading.Thread(target=self.run, daemon=True,
+                                       name=f"writer-{self.client.username}")
+        self.writer.start()
+
+    def depth(self):
+        return len(self.frames)
+
+    def put(self, frames):
+        """Queue frames for the writer; return False if the client must be disconnected"""
+        with self.ready:
+            if self.closed:
+                return True
+            for frame in frames:
+                if len(self.frames) >= self.capacity and not self.make_room():
+                    self.evicted = True
+                    return False
+                self.frames.append(frame)
+                self.queued_bytes += len(frame)
+            self.high_water = max(self.high_water, len(self.frames))
+            self.wake()
+        return True
+
+    def make_room(self):
+        """Apply the overflow policy to a full queue; False means disconnect"""
+        if self.policy == 'disconnect':
+            return False
+
+        # Coalescing merges the backlog into one buffer, which only framed clients can split again
+        if self.policy == 'coalesce' and self.client.framing:
+            if self.queued_bytes > CONFIG['OUTBOX_MAX_BYTES']:
+                return False
+            merged = b''.join(self.frames)
+            self.frames.clear()
+            self.frames.append(merged)
+            self.coalesced += 1
+            return True
+
+        self.queued_bytes -= len(self.frames.popleft())
+        self.dropped += 1
+        return True
+
+    def take_batch(self):
+        """Pop up to one sendmsg call's worth of frames; caller holds the lock"""
+        batch = []
+        while self.frames and len(batch) < IOV_MAX:
+            frame = self.frames.popleft()
+            self.queued_bytes -= len(frame)
+            batch.append(frame)
+        return batch
+
+    def wake(self):
+        self.ready.notify()
+
+    def run(self):
+        try:
+            while True:
+                with self.ready:
+                    while not self.frames and not self.closed:
+                        self.ready.wait()
+                    batch = self.take_batch()
+                if not batch:
+                    break
+                self.client.write_frames(batch)
+        except OSError:
+            pass
+        finally:
+            # Wake the reader so its loop ends and the client is removed
+            self.client.abort()
+
+    def close(self, timeout=0):
+        """Stop accepting frames, giving the writer up to timeout seconds to flush"""
+        with self.ready:
+            self.closed = True
+            self.wake()
+        if timeout and self.writer and self.writer is not threading.current_thread():
+            self.writer.join(timeout)
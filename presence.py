@@ -0,0 +1,106 @@
+# presence.py
+import bisect
+import itertools
+import secrets
+import threading
+from collections import deque
+from protocol import format_roster
+
+class Presence:
+    """Versioned roster of online users, with join/leave notices batched per room.
+
+    Every change bumps the version and goes in a bounded log, so a client
+    that last saw version v can be sent only what changed since. Notices
+    wait for take_notices(), which the server calls every PRESENCE_INTERVAL:
+    a reconnect storm then costs each user one notice per interval instead
+    of one per reconnecting user, and a leave followed by a join cancels out.
+    The sorted name list for full replies is updated from the same batch,
+    by bisection, so a storm does not re-sort the roster.
+    """
+    def __init__(self, log_size):
+        self.lock = threading.Lock()
+        self.epoch = secrets.token_hex(4)  # Tokens from an earlier server never match
+        self.version = 0
+        self.online = set()
+        self.changes = deque(maxlen=log_size)  # (version, username, online)
+        self.pending = {}  # room -> {username: True if joined, False if left}
+        self.unlisted = {}  # username -> online, net changes not yet in sorted_names
+        self.sorted_names = []  # Online users in order, as of the last flush
+        self.user_list = None  # Cached ', '.join(sorted_names)
+
+    def token(self):
+        return f"{self.epoch}.{self.version}"
+
+    def update(self, username, online, room=None):
+        """Record a user coming online or going offline; room None sends no notice"""
+        with self.lock:
+            if online == (username in self.online):
+                return
+            if online:
+                self.online.add(username)
+            else:
+                self.online.discard(username)
+            self.version += 1
+            self.changes.append((self.version, username, online))
+            if username in self.unlisted:
+                del self.unlisted[username]  # Flipped back before the list was updated
+            else:
+                self.unlisted[username] = online
+            if room is not None:
+                events = self.pending.setdefault(room, {})
+                if events.get(username) == (not online):
+                    del events[username]  # Left and came back (or the reverse) before anyone was told
+                else:
+                    events[username] = online
+
+    def take_notices(self):
+        """room -> {username: joined} for the changes since the last call"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.update_list()
+        return {room: events for room, events in pending.items() if events}
+
+    def update_list(self):
+        """Apply the net changes since the last flush to sorted_names; caller holds the lock"""
+        if not self.unlisted:
+            return
+        names = self.sorted_names
+        for username, online in self.unlisted.items():
+            if online:
+                bisect.insort(names, username)
+            else:
+                del names[bisect.bisect_left(names, username)]
+        self.unlisted = {}
+        self.user_list = None
+
+    def changes_since(self, token):
+        """username -> online for everything after token, or None if the log cannot tell"""
+        epoch, _, version = token.partition('.')
+        if epoch != self.epoch or not version.isdigit():
+            return None
+        version = int(version)
+        if version > self.version:
+            return None
+        first = self.changes[0][0] if self.changes else self.version + 1
+        if version < first - 1:
+            return None  # Older than the log reaches
+        before = {}
+        net = {}
+        for _, username, online in itertools.islice(self.changes, max(version - first + 1, 0), None):
+            before.setdefault(username, not online)  # Every change flips the state
+            net[username] = online
+        # Whoever dropped and came back (or the reverse) since then has not changed
+        return {username: online for username, online in net.items() if online != before[username]}
+
+    def users(self, since=None):
+        """Reply for /users: what changed since an earlier reply's token, else everyone"""
+        with self.lock:
+            changes = self.changes_since(since) if since else None
+            # After a storm the full list can be the shorter reply
+            if changes is not None and len(changes) < len(self.online):
+                return format_roster(changes, self.token(), since)
+            # Changes since the last flush, so the list matches the token
+            self.update_list()
+            if self.user_list is None:
+                self.user_list = ', '.join(self.sorted_names)
+            return format_roster(self.user_list, self.token())
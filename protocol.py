@@ -0,0 +1,344 @@
+# protocol.py
+import re
+import struct
+import threading
+import zlib
+from config import CONFIG
+
+# Framing offered by clients after their username in the handshake, in order of preference
+FRAMING_LENGTH_PREFIX = 'lp1'  # Length-prefixed JSON
+FRAMING_BINARY = 'bin1'        # Length-prefixed compact binary (see encode_binary)
+SUPPORTED_FRAMINGS = (FRAMING_BINARY, FRAMING_LENGTH_PREFIX)
+FEATURE_HEARTBEAT = 'hb1'       # Client answers the server's pings with pongs
+FEATURE_SESSION = 'sess1'       # Client accepts a session token and can resume with it
+RESUME_PREFIX = 'resume='       # 'resume=<token>:<last seq>' asks to resume a session
+FEATURE_COMPRESSION = 'z1'      # Large payloads may be deflated (see compress_payload)
+
+# Connection bookkeeping rather than conversation: never buffered or replayed
+CONTROL_TYPES = ('handshake', 'session', 'ping', 'pong')
+
+HEADER = struct.Struct('!I')  # 4-byte big-endian payload length
+IOV_MAX = 1024  # Most buffers a single sendmsg call accepts on Linux
+
+# Binary payloads start with a small type tag; JSON payloads always start with '{'
+# (0x7b), so a receiver can tell the two apart frame by frame.
+TYPE_TAGS = {'chat': 1, 'status': 2, 'command': 3, 'dm': 4, 'handshake': 5, 'error': 6,
+             'ping': 7, 'pong': 8, 'session': 9}
+TAG_TYPES = {tag: type for type, tag in TYPE_TAGS.items()}
+TAG_DEFINE = 0  # Binds a sender id to its name for the rest of the connection
+TAG_DEFLATE = 0x7a  # 'z': the rest of the payload is a deflated JSON payload
+
+BINARY_HEADER = struct.Struct('!BBQI')  # type tag, flags, epoch milliseconds, sender id
+DEFINE_HEADER = struct.Struct('!BI')    # TAG_DEFINE, sender id; the name follows
+STRING_LENGTH = struct.Struct('!H')
+SEQUENCE = struct.Struct('!Q')
+HAS_RECIPIENT = 1
+HAS_ROOM = 2
+HAS_SEQ = 4
+DEFLATED = 8  # The content is deflated
+
+# Preset dictionary for deflate. Every frame is compressed on its own, so one
+# compressed broadcast can go to every recipient and be replayed later; the
+# dictionary stands in for the context a stream would share across frames.
+# zlib finds strings near the end soonest, so the most common come last.
+ZDICT = (
+    b'Server Chatbot status command error dm joined the chat left the chat '
+    b'because there would which their about could other these should people think '
+    b'what when your have with that this from will they just like know more also '
+    b'the and for you are not but can all was one has it is to of in a I '
+    b'"recipient": null, "room": null, "timestamp": "20'
+    b'{"type": "chat", "content": "'
+    b'", "sender": "Chatbot", "recipient": null, "room": "lobby", "timestamp": "20'
+)
+# A 4KB window and small memLevel: chat payloads are short, and setting up a
+# full-size compressor would cost more than compressing them
+DEFLATE_WBITS = -12
+DEFLATE_MEMLEVEL = 6
+
+def parse_handshake(data):
+    """Split the handshake into username and offered protocol features"""
+    username, _, features = data.decode().partition(' ')
+    return username, features.split()
+
+def parse_resume(features):
+    """Session token and last sequence number from a resume feature, or (None, 0)"""
+    for feature in features:
+        if feature.startswith(RESUME_PREFIX):
+            token, _, seq = feature[len(RESUME_PREFIX):].partition(':')
+            return token, int(seq) if seq.isdigit() else 0
+    return None, 0
+
+# '/users' replies end with a roster token; sending it back with the next
+# '/users' asks for only the changes: '+name' came online, '-name' left
+ROSTER_REPLY = re.compile(r'Online users(?: since (\S+))?: (.*) \(roster (\S+)\)$')
+
+def format_roster(users, token, since=None):
+    """Reply content: users is the comma-separated list, or a username -> online dict since a token"""
+    if since is None:
+        return f"Online users: {users} (roster {token})"
+    changes = ', '.join(('+' if online else '-') + name for name, online in users.items())
+    return f"Online users since {since}: {changes} (roster {token})"
+
+def parse_roster(content):
+    """(since token or None, names or +/- changes, token) from a '/users' reply, else None"""
+    match = ROSTER_REPLY.match(content)
+    if match is None:
+        return None
+    since, users, token = match.groups()
+    return since, users.split(', ') if users else [], token
+
+def encode_frame(payload):
+    """Prefix payload bytes with their length"""
+    return HEADER.pack(len(payload)) + payload
+
+def deflate(data):
+    """Raw deflate of one payload against ZDICT"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, DEFLATE_WBITS, DEFLATE_MEMLEVEL,
+                                  zlib.Z_DEFAULT_STRATEGY, ZDICT)
+    return compressor.compress(data) + compressor.flush()
+
+def inflate(data):
+    """Undo deflate, refusing output larger than MAX_FRAME_SIZE"""
+    decompressor = zlib.decompressobj(DEFLATE_WBITS, zdict=ZDICT)
+    output = decompressor.decompress(data, CONFIG['MAX_FRAME_SIZE'])
+    if decompressor.unconsumed_tail:
+        raise ValueError("Compressed payload exceeds MAX_FRAME_SIZE")
+    return output
+
+def compress_payload(payload):
+    """Deflated JSON payload behind TAG_DEFLATE, if it is large enough and it helps"""
+    threshold = CONFIG['COMPRESSION_THRESHOLD']
+    if threshold is None or len(payload) < threshold:
+        return payload
+    packed = bytes((TAG_DEFLATE,)) + deflate(payload)
+    return packed if len(packed) < len(payload) else payload
+
+def encode_message(message, framing=None, compress=False):
+    """Encode a Message for a connection using the given framing.
+
+    compress is only for framed connections that negotiated FEATURE_COMPRESSION.
+    """
+    if framing == FRAMING_BINARY:
+        return encode_frame(encode_binary(message, compress))
+    payload = message.to_json().encode()
+    if framing == FRAMING_LENGTH_PREFIX:
+        return encode_frame(compress_payload(payload) if compress else payload)
+    return payload
+
+class SenderTable:
+    """Process-wide sender name <-> id table for the binary format.
+
+    Ids are never reused, so a frame encoded once can be shared by every
+    connection; each connection only has to have seen the define frame for
+    the ids it receives. The table holds one entry per distinct sender.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = {}
+        self.definitions = []  # sender id -> encoded define frame
+
+    def id_for(self, name):
+        sender_id = self.ids.get(name)
+        if sender_id is None:
+            with self.lock:
+                sender_id = self.ids.get(name)
+                if sender_id is None:
+                    sender_id = len(self.definitions)
+                    payload = DEFINE_HEADER.pack(TAG_DEFINE, sender_id) + name.encode()
+                    self.definitions.append(encode_frame(payload))
+                    self.ids[name] = sender_id
+        return sender_id
+
+    def definition(self, sender_id):
+        return self.definitions[sender_id]
+
+SENDERS = SenderTable()
+
+def encode_binary(message, compress=False):
+    """Compact payload: fixed header, optional sequence number, recipient and room, then the content.
+
+    With compress, content over COMPRESSION_THRESHOLD is deflated; the
+    header stays readable so define frames still work. Message types
+    without a tag fall back to a JSON payload.
+    """
+    tag = TYPE_TAGS.get(message.type)
+    if tag is None:
+        payload = message.to_json().encode()
+        return compress_payload(payload) if compress else payload
+
+    flags = 0
+    parts = [b'']
+    if message.seq is not None:
+        flags |= HAS_SEQ
+        parts.append(SEQUENCE.pack(message.seq))
+    for flag, value in ((HAS_RECIPIENT, message.recipient), (HAS_ROOM, message.room)):
+        if value is not None:
+            flags |= flag
+            value = value.encode()
+            parts.append(STRING_LENGTH.pack(len(value)))
+            parts.append(value)
+    content = message.content.encode()
+    threshold = CONFIG['COMPRESSION_THRESHOLD']
+    if compress and threshold is not None and len(content) >= threshold:
+        packed = deflate(content)
+        if len(packed) < len(content):
+            flags |= DEFLATED
+            content = packed
+    parts.append(content)
+    parts[0] = BINARY_HEADER.pack(tag, flags, message.epoch_ms, SENDERS.id_for(message.sender))
+    return b''.join(parts)
+
+def decode_binary(payload, names):
+    """Decode a binary payload into Message fields.
+
+    Define frames update names (sender id -> name) and return None.
+    """
+    if payload[0] == TAG_DEFINE:
+        _, sender_id = DEFINE_HEADER.unpack_from(payload)
+        names[sender_id] = bytes(payload[DEFINE_HEADER.size:]).decode()
+        return None
+
+    tag, flags, epoch_ms, sender_id = BINARY_HEADER.unpack_from(payload)
+    offset = BINARY_HEADER.size
+    seq = None
+    if flags & HAS_SEQ:
+        (seq,) = SEQUENCE.unpack_from(payload, offset)
+        offset += SEQUENCE.size
+    strings = []
+    for flag in (HAS_RECIPIENT, HAS_ROOM):
+        if flags & flag:
+            (length,) = STRING_LENGTH.unpack_from(payload, offset)
+            offset += STRING_LENGTH.size
+            strings.append(bytes(payload[offset:offset + length]).decode())
+            offset += length
+        else:
+            strings.append(None)
+    content = payload[offset:]
+    content = (inflate(content) if flags & DEFLATED else bytes(content)).decode()
+    return (TAG_TYPES.get(tag, 'chat'), content, names.get(sender_id, 'unknown'),
+            strings[0], strings[1], epoch_ms, seq)
+
+def add_definitions(frames, defined):
+    """Precede binary frames with define frames for sender ids the peer has not seen.
+
+    defined is the per-connection set of ids already sent. Buffers may hold
+    several frames (a coalesced backlog), so each one is walked frame by
+    frame; defines only have to arrive before the buffer that uses them.
+    """
+    output = []
+    for buffer in frames:
+        position = 0
+        while position < len(buffer):
+            (length,) = HEADER.unpack_from(buffer, position)
+            payload = position + HEADER.size
+            if length >= BINARY_HEADER.size and buffer[payload] in TAG_TYPES:
+                sender_id = BINARY_HEADER.unpack_from(buffer, payload)[3]
+                if sender_id not in defined:
+                    defined.add(sender_id)
+                    output.append(SENDERS.definition(sender_id))
+            position = payload + length
+        output.append(buffer)
+    return output
+
+def send_frames(sock, frames):
+    """Write several frames with one scatter-gather syscall, resuming partial writes"""
+    if len(frames) == 1:
+        sock.sendall(frames[0])
+        return
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(frames))
+        return
+
+    buffers = [memoryview(frame) for frame in frames]
+    first = 0
+    while first < len(buffers):
+        sent = sock.sendmsg(buffers[first:first + IOV_MAX])
+        while sent and sent >= len(buffers[first]):
+            sent -= len(buffers[first])
+            first += 1
+        if sent:
+            buffers[first] = buffers[first][sent:]
+
+def make_decoder(framing=None):
+    if framing in SUPPORTED_FRAMINGS:
+        return FrameDecoder()
+    return RawDecoder()
+
+class RawDecoder:
+    """Legacy decoding: every read is assumed to hold exactly one message"""
+    def feed(self, data):
+        return [bytes(data)] if data else []
+
+    def read_from(self, sock):
+        data = sock.recv(CONFIG['BUFFER_SIZE'])
+        if not data:
+            return None
+        return [data]
+
+    def pending(self):
+        return b''
+
+class FrameDecoder:
+    """Streaming decoder that reassembles length-prefixed frames.
+
+    Reads land directly in a reusable per-connection bytearray, and every
+    complete frame found after a read is returned at once.
+    """
+    def __init__(self, size=None):
+        self.buffer = bytearray(size or CONFIG['BUFFER_SIZE'])
+        self.view = memoryview(self.buffer)
+        self.start = 0  # first unconsumed byte
+        self.end = 0    # end of received data
+
+    def read_from(self, sock):
+        """Receive once from sock; return complete frames, or None on EOF"""
+        self.reserve(1)
+        count = sock.recv_into(self.view[self.end:])
+        if not count:
+            return None
+        self.end += count
+        return self.frames()
+
+    def feed(self, data):
+        """Append bytes from an external read and return complete frames"""
+        self.reserve(len(data))
+        self.view[self.end:self.end + len(data)] = data
+        self.end += len(data)
+        return self.frames()
+
+    def pending(self):
+        """Bytes received but not yet part of a complete frame"""
+        return bytes(self.view[self.start:self.end])
+
+    def frames(self):
+        frames = []
+        while self.end - self.start >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer, self.start)
+            if length > CONFIG['MAX_FRAME_SIZE']:
+                raise ValueError(f"Frame of {length} bytes exceeds MAX_FRAME_SIZE")
+            frame_end = self.start + HEADER.size + length
+            if frame_end > self.end:
+                # Make sure the rest of this frame will fit on the next read
+                self.reserve(frame_end - self.end)
+                break
+            frames.append(bytes(self.view[self.start + HEADER.size:frame_end]))
+            self.start = frame_end
+
+        if self.start == self.end:
+            self.start = self.end = 0
+        return frames
+
+    def reserve(self, count):
+        """Ensure count free bytes after end, compacting or growing the buffer"""
+        if len(self.buffer) - self.end >= count:
+            return
+        pending = self.end - self.start
+        if pending + count > len(self.buffer):
+            buffer = bytearray(max(len(self.buffer) * 2, pending + count))
+            buffer[:pending] = self.view[self.start:self.end]
+            self.view.release()
+            self.buffer = buffer
+            self.view = memoryview(self.buffer)
+        else:
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+        self.start, self.end = 0, pending
@@ -0,0 +1,56 @@
+# ratelimit.py
+import threading
+import time
+
+class TokenBucket:
+    """Allows rate events per second with bursts of up to burst.
+
+    Refilled from the elapsed time whenever a token is taken, so an idle
+    bucket costs nothing and no timer is needed.
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if tokens < 1:
+            self.tokens = tokens
+            return False
+        self.tokens = tokens - 1
+        return True
+
+class RateLimiter:
+    """Per-user and server-wide token buckets for each kind of message.
+
+    A user's buckets live in a dict on their Client and are only touched
+    by the thread reading from that client; the global buckets are shared
+    and take a lock. Kinds without a configured limit are always allowed.
+    """
+    def __init__(self, user_limits, global_limits):
+        now = time.monotonic()
+        self.user_limits = user_limits  # kind -> (rate, burst)
+        self.global_buckets = {kind: TokenBucket(rate, burst, now)
+                               for kind, (rate, burst) in global_limits.items()}
+        self.lock = threading.Lock()
+
+    def allow(self, buckets, kind):
+        """Take a token for kind from a user's buckets and the global one"""
+        now = time.monotonic()
+        limit = self.user_limits.get(kind)
+        if limit:
+            bucket = buckets.get(kind)
+            if bucket is None:
+                bucket = buckets[kind] = TokenBucket(limit[0], limit[1], now)
+            if not bucket.take(now):
+                return False
+        shared = self.global_buckets.get(kind)
+        if shared:
+            with self.lock:
+                return shared.take(now)
+        return True
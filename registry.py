@@ -0,0 +1,83 @@
+# registry.py
+import threading
+
+class ClientRegistry:
+    """Thread-safe username -> Client map.
+
+    Writers take a lock and drop the tuple of (username, client) pairs;
+    the next reader rebuilds it, so broadcast loops iterate a snapshot
+    without locking and never see the map change underneath them. A burst
+    of connects costs one copy, not one per connect, and the lock is only
+    held for O(1) dict updates, so one lock is enough. Lookups are plain
+    dict reads.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.reserved = set()      # Usernames claimed by handshakes in progress
+        self.snapshot = ()         # Immutable (username, client) pairs, or None until the next read
+
+    def reserve(self, username):
+        """Atomically claim a username; False if it is taken or being claimed"""
+        with self.lock:
+            if username in self.clients or username in self.reserved:
+                return False
+            self.reserved.add(username)
+            return True
+
+    def release(self, username):
+        """Give up a reservation that never became a client"""
+        with self.lock:
+            self.reserved.discard(username)
+
+    def add(self, client):
+        with self.lock:
+            self.reserved.discard(client.username)
+            self.clients[client.username] = client
+            self.snapshot = None
+
+    def replace(self, client):
+        """Register client in place of the one with its username (a resumed session)"""
+        with self.lock:
+            self.clients[client.username] = client
+            self.snapshot = None
+
+    def remove(self, username, client=None):
+        """Remove and return a client, or None if another thread got there first.
+
+        With client given, only remove it if it is still the registered one.
+        """
+        with self.lock:
+            current = self.clients.get(username)
+            if current is None or (client is not None and current is not client):
+                return None
+            del self.clients[username]
+            self.snapshot = None
+            return current
+
+    def clear(self):
+        with self.lock:
+            self.clients = {}
+            self.snapshot = ()
+
+    def get(self, username):
+        return self.clients.get(username)
+
+    def __contains__(self, username):
+        return username in self.clients
+
+    def __len__(self):
+        return len(self.clients)
+
+    def items(self):
+        """Snapshot of (username, client) pairs; safe to iterate while others join or leave"""
+        snapshot = self.snapshot
+        if snapshot is None:
+            with self.lock:
+                if self.snapshot is None:
+                    self.snapshot = tuple(self.clients.items())
+                snapshot = self.snapshot
+        return snapshot
+
+    def values(self):
+        return [client for _, client in self.items()]
@@ -0,0 +1,98 @@
+# render.py
+import itertools
+import sys
+import threading
+import time
+from collections import deque
+from config import CONFIG
+from utils import colored, format_message
+
+class Renderer:
+    """Draws incoming messages in batches, at most CLIENT_RENDER_FPS frames a second.
+
+    The receiving thread only formats and queues each message; a render
+    thread writes everything queued since the last frame with one write,
+    clearing and redrawing the input prompt once per frame instead of once
+    per message. The scrollback keeps the last CLIENT_SCROLLBACK lines, so
+    when a flood outruns the terminal, lines that have already fallen out
+    of it are counted as skipped instead of drawn.
+    """
+    def __init__(self, out=None, fps=None, scrollback=None, prompt=None):
+        self.out = out  # None writes to whatever sys.stdout is at the time
+        fps = CONFIG['CLIENT_RENDER_FPS'] if fps is None else fps
+        self.interval = 1.0 / fps if fps else None  # None draws each message at once
+        self.scrollback = deque(maxlen=scrollback or CONFIG['CLIENT_SCROLLBACK'])
+        self.prompt = prompt  # Returns the input line to redraw under new lines, or None
+        self.undrawn = 0      # Newest lines in the scrollback not on screen yet
+        self.skipped = 0      # Lines that left the scrollback before they were drawn
+        self.ready = threading.Condition()
+        self.running = False
+        self.thread = None
+
+        # Metrics
+        self.frames = 0
+        self.lines = 0
+        self.dropped = 0      # Lines never drawn, in all
+
+    def start(self):
+        if self.interval is None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True, name='renderer')
+        self.thread.start()
+
+    def add(self, msg):
+        """Queue a message for the next frame"""
+        self.add_line(format_message(msg))
+
+    def add_line(self, line):
+        with self.ready:
+            self.scrollback.append(line)
+            if self.undrawn == self.scrollback.maxlen:
+                self.skipped += 1
+                self.dropped += 1
+            else:
+                self.undrawn += 1
+            if self.interval is None:
+                self.draw()
+            elif self.undrawn == 1:
+                self.ready.notify()  # Only an idle render thread needs waking
+
+    def run(self):
+        next_frame = 0.0
+        while True:
+            with self.ready:
+                while self.running and not self.undrawn:
+                    self.ready.wait()
+                if not self.undrawn:
+                    return
+                # A line after a quiet spell is drawn at once; a busy room waits for the next frame
+                while self.running and time.monotonic() < next_frame:
+                    self.ready.wait(max(next_frame - time.monotonic(), 0))
+                self.draw()
+            next_frame = time.monotonic() + self.interval
+
+    def draw(self):
+        """Write the undrawn lines and the prompt in one go; call with self.ready held"""
+        lines = list(itertools.islice(reversed(self.scrollback), self.undrawn))[::-1]
+        self.lines += len(lines)
+        if self.skipped:
+            lines.insert(0, colored(f"... {self.skipped} messages skipped", 'yellow'))
+        prompt = self.prompt() if self.prompt else None
+        # Clear the prompt line, print the new lines, then put the prompt back
+        text = '\r' + ' ' * (len(prompt or '') + 2) + '\r' + '\n'.join(lines) + '\n'
+        if prompt is not None:
+            text += f"> {prompt}"
+        out = self.out or sys.stdout
+        out.write(text)
+        out.flush()
+        self.frames += 1
+        self.undrawn = self.skipped = 0
+
+    def stop(self):
+        """Draw whatever is still queued and stop the render thread"""
+        with self.ready:
+            self.running = False
+            self.ready.notify()
+        if self.thread:
+            self.thread.join()
@@ -0,0 +1,80 @@
+# rooms.py
+import threading
+from config import CONFIG
+
+class RoomManager:
+    """Room membership indexes so broadcasts only touch a room's members.
+
+    As in ClientRegistry, a membership change only drops the room's
+    snapshot of (username, client) pairs; the next broadcast to the room
+    rebuilds it, so a burst of joins costs one copy rather than one each.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.members = {}    # room -> {username: client}
+        self.snapshots = {}  # room -> tuple of (username, client) pairs, or None until the next read
+
+    def join(self, client, room):
+        """Move client into room, creating it if needed; returns the previous room"""
+        with self.lock:
+            previous = client.room
+            if previous == room:
+                return previous
+            if previous is not None:
+                self.discard(client.username, previous)
+            members = self.members.setdefault(room, {})
+            members[client.username] = client
+            self.snapshots[room] = None
+            client.room = room
+            return previous
+
+    def leave(self, client):
+        """Remove client from its room; returns the room it was in"""
+        with self.lock:
+            room = client.room
+            if room is not None:
+                self.discard(client.username, room)
+                client.room = None
+            return room
+
+    def replace(self, old, new):
+        """Put new in old's place in its room, as when a session is resumed"""
+        with self.lock:
+            room = old.room
+            if room is not None:
+                members = self.members.setdefault(room, {})
+                members[new.username] = new
+                self.snapshots[room] = None
+            new.room = room
+            old.room = None
+
+    def discard(self, username, room):
+        # Caller holds the lock; empty rooms other than the default disappear
+        members = self.members.get(room, {})
+        members.pop(username, None)
+        if members or room == CONFIG['DEFAULT_ROOM']:
+            self.snapshots[room] = None
+        else:
+            self.members.pop(room, None)
+            self.snapshots.pop(room, None)
+
+    def items(self, room):
+        """Snapshot of (username, client) pairs in room"""
+        snapshot = self.snapshots.get(room, ())
+        if snapshot is None:
+            with self.lock:
+                snapshot = self.snapshots.get(room, ())
+                if snapshot is None:
+                    snapshot = self.snapshots[room] = tuple(self.members[room].items())
+        return snapshot
+
+    def summary(self, remote_counts=None):
+        """Room names with member counts, e.g. 'dev (2), lobby (5)'
+
+        remote_counts adds members connected to other worker processes.
+        """
+        with self.lock:
+            counts = {room: len(members) for room, members in self.members.items()}
+        for room, count in (remote_counts or {}).items():
+            counts[room] = counts.get(room, 0) + count
+        return ', '.join(f"{room} ({count})" for room, count in sorted(counts.items()))
@@ -1,28 +1,96 @@
 # server.py
+import base64
+import os
+import select
 import socket
 import threading
 import json
-from config import CONFIG, get_local_ip, find_available_port
-from models import Client, Message
-from utils import log_message, print_colored
+from config import BOOT_STARTED, CONFIG, candidate_ports, get_local_ip
+from models import Client, Message, continue_sequence, next_sequence
+from protocol import (FEATURE_COMPRESSION, FEATURE_HEARTBEAT, FEATURE_SESSION,
+                      SUPPORTED_FRAMINGS, TYPE_TAGS, parse_handshake, parse_resume)
+from registry import ClientRegistry
+from rooms import RoomManager
+from utils import flush_logs, log_message, log_stats, print_colored
 import signal
 import sys
-import openai
+import time
+from chatbot import create_chatbot_pool
+from heartbeat import TimerWheel
+from history import create_history_store
+from logsearch import create_log_index
+from metrics import METRICS, start_metrics_server
+from presence import Presence
+from ratelimit import RateLimiter
+from sessions import Session
+from transport import create_transport
+from upgrade import (UPGRADE_ACK, connect_to_predecessor, listen_for_successor, receive_state,
+                     recv_exactly, send_state, upgrades_supported)
 
-# Set your OpenAI API key here
-openai.api_key = 'YOUR_OPENAI_API_KEY'
+METRICS.counter('chat_connections_accepted_total', 'Connections accepted')
+METRICS.counter('chat_messages_in_total', 'Messages received from clients', label='type')
+METRICS.counter('chat_messages_out_total', 'Messages queued for delivery to clients', label='type')
+METRICS.counter('chat_send_errors_total', 'Sends that failed and disconnected the client')
+METRICS.counter('chat_client_removals_total', 'Clients removed from the server', label='reason')
+METRICS.counter('chat_sessions_resumed_total', 'Reconnects that resumed their session')
+METRICS.counter('chat_rate_limited_total', 'Messages dropped by rate limits', label='kind')
+METRICS.histogram('chat_broadcast_seconds', 'Time to fan one broadcast out to local recipients')
+
+def type_label(message_type):
+    """Metric label for a message type; clients choose types freely, so unknown ones share 'other'"""
+    return message_type if message_type in TYPE_TAGS else 'other'
 
 class ChatServer:
+    client_class = Client
+
     def __init__(self):
-        self.clients = {}  # username -> Client object
+        self.startup_mark = time.perf_counter()
+        # Phase -> seconds, shown once listening; imports run from the first import of config
+        self.startup = {'imports': self.startup_mark - BOOT_STARTED}
+        self.clients = ClientRegistry()  # username -> Client object
+        self.rooms = RoomManager()
+        self.presence = Presence(CONFIG['PRESENCE_LOG_SIZE'])  # Roster and batched join/leave notices
+        self.outbox_totals = {'dropped': 0, 'coalesced': 0, 'slow_disconnects': 0}
         self.socket = None
-        self.server_ip = get_local_ip()
         self.running = True
         self.port = CONFIG['SERVER_PORT']
+        self.transport = create_transport()
+        self.history = create_history_store()
+        self.limiter = RateLimiter(CONFIG['RATE_LIMITS'], CONFIG['GLOBAL_RATE_LIMITS'])
+        self.worker_id = None  # Set with bus when running as one of several workers
+        self.bus = None
+        self.metrics_server = None
+        self.heartbeats = None  # Timer wheel of clients due a liveness or session check
+        self.heartbeat_lock = threading.Lock()
+        self.session_lock = threading.Lock()
+        self.chatbot = create_chatbot_pool(self.broadcast_chatbot_response)
+        self.log_index = None  # Search index over the log for logsearch.py, opened once listening
+        self.connection_threads = set()  # Threads handling a connection, from accept until it ends
+
+        # Hot upgrade (see upgrade.py)
+        self.take_over = False    # Adopt the sockets of the server at UPGRADE_SOCKET instead of binding
+        self.predecessor = None   # Connection to the process being taken over
+        self.inherited = []       # (client description, fd) pairs received from it
+        self.inherited_messages = {}  # seq -> Message held by the inherited sessions
+        self.upgrade_listener = None
+        self.successor = None     # Connection from the process taking over from this one
+        self.wake_readers = None  # Pipe whose read end readers poll beside their socket
 
         # Setup signal handlers for graceful shutdown
         signal.signal(signal.SIGINT, self.handle_shutdown)
         signal.signal(signal.SIGTERM, self.handle_shutdown)
+        self.startup_phase('init')
+
+    def startup_phase(self, phase):
+        """Record how long phase took since the previous one ended"""
+        now = time.perf_counter()
+        self.startup[phase] = now - self.startup_mark
+        self.startup_mark = now
+
+    def startup_summary(self):
+        total = sum(self.startup.values()) * 1000
+        phases = ', '.join(f"{phase} {seconds * 1000:.1f}" for phase, seconds in self.startup.items())
+        return f"Started in {total:.1f} ms ({phases})"
 
     def handle_shutdown(self, signum, frame):
         """Handle shutdown signals gracefully"""
@@ -30,46 +98,188 @@ class ChatServer:
         self.shutdown()
         sys.exit(0)
 
-    def start(self):
+    def bind_socket(self):
+        """Create the listening socket, falling back to a free port if allowed.
+
+        Each candidate port is tried by listening on it directly; port 0
+        lets the kernel choose.
+        """
+        reuse_port = self.worker_id is not None
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.socket.settimeout(CONFIG['SOCKET_TIMEOUT'])
+            self.socket = self.transport.listen(self.port, CONFIG['MAX_CONNECTIONS'], reuse_port)
+        except OSError as e:
+            if reuse_port:
+                # The supervisor picked the port for every worker; don't wander off it
+                print_colored(f"Worker {self.worker_id} could not bind port {self.port}", "red")
+                return False
+            if not self.transport.uses_port:
+                print_colored(f"Could not listen on {self.transport.describe(self.port)}: {e}", "red")
+                return False
+            fallback = candidate_ports()[1:]
+            if not fallback:
+                print_colored(f"Port {self.port} is in use: {e}", "red")
+                return False
+            print_colored(f"Default port {self.port} is in use, searching for available port...", "yellow")
+            for port in fallback:
+                try:
+                    self.socket = self.transport.listen(port, CONFIG['MAX_CONNECTIONS'])
+                except OSError:
+                    continue
+                self.port = port
+                print_colored(f"Successfully bound to port {self.port}", "green")
+                break
+            else:
+                print_colored(f"No available ports found in range {CONFIG['PORT_RANGE_START']}-{CONFIG['PORT_RANGE_END']}", "red")
+                return False
+
+        if self.transport.uses_port:
+            self.port = self.socket.getsockname()[1]  # The kernel's choice when the port was 0
+        self.socket.settimeout(CONFIG['SOCKET_TIMEOUT'])
+        self.startup_phase('bind')
+        return True
+
+    def announce_start(self):
+        """Print connection details once the server is listening"""
+        self.start_metrics()
+        self.start_heartbeat()
+        self.start_presence()
+        self.start_log_index()
+        self.start_upgrade_listener()
+        if self.bus:
+            # Peers may already have published; their events wait in the socket buffers
+            self.bus.start()
+        self.startup_phase('services')
+        if self.worker_id is not None:
+            print_colored(f"Worker {self.worker_id} accepting on port {self.port}. {self.startup_summary()}", "blue")
+            log_message(f"Worker {self.worker_id} started successfully. {self.startup_summary()}")
+            return
+
+        print_colored("\n=== Chat Server Started ===", "green")
+        print_colored(f"Server IP: {get_local_ip()}", "blue")
+        if self.transport.uses_port:
+            print_colored(f"Port: {self.port} ({self.transport.name})", "blue")
+        else:
+            print_colored(f"Socket: {self.transport.describe(self.port)}", "blue")
+        print_colored("Share these details with clients to connect.", "yellow")
+        print_colored("Press Ctrl+C to shutdown server.", "yellow")
+        if self.upgrade_listener:
+            print_colored("Run 'python server.py --upgrade' to restart without dropping clients.", "yellow")
+        print_colored(self.startup_summary(), "blue")
+        print_colored("Waiting for connections...\n", "yellow")
+
+        log_message(f"Server started successfully. {self.startup_summary()}")
+
+    def start_metrics(self):
+        """Register gauges and serve /metrics; workers use consecutive ports"""
+        METRICS.collector('chat_connected_clients', 'Clients connected to this process',
+                          lambda: len(self.clients))
+        METRICS.collector('chat_outbox', 'Outbox queue depth and overflow totals',
+                          self.outbox_stats, label='stat')
+        METRICS.collector('chat_roster', 'Roster version and users online across workers',
+                          lambda: {'version': self.presence.version, 'online': len(self.presence.online)},
+                          label='stat')
+        METRICS.collector('chat_log_records', 'Log queue depth and records sampled or dropped under backpressure',
+                          log_stats, label='stat')
+        METRICS.collector('chat_startup_seconds', 'Time each startup phase took',
+                          lambda: self.startup, label='phase')
+        if self.chatbot:
+            METRICS.collector('chat_bot', 'Chatbot pool queue, cache and outcome counts',
+                              lambda: {key: int(value) for key, value in self.chatbot.stats().items()},
+                              label='stat')
+        if self.bus:
+            METRICS.collector('chat_bus_events', 'Events relayed to, received from and dropped for other workers',
+                              lambda: {'relayed': self.bus.relayed, 'received': self.bus.received,
+                                       'dropped': self.bus.dropped},
+                              label='direction')
+        if self.history:
+            METRICS.collector('chat_history_dropped', 'Messages dropped before reaching history',
+                              lambda: self.history.dropped)
+
+        port = CONFIG['METRICS_PORT']
+        if port is not None:
+            port += self.worker_id or 0
+            self.metrics_server = start_metrics_server(CONFIG['METRICS_HOST'], port)
+
+    def start_heartbeat(self):
+        """Create the timer wheel and one thread that ticks it for every client"""
+        if self.create_heartbeat_wheel():
+            threading.Thread(target=self.run_heartbeat, daemon=True, name="heartbeat").start()
+
+    def start_presence(self):
+        """Send batched join/leave notices from one thread"""
+        threading.Thread(target=self.run_presence, daemon=True, name="presence").start()
 
-            # Try to bind to default port, if fails, find an available port
+    def run_presence(self):
+        while self.running:
+            time.sleep(CONFIG['PRESENCE_INTERVAL'])
+            self.flush_presence()
+
+    def start_log_index(self):
+        """Keep the log search index up to date from one thread; indexing is file I/O, so not on a loop"""
+        self.log_index = create_log_index()
+        if self.log_index:
+            threading.Thread(target=self.run_log_index, daemon=True, name="log-index").start()
+
+    def run_log_index(self):
+        while self.running:
             try:
-                self.socket.bind(('0.0.0.0', self.port))
-            except OSError:
-                print_colored(f"Default port {self.port} is in use, searching for available port...", "yellow")
-                available_port = find_available_port()
-                if available_port:
-                    self.port = available_port
-                    try:
-                        self.socket.bind(('0.0.0.0', self.port))
-                        print_colored(f"Successfully bound to port {self.port}", "green")
-                    except OSError as e:
-                        print_colored(f"Error binding to port {self.port}: {e}", "red")
-                        return
-                else:
-                    print_colored(f"No available ports found in range {CONFIG['PORT_RANGE_START']}-{CONFIG['PORT_RANGE_END']}", "red")
-                    return
+                # Workers and a hot-upgrade successor share the index; whoever holds its lock updates it
+                self.log_index.update(wait=False)
+            except Exception as e:
+                log_message(f"Error updating the log search index: {e}", 'error')
+            time.sleep(CONFIG['SEARCH_INDEX_INTERVAL'])
+
+    def flush_presence(self):
+        """Tell each room who joined and left it since the last flush, in one notice"""
+        for room, events in self.presence.take_notices().items():
+            joined = [username for username, online in events.items() if online]
+            left = [username for username, online in events.items() if not online]
+            parts = []
+            if joined:
+                parts.append(f"{self.name_list(joined)} joined the chat")
+            if left:
+                parts.append(f"{self.name_list(left)} left the chat")
+            self.broadcast_message(Message('status', '; '.join(parts), 'Server', room=room), room=room)
 
-            self.socket.listen(CONFIG['MAX_CONNECTIONS'])
+    def name_list(self, names):
+        """'a', 'a and b', 'a, b and c', or 'a, b and 40 others' past PRESENCE_MAX_NAMES"""
+        limit = CONFIG['PRESENCE_MAX_NAMES']
+        if len(names) > limit:
+            return f"{', '.join(names[:limit])} and {len(names) - limit} others"
+        if len(names) == 1:
+            return names[0]
+        return f"{', '.join(names[:-1])} and {names[-1]}"
 
-            print_colored("\n=== Chat Server Started ===", "green")
-            print_colored(f"Server IP: {self.server_ip}", "blue")
-            print_colored(f"Port: {self.port}", "blue")
-            print_colored("Share these details with clients to connect.", "yellow")
-            print_colored("Press Ctrl+C to shutdown server.", "yellow")
-            print_colored("Waiting for connections...\n", "yellow")
+    def create_heartbeat_wheel(self):
+        # Detached sessions expire off the same wheel
+        delays = [CONFIG['HEARTBEAT_TIMEOUT'], CONFIG['SESSION_TTL']]
+        if not any(delays):
+            return False
+        horizon = max([CONFIG['HEARTBEAT_INTERVAL']] + [delay for delay in delays if delay])
+        self.heartbeats = TimerWheel(CONFIG['HEARTBEAT_TICK'], horizon, time.monotonic())
+        return True
 
-            log_message("Server started successfully")
+    def run_heartbeat(self):
+        while self.running:
+            time.sleep(CONFIG['HEARTBEAT_TICK'])
+            self.check_heartbeats()
+
+    def start(self):
+        try:
+            if not (self.take_over_sockets() if self.take_over else self.bind_socket()):
+                return
+
+            self.announce_start()
+            if self.predecessor:
+                self.adopt_clients()
 
             while self.running:
                 try:
-                    conn, addr = self.socket.accept()
-                    threading.Thread(target=self.handle_client_connection,
-                                   args=(conn, addr)).start()
+                    conn, addr = self.transport.accept(self.socket)
+                    METRICS.inc('chat_connections_accepted_total')
+                    thread = threading.Thread(target=self.handle_client_connection, args=(conn, addr))
+                    self.connection_threads.add(thread)
+                    thread.start()
                 except socket.timeout:
                     continue
                 except Exception as e:
@@ -81,168 +291,815 @@ class ChatServer:
             print_colored(f"Server error: {e}", "red")
             log_message(f"Server error: {e}", 'error')
         finally:
-            self.shutdown()
+            if not (self.successor and self.hand_off()):
+                self.shutdown()
 
     def handle_client_connection(self, conn, addr):
         try:
-            # Set timeout for client connections
-            conn.settimeout(CONFIG['CLIENT_TIMEOUT'])
+            # Only the handshake has a deadline; idle clients are found by heartbeat
+            conn.settimeout(CONFIG['HANDSHAKE_TIMEOUT'])
+            self.transport.handshake(conn)
+            handshake = conn.recv(CONFIG['BUFFER_SIZE'])
+            conn.settimeout(None)
+            if not handshake:
+                conn.close()  # Closed without saying who it is (or the wake-up below)
+                return
 
-            username = conn.recv(CONFIG['BUFFER_SIZE']).decode()
+            client = self.register_client(conn, addr, handshake)
+            if client:
+                self.handle_client_messages(client)
 
-            # Check if username already exists
-            if username in self.clients:
-                error_msg = Message('status', 'Username already taken. Please try again.', 'Server')
-                conn.send(error_msg.to_json().encode())
+        except Exception as e:
+            log_message(f"Error handling client connection: {e}", 'error')
+            if conn:
                 conn.close()
-                return
+        finally:
+            self.connection_threads.discard(threading.current_thread())
 
-            client = Client(conn, addr, username)
-            self.clients[username] = client
+    def register_client(self, conn, addr, handshake):
+        """Add a client after the username handshake, or reject a duplicate name"""
+        username, features = parse_handshake(handshake)
+        framing = next((f for f in features if f in SUPPORTED_FRAMINGS), None)
+        client = self.client_class(conn, addr, username, framing, self.transport)
+        client.heartbeat = FEATURE_HEARTBEAT in features
+        client.compress = (bool(framing) and FEATURE_COMPRESSION in features
+                           and CONFIG['COMPRESSION_THRESHOLD'] is not None)
+        client.start()
 
-            print_colored(f"New connection from {addr} - Username: {username}", "green")
-            log_message(f"Client connected: {username} from {addr}")
+        token, last_seq = parse_resume(features)
+        if token and self.resume_session(client, token, last_seq):
+            return client
 
-            # Send welcome message to new client
-            welcome_msg = Message('status', f'Welcome to the chat, {username}!', 'Server')
-            client.connection.send(welcome_msg.to_json().encode())
+        # Check if username already exists; reserving it stops concurrent handshakes racing
+        if not self.claim_username(username):
+            error_msg = Message('status', 'Username already taken. Please try again.', 'Server')
+            client.send_messages(self.handshake_messages(client) + [error_msg])
+            client.close(CONFIG['OUTBOX_FLUSH_TIMEOUT'])
+            return None
 
-            # Broadcast join message to other clients
-            self.broadcast_message(
-                Message('status', f'{username} joined the chat', 'Server')
-            )
+        self.clients.add(client)
+        if FEATURE_SESSION in features and self.sessions_enabled():
+            client.session = Session(CONFIG['SESSION_BUFFER_SIZE'])
+        self.watch_client(client)
+        self.rooms.join(client, CONFIG['DEFAULT_ROOM'])
+        self.presence.update(username, True, client.room)
+        self.publish_presence(username, client.room)
 
-            self.handle_client_messages(client)
+        print_colored(f"New connection from {addr} - Username: {username}", "green")
+        log_message(f"Client connected: {username} from {addr}")
 
-        except Exception as e:
-            log_message(f"Error handling client connection: {e}", 'error')
-            if conn:
-                conn.close()
+        # Send welcome message to new client
+        welcome_msg = Message('status', f'Welcome to the chat, {username}!', 'Server')
+        client.send_messages(self.handshake_messages(client) + [welcome_msg] +
+                             self.replay_history(client))
+        return client
+
+    def sessions_enabled(self):
+        # A reconnect may land on any worker, so only a single process can resume sessions
+        return bool(CONFIG['SESSION_TTL']) and self.bus is None
+
+    def resume_session(self, client, token, last_seq):
+        """Hand a held session to a reconnecting client and replay what it missed.
+
+        The old connection may be detached or, if the client noticed the
+        drop before the server did, still look open; either way the new
+        client takes its place without leave or join notices. Returns False
+        if there is no such session, and the client joins afresh.
+        """
+        old = self.clients.get(client.username)
+        session = old.session if old else None
+        if session is None or not session.matches(token):
+            return False
+
+        # Holding the old outbox lock stops messages being recorded after the replay is taken
+        with old.outbox.ready:
+            missed, complete = session.missed(last_seq)
+            client.session = session
+            old.replaced_by = client
+            welcome = [Message('status', f'Welcome back, {client.username}! '
+                                         f'{len(missed)} missed messages follow.', 'Server')]
+            if not complete:
+                welcome.append(Message('status', 'Some older messages could not be recovered', 'Server'))
+            # Numbered with the client's own last_seq, so dropping again before the replay arrives
+            # resumes from the same place rather than after messages it never got
+            for message in welcome:
+                message.seq = last_seq
+            client.send_messages(self.handshake_messages(client) + welcome + missed, record=False)
+            self.clients.replace(client)
+            self.rooms.replace(old, client)
+        old.close()
+        self.watch_client(client)
+
+        METRICS.inc('chat_sessions_resumed_total')
+        print_colored(f"Client resumed: {client.username} ({len(missed)} messages replayed)", "green")
+        log_message(f"Client resumed: {client.username} from {client.address}, "
+                    f"{len(missed)} messages replayed")
+        return True
+
+    def detach_client(self, username, client=None):
+        """Close a dropped client's connection but keep its session for SESSION_TTL.
+
+        The client stays registered and in its room, so messages keep being
+        recorded for replay. Returns False if it has no session to keep.
+        """
+        current = self.clients.get(username)
+        if current is None or (client is not None and current is not client):
+            return False
+        if current.session is None or current.outbox.evicted:
+            return False
+        with self.session_lock:
+            if current.detached is not None:
+                return True
+            current.detached = time.monotonic()
+
+        current.close()
+        METRICS.inc('chat_client_removals_total', 'detached')
+        print_colored(f"Client connection lost: {username} (session held)", "yellow")
+        log_message(f"Client detached: {username}; session held for {CONFIG['SESSION_TTL']}s")
+        # A heartbeat check may also be pending; whichever comes due first after the TTL expires it
+        with self.heartbeat_lock:
+            self.heartbeats.schedule(current, CONFIG['SESSION_TTL'])
+        return True
+
+    def claim_username(self, username):
+        """Reserve username unless a client here or on another worker has it"""
+        if not self.clients.reserve(username):
+            return False
+        if self.bus and self.bus.worker_for(username) is not None:
+            self.clients.release(username)
+            return False
+        return True
+
+    def publish_presence(self, username, room):
+        """Tell other workers where a local user is; room None means they left"""
+        if self.bus:
+            self.bus.publish({'op': 'presence', 'username': username, 'room': room})
+
+    def replay_history(self, client):
+        """Recent room messages for a client that just arrived.
+
+        Legacy clients read one message per recv, so a replay queued right
+        behind the welcome would reach them merged into unreadable JSON;
+        they get none, and /history answers them in one message.
+        """
+        limit = CONFIG['HISTORY_REPLAY_ON_JOIN']
+        if not self.history or limit <= 0 or client.framing is None:
+            return []
+        room = client.room
+        messages = self.history.recent(room, limit)
+        if not messages:
+            return []
+        header = Message('status', f'Last {len(messages)} messages in {room}:', 'Server', room=room)
+        return [header] + messages
+
+    def watch_client(self, client):
+        """Put a client that answers pings on the heartbeat wheel"""
+        if self.heartbeats and client.heartbeat and CONFIG['HEARTBEAT_TIMEOUT']:
+            with self.heartbeat_lock:
+                self.heartbeats.schedule(client, min(CONFIG['HEARTBEAT_INTERVAL'],
+                                                     CONFIG['HEARTBEAT_TIMEOUT']))
+
+    def check_heartbeats(self):
+        """Ping idle clients, evict silent ones and expire detached sessions.
+
+        Only clients whose check fell due are looked at. Traffic just moves
+        last_seen; a client that was heard from is rescheduled when its
+        check comes round, and one that has left is dropped then.
+        """
+        now = time.monotonic()
+        with self.heartbeat_lock:
+            due = self.heartbeats.advance(now)
+        interval, timeout = CONFIG['HEARTBEAT_INTERVAL'], CONFIG['HEARTBEAT_TIMEOUT']
+        ping = None  # One message, encoded once, for every client pinged this tick
+
+        for client in due:
+            if self.clients.get(client.username) is not client:
+                continue
+            if client.detached is not None:
+                waited = now - client.detached
+                if waited >= CONFIG['SESSION_TTL']:
+                    self.remove_client(client.username, 'session_expired', client)
+                else:
+                    with self.heartbeat_lock:
+                        self.heartbeats.schedule(client, CONFIG['SESSION_TTL'] - waited)
+                continue
+            idle = now - client.last_seen
+            if idle >= timeout:
+                log_message(f"No heartbeat from {client.username} for {idle:.0f}s", 'warning')
+                self.remove_client(client.username, 'timeout', client)
+                continue
+            if idle >= interval:
+                if client.pinged < client.last_seen:
+                    ping = ping or Message('ping', '', 'Server')
+                    client.pinged = now
+                    if not self.send_to(client, [ping]):
+                        continue
+                delay = min(timeout - idle, interval)
+            else:
+                delay = interval - idle
+            with self.heartbeat_lock:
+                self.heartbeats.schedule(client, delay)
+
+    def handshake_messages(self, client):
+        """Acknowledge the framing (and compression) so the client knows how to decode, then the session token"""
+        messages = []
+        if client.framing:
+            accepted = f"{client.framing} {FEATURE_COMPRESSION}" if client.compress else client.framing
+            messages.append(Message('handshake', accepted, 'Server'))
+        if client.session:
+            messages.append(Message('session', client.session.token, 'Server'))
+        return messages
 
     def handle_client_messages(self, client):
+        client.reader = threading.current_thread()
+        poller = self.reader_poller(client)
         while self.running:
             try:
-                data = client.connection.recv(CONFIG['BUFFER_SIZE'])
-                if not data:
-                    break
+                if poller and self.wake_readers[0] in dict(poller.poll()):
+                    break  # Handing over: leave unread bytes for the new process
 
-                try:
-                    msg = Message.from_json(data.decode())
-                    log_message(f"Message from {client.username}: {msg.content}")
+                frames = client.decoder.read_from(client.connection)
+                if frames is None:
+                    break
 
-                    if msg.type == 'command':
-                        self.handle_command(msg, client)
-                    elif msg.type == 'dm':
-                        self.handle_private_message(msg)
-                    else:
-                        self.broadcast_message(msg, exclude=client.username)
-                        # Send message to chatbot and broadcast response
-                        chatbot_response = self.get_chatbot_response(msg.content)
-                        if chatbot_response:
-                            self.broadcast_message(
-                                Message('chat', chatbot_response, 'Chatbot')
-                            )
-                except Exception as e:
-                    log_message(f"Error processing message: {e}", 'error')
+                self.dispatch_frames(client, frames)
 
             except Exception as e:
                 log_message(f"Error handling message from {client.username}: {e}", 'error')
                 break
 
-        self.remove_client(client.username)
+        if self.successor:
+            return  # The client goes to the new process as it is
+        self.remove_client(client.username, client=client)
 
-    def get_chatbot_response(self, user_message):
-        try:
-            response = openai.Completion.create(
-                engine="text-davinci-003",
-                prompt=user_message,
-                max_tokens=150
-            )
-            return response.choices[0].text.strip()
-        except Exception as e:
-            log_message(f"Error getting chatbot response: {e}", 'error')
+    def reader_poller(self, client):
+        """poll object over the client's socket and the wake pipe, or None without hot upgrades.
+
+        A blocked recv cannot be interrupted without shutting the socket
+        down for the new process as well, so readers wait in poll instead.
+        """
+        if self.wake_readers is None:
             return None
+        poller = select.poll()
+        poller.register(client.connection, select.POLLIN)
+        poller.register(self.wake_readers[0], select.POLLIN)
+        return poller
+
+    def dispatch_frames(self, client, frames):
+        """Route every message from one read; consecutive chat lines fan out together"""
+        chat_batch = []
+        client.last_seen = time.monotonic()
+        for data in frames:
+            try:
+                msg = Message.from_wire(data, client.names)
+                if msg is None:
+                    continue
+                # Sequence numbers are the server's to give; a client's would corrupt other sessions' replay
+                msg.seq = None
+                # Likewise the sender is whoever this connection logged in as, not what the message claims
+                msg.sender = client.username
+                METRICS.inc('chat_messages_in_total', type_label(msg.type))
+                if msg.type == 'pong':
+                    continue
+                if msg.type == 'ping':
+                    # Answered like a command, so limited like one
+                    if self.limiter.allow(client.buckets, 'command'):
+                        self.send_to(client, [Message('pong', msg.content, 'Server')])
+                    else:
+                        self.reject_message(client, 'command')
+                    continue
+                # Anything else is broadcast like chat, so it is limited like chat
+                kind = msg.type if msg.type in ('command', 'dm') else 'chat'
+                if not self.limiter.allow(client.buckets, kind):
+                    self.reject_message(client, kind)
+                    continue
+                if client.throttled:
+                    client.throttled.discard(kind)
+                log_message(f"Message from {client.username}: {msg.content}")
+
+                if msg.type == 'command':
+                    self.flush_chat(client, chat_batch)
+                    self.handle_command(msg, client)
+                elif msg.type == 'dm':
+                    self.flush_chat(client, chat_batch)
+                    self.handle_private_message(msg)
+                else:
+                    chat_batch.append(msg)
+            except Exception as e:
+                log_message(f"Error processing message: {e}", 'error')
+
+        self.flush_chat(client, chat_batch)
+
+    def reject_message(self, client, kind):
+        """Count a rate-limited message; tell the client once per flood"""
+        METRICS.inc('chat_rate_limited_total', kind)
+        if kind not in client.throttled:
+            client.throttled.add(kind)
+            self.send_to(client, [Message('status', f'You are sending {kind} messages too fast; '
+                                                    'some were dropped', 'Server')])
+
+    def flush_chat(self, client, chat_batch):
+        """Broadcast pending chat lines in one batch, then ask the chatbot"""
+        if not chat_batch:
+            return
+        messages = chat_batch[:]
+        chat_batch.clear()
+
+        # Chat goes to the sender's current room, whatever the message claims
+        room = client.room
+        for msg in messages:
+            msg.room = room
+            self.record_history(msg)
+        self.broadcast_messages(messages, exclude=client.username, room=room)
+        if not self.chatbot:
+            return
+        for msg in messages:
+            if self.limiter.allow(client.buckets, 'bot'):
+                self.request_chatbot_response(msg.content, room)
+            else:
+                METRICS.inc('chat_rate_limited_total', 'bot')
+
+    def request_chatbot_response(self, user_message, room=None):
+        """Hand the message to the chatbot pool; the reply is broadcast when ready"""
+        if self.chatbot and not self.chatbot.submit(user_message, room):
+            log_message("Chatbot busy or unavailable; prompt skipped", 'warning')
+
+    def broadcast_chatbot_response(self, chatbot_response, room=None):
+        message = Message('chat', chatbot_response, 'Chatbot', room=room)
+        self.record_history(message)
+        self.broadcast_message(message, room=room)
 
-    def broadcast_message(self, message, exclude=None):
+    def record_history(self, message):
+        if self.history:
+            self.history.record(message)
+
+    def broadcast_message(self, message, exclude=None, room=None):
+        self.broadcast_messages([message], exclude, room)
+
+    def broadcast_messages(self, messages, exclude=None, room=None):
+        """Send messages to a room, or to every client when room is None.
+
+        Clients on other workers get them through the bus.
+        """
+        if self.bus:
+            self.bus.publish({
+                'op': 'broadcast',
+                'messages': [message.to_dict() for message in messages],
+                'exclude': exclude,
+                'room': room
+            })
+        self.deliver_messages(messages, exclude, room)
+
+    def deliver_messages(self, messages, exclude=None, room=None):
+        """Send messages to this process's clients in a room, or to all of them.
+
+        Each message is encoded once and the frame shared by all recipients.
+        """
+        started = time.perf_counter()
         disconnected_clients = []
+        recipients = self.clients.items() if room is None else self.rooms.items(room)
+        delivered = 0
 
-        for username, client in self.clients.items():
+        for username, client in recipients:
             if username != exclude:
                 try:
-                    client.connection.send(message.to_json().encode())
+                    client.send_messages(messages)
+                    delivered += 1
                 except:
-                    disconnected_clients.append(username)
+                    disconnected_clients.append(client)
+
+        self.count_sent(messages, delivered)
+        METRICS.observe('chat_broadcast_seconds', time.perf_counter() - started)
 
         # Remove disconnected clients
-        for username in disconnected_clients:
-            self.remove_client(username)
+        for client in disconnected_clients:
+            METRICS.inc('chat_send_errors_total')
+            self.remove_client(client.username, 'send_error', client)
+
+    def send_to(self, client, messages):
+        """Send messages to one client, removing it if that fails"""
+        try:
+            client.send_messages(messages)
+        except:
+            METRICS.inc('chat_send_errors_total')
+            self.remove_client(client.username, 'send_error', client)
+            return False
+        self.count_sent(messages)
+        return True
+
+    def count_sent(self, messages, recipients=1):
+        if recipients:
+            for message in messages:
+                METRICS.inc('chat_messages_out_total', type_label(message.type), recipients)
 
     def handle_command(self, message, client):
-        if message.content == 'users':
+        command, _, argument = message.content.partition(' ')
+        argument = argument.strip()
+
+        if command == 'users':
+            # '/users <token>' from an earlier reply gets only what changed since
+            response = Message('command', self.presence.users(argument or None), 'Server')
+        elif command == 'rooms':
             response = Message('command',
-                             f"Online users: {', '.join(self.clients.keys())}",
+                             f"Rooms: {self.rooms.summary(self.bus.room_counts() if self.bus else None)}",
                              'Server')
-            try:
-                client.connection.send(response.to_json().encode())
-            except:
-                self.remove_client(client.username)
+        elif command == 'join' and argument:
+            response = self.change_room(client, argument)
+        elif command == 'leave':
+            response = self.change_room(client, CONFIG['DEFAULT_ROOM'])
+        elif command == 'history':
+            self.send_to(client, self.history_messages(client, argument))
+            return
+        elif command == 'quit':
+            # Leaving on purpose: the coming disconnect should not hold the session
+            client.session = None
+            return
+        else:
+            return
 
-    def handle_private_message(self, message):
-        if message.recipient in self.clients:
-            try:
-                self.clients[message.recipient].connection.send(
-                    message.to_json().encode()
-                )
-            except:
-                self.remove_client(message.recipient)
+        self.send_to(client, [response])
 
-            # Send confirmation to sender
-            try:
-                confirm_msg = Message('status',
-                                    f"Message sent to {message.recipient}",
-                                    'Server')
-                self.clients[message.sender].connection.send(
-                    confirm_msg.to_json().encode()
-                )
-            except:
-                self.remove_client(message.sender)
+    def history_messages(self, client, argument):
+        """Messages answering '/history [n]', '/history username [n]' or '/history from:username [n]'"""
+        if not self.history:
+            return [Message('command', 'Message history is disabled', 'Server')]
+
+        args = argument.split()
+        limit = CONFIG['HISTORY_DEFAULT_LIMIT']
+        if args and args[-1].isdigit():
+            limit = int(args.pop())
+        if len(args) > 1:
+            return [Message('command', 'Usage: /history [n], /history username [n] '
+                                       'or /history from:username [n]', 'Server')]
+
+        if args and args[0].startswith('from:'):
+            sender = args[0][len('from:'):]
+            messages = self.history.by_sender(sender, limit)
+            where = f'from {sender}'
+        elif args:
+            messages = self.history.conversation(client.username, args[0], limit)
+            where = f'with {args[0]}'
+        else:
+            messages = self.history.recent(client.room, limit)
+            where = f'in {client.room}'
+        if not messages:
+            return [Message('command', f'No messages {where} yet', 'Server')]
+        header = f'Last {len(messages)} messages {where}:'
+        if client.framing is None:
+            # Legacy clients read one message per recv; send the lines as one
+            lines = [f"[{msg.timestamp}] {msg.sender}: {msg.content}" for msg in messages]
+            return [Message('command', '\n'.join([header] + lines), 'Server')]
+        return [Message('command', header, 'Server')] + messages
+
+    def change_room(self, client, room):
+        """Move client to room, telling both rooms; returns the reply for the client"""
+        previous = self.rooms.join(client, room)
+        if previous == room:
+            return Message('command', f"You are already in {room}", 'Server', room=room)
+
+        username = client.username
+        self.publish_presence(username, room)
+        self.broadcast_message(
+            Message('status', f'{username} left {previous}', 'Server', room=previous),
+            room=previous
+        )
+        self.broadcast_message(
+            Message('status', f'{username} joined {room}', 'Server', room=room),
+            exclude=username, room=room
+        )
+        return Message('command', f"You are now in {room}", 'Server', room=room)
+
+    def handle_private_message(self, message):
+        recipient = self.clients.get(message.recipient)
+        sender = self.clients.get(message.sender)
+        worker = self.bus.worker_for(message.recipient) if self.bus and not recipient else None
+        if recipient:
+            self.record_history(message)
+            self.send_to(recipient, [message])
+        elif worker is not None:
+            # The recipient is connected to another worker
+            self.record_history(message)
+            self.bus.publish({'op': 'dm', 'messages': [message.to_dict()]}, worker)
         else:
             # Notify sender that recipient is not found
-            try:
+            if sender:
                 error_msg = Message('status',
                                   f"User {message.recipient} not found",
                                   'Server')
-                self.clients[message.sender].connection.send(
-                    error_msg.to_json().encode()
-                )
-            except:
-                self.remove_client(message.sender)
+                self.send_to(sender, [error_msg])
+            return
+
+        # Send confirmation to sender
+        if sender:
+            confirm_msg = Message('status',
+                                f"Message sent to {message.recipient}",
+                                'Server')
+            self.send_to(sender, [confirm_msg])
 
-    def remove_client(self, username):
-        if username in self.clients:
+    def handle_bus_event(self, event):
+        """Deliver a broadcast or DM relayed from another worker to local clients"""
+        if event['op'] == 'presence':
+            # The worker the user is on sends the notices; here only the roster changes
+            self.presence.update(event['username'], event['room'] is not None)
+            return
+        messages = [Message.from_dict(data) for data in event['messages']]
+        if event['op'] == 'broadcast':
+            self.deliver_messages(messages, event['exclude'], event['room'])
+        elif event['op'] == 'dm':
+            for message in messages:
+                recipient = self.clients.get(message.recipient)
+                if recipient:
+                    self.send_to(recipient, [message])
+
+    def remove_client(self, username, reason='disconnect', client=None):
+        """Remove a client, or only detach it if it has a session to resume.
+
+        With client given, nothing happens unless it is still the registered
+        one; a resumed session may already have replaced it. The leave notice
+        is only queued, so a send failing mid-broadcast never starts another
+        broadcast from inside this one.
+        """
+        if reason in ('disconnect', 'timeout', 'send_error') and self.detach_client(username, client):
+            return
+
+        # Only the thread that actually removes the client announces it
+        client = self.clients.remove(username, client)
+        if client:
             print_colored(f"Client disconnected: {username}", "yellow")
             log_message(f"Client disconnected: {username}")
 
-            self.clients[username].connection.close()
-            del self.clients[username]
+            client.close()
+            self.record_outbox_totals(client)
+            METRICS.inc('chat_client_removals_total',
+                        'slow_consumer' if client.outbox.evicted else reason)
+            room = self.rooms.leave(client)
+            self.presence.update(username, False, room)
+            self.publish_presence(username, None)
+
+    def record_outbox_totals(self, client):
+        """Fold a departing client's outbox counters into the server totals"""
+        outbox = client.outbox
+        self.outbox_totals['dropped'] += outbox.dropped
+        self.outbox_totals['coalesced'] += outbox.coalesced
+        if outbox.evicted:
+            self.outbox_totals['slow_disconnects'] += 1
+            log_message(f"Disconnected slow client {client.username} "
+                        f"({outbox.depth()} frames queued)", 'warning')
+
+    def outbox_stats(self):
+        """Queue depth and overflow metrics across all client outboxes"""
+        outboxes = [client.outbox for client in self.clients.values()]
+        depths = [outbox.depth() for outbox in outboxes]
+        return {
+            'clients': len(outboxes),
+            'queued_frames': sum(depths),
+            'max_depth': max(depths, default=0),
+            'high_water': max((outbox.high_water for outbox in outboxes), default=0),
+            'dropped': self.outbox_totals['dropped'] + sum(o.dropped for o in outboxes),
+            'coalesced': self.outbox_totals['coalesced'] + sum(o.coalesced for o in outboxes),
+            'slow_disconnects': self.outbox_totals['slow_disconnects'],
+        }
+
+    # Hot upgrade: the old process side
+
+    def start_upgrade_listener(self):
+        """Wait on UPGRADE_SOCKET for a new server process to hand everything over to"""
+        if not CONFIG['UPGRADE_SOCKET']:
+            return
+        reason = self.upgrade_blocker()
+        if reason is None:
+            try:
+                self.upgrade_listener = listen_for_successor()
+            except OSError as e:
+                reason = str(e)
+        if reason:
+            print_colored(f"Hot upgrades disabled: {reason}", "yellow")
+            return
+        self.wake_readers = os.pipe()
+        threading.Thread(target=self.run_upgrade_listener, daemon=True, name="upgrade").start()
+
+    def upgrade_blocker(self):
+        """Why this server cannot hand over to another process, or None"""
+        if not upgrades_supported():
+            return "this platform cannot pass sockets between processes"
+        if self.transport.name == 'tls':
+            return "TLS connection state cannot move to another process"
+        if self.bus:
+            return "not supported with several workers"
+        return None
+
+    def run_upgrade_listener(self):
+        try:
+            conn, _ = self.upgrade_listener.accept()
+        except OSError:
+            return
+        self.accept_successor(conn)
+
+    def accept_successor(self, conn):
+        """Stop serving so the main loop hands everything to conn's process"""
+        # The new process listens on UPGRADE_SOCKET next; closing leaves the file for it to replace
+        self.upgrade_listener.close()
+        print_colored("\nA new server process is taking over...", "yellow")
+        log_message("Hot upgrade: handing over to a new server process")
+        self.successor = conn
+        self.running = False
+        os.write(self.wake_readers[1], b'x')
+        self.wake_accept_loop()
+
+    def wake_accept_loop(self):
+        """Connect to our own listener so the blocked accept returns now, not at its timeout"""
+        try:
+            self.transport.connect(('127.0.0.1', self.port), CONFIG['SOCKET_TIMEOUT']).close()
+        except OSError:
+            pass
+
+    def hand_off(self):
+        """Give the listening socket and every client to the successor; False if it failed.
+
+        Runs once the accept loop has stopped. Readers are woken out of
+        poll before reading anything more, and writers flush what is queued,
+        so the new process starts exactly where this one stopped.
+        """
+        if self.chatbot:
+            self.chatbot.stop()  # Replies still being written are lost
+        # Handshakes in progress finish registering; readers stop at once
+        deadline = time.monotonic() + CONFIG['HANDSHAKE_TIMEOUT']
+        for thread in list(self.connection_threads):
+            thread.join(max(deadline - time.monotonic(), 0.01))
+        self.flush_presence()
+
+        clients = [client for client in self.clients.values()
+                   if client.detached is None and not (client.reader and client.reader.is_alive())]
+        deadline = time.monotonic() + CONFIG['OUTBOX_FLUSH_TIMEOUT']
+        for client in clients:
+            client.handed_off = True
+            client.outbox.close(max(deadline - time.monotonic(), 0.01))
+        # A writer still going would interleave with the new process
+        handed = [(client, client.connection.fileno()) for client in clients
+                  if not client.outbox.writer.is_alive()]
+        return self.send_to_successor(handed)
+
+    def send_to_successor(self, handed):
+        """Send the listener, the (client, fd) pairs and their state; wait for the successor to take over"""
+        if self.history:
+            self.history.close()  # Flushed, so the new process sees every message
+            self.history = None
+        if self.metrics_server:
+            self.metrics_server.shutdown()  # Frees the port for the new process
+            self.metrics_server = None
+        messages = {}  # seq -> fields of every message a session holds, once however many hold it
+        state = {
+            'transport': self.transport.name,
+            'port': self.port,
+            'sequence': next_sequence(),
+            'clients': [self.describe_client(client, index + 1, messages)
+                        for index, (client, _) in enumerate(handed)],
+            'messages': messages
+        }
+        try:
+            self.successor.settimeout(CONFIG['UPGRADE_TIMEOUT'])
+            send_state(self.successor, state, [self.socket.fileno()] + [fd for _, fd in handed])
+            if recv_exactly(self.successor, len(UPGRADE_ACK)) != UPGRADE_ACK:
+                raise ConnectionError("Unexpected reply from the new server process")
+        except (OSError, ValueError) as e:
+            print_colored(f"Hot upgrade failed: {e}", "red")
+            log_message(f"Hot upgrade failed: {e}", 'error')
+            for client, _ in handed:
+                client.handed_off = False
+            return False
+
+        print_colored(f"Handed {len(handed)} clients over to the new server process.", "green")
+        log_message(f"Hot upgrade: handed {len(handed)} clients over; exiting")
+        flush_logs()
+        return True
+
+    def describe_client(self, client, fd, messages):
+        """What the new process needs to carry on serving client; fd indexes the descriptors sent"""
+        session = client.session
+        if session:
+            for message in session.sent:
+                if message.seq not in messages:
+                    messages[message.seq] = (message.type, message.content, message.sender,
+                                             message.recipient, message.room, message.epoch_ms / 1000)
+        return {
+            'username': client.username,
+            'address': client.address,
+            'framing': client.framing,
+            'compress': client.compress,
+            'heartbeat': client.heartbeat,
+            'room': client.room,
+            'names': client.names,
+            'pending': base64.b64encode(client.decoder.pending()).decode(),
+            'session': session and {'token': session.token,
+                                    'sent': [message.seq for message in session.sent]},
+            'fd': fd
+        }
+
+    # Hot upgrade: the new process side
+
+    def take_over_sockets(self):
+        """Receive the listening socket and clients of the server at UPGRADE_SOCKET"""
+        try:
+            if not upgrades_supported() or not CONFIG['UPGRADE_SOCKET']:
+                raise ValueError("hot upgrades need UPGRADE_SOCKET and a platform that passes sockets")
+            self.predecessor = connect_to_predecessor(CONFIG['UPGRADE_TIMEOUT'])
+            state, fds = receive_state(self.predecessor)
+        except (OSError, ValueError) as e:
+            print_colored(f"Could not take over from the running server: {e}", "red")
+            return False
+        if state['transport'] != self.transport.name:
+            for fd in fds:
+                os.close(fd)
+            print_colored(f"The running server uses the {state['transport']} transport, "
+                          f"not {self.transport.name}", "red")
+            return False
+
+        self.socket = socket.socket(fileno=fds[0])
+        self.socket.settimeout(CONFIG['SOCKET_TIMEOUT'])
+        self.port = state['port']
+        continue_sequence(state['sequence'])
+        self.inherited = [(info, fds[info['fd']]) for info in state['clients']]
+        # Sessions share message objects, as they did in the old process
+        self.inherited_messages = {int(seq): Message(*fields, seq=int(seq))
+                                   for seq, fields in state['messages'].items()}
+        self.startup_phase('bind')
+        return True
+
+    def restore_client(self, info, connection):
+        """Register a client taken over from the old process, with no join notice"""
+        address = info['address']
+        client = self.client_class(connection, tuple(address) if isinstance(address, list) else address,
+                                   info['username'], info['framing'], self.transport)
+        client.compress = info['compress']
+        client.heartbeat = info['heartbeat']
+        client.names = {int(sender_id): name for sender_id, name in info['names'].items()}
+        if info['session']:
+            client.session = Session(CONFIG['SESSION_BUFFER_SIZE'], info['session']['token'])
+            client.session.record(self.inherited_messages[seq] for seq in info['session']['sent'])
+        client.start()
+        self.clients.add(client)
+        self.rooms.join(client, info['room'] or CONFIG['DEFAULT_ROOM'])
+        self.presence.update(client.username, True)
+        self.watch_client(client)
+        return client
 
-            self.broadcast_message(
-                Message('status', f'{username} left the chat', 'Server')
-            )
+    def adopt_clients(self):
+        # Everyone is back in their room before anyone's messages are read
+        adopted = []
+        for info, fd in self.inherited:
+            conn = socket.socket(fileno=fd)
+            conn.settimeout(None)
+            adopted.append((self.restore_client(info, conn), base64.b64decode(info['pending'])))
+        # Readers wait until all have started; starting threads among busy ones is slow
+        go = threading.Event()
+        for client, pending in adopted:
+            thread = threading.Thread(target=self.handle_adopted_client, args=(client, pending, go))
+            self.connection_threads.add(thread)
+            thread.start()
+        go.set()
+        self.finish_take_over()
+
+    def handle_adopted_client(self, client, pending, go):
+        """Finish any message the old process had partly read, then serve as usual"""
+        try:
+            go.wait()
+            if pending:
+                self.dispatch_frames(client, client.decoder.feed(pending))
+            self.handle_client_messages(client)
+        finally:
+            self.connection_threads.discard(threading.current_thread())
+
+    def finish_take_over(self):
+        """Tell the old process it can exit now that its clients are served here"""
+        count = len(self.inherited)
+        self.inherited = []
+        self.inherited_messages = {}
+        try:
+            self.predecessor.sendall(UPGRADE_ACK)
+        except OSError as e:
+            log_message(f"Could not acknowledge the hot upgrade: {e}", 'warning')
+        self.predecessor.close()
+        self.predecessor = None
+        print_colored(f"Took over {count} clients from the previous server process.", "green")
+        log_message(f"Hot upgrade: took over {count} clients")
 
     def shutdown(self):
         """Shutdown the server and clean up connections"""
         self.running = False
         print_colored("\nShutting down server...", "yellow")
 
-        # Notify all clients about server shutdown
+        if self.chatbot:
+            self.chatbot.stop()
+
+        # Notify all clients about server shutdown; other workers tell their own clients
         shutdown_msg = Message('status', 'Server is shutting down...', 'Server')
-        self.broadcast_message(shutdown_msg)
+        self.deliver_messages([shutdown_msg])
 
-        # Close all client connections
-        for client in list(self.clients.values()):
+        # Close all client connections, letting queued messages flush first
+        deadline = time.monotonic() + CONFIG['OUTBOX_FLUSH_TIMEOUT']
+        for client in self.clients.values():
             try:
-                client.connection.close()
+                client.close(max(deadline - time.monotonic(), 0.01))
             except:
                 pass
         self.clients.clear()
@@ -250,15 +1107,40 @@ class ChatServer:
         # Close server socket
         if self.socket:
             try:
-                self.socket.close()
+                self.transport.close_listener(self.socket)
             except:
                 pass
 
+        if self.history:
+            self.history.close()
+        if self.bus:
+            self.bus.close()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+
         print_colored("Server shutdown complete.", "green")
         log_message("Server shutdown complete")
+        flush_logs()
+
+def create_server():
+    """Build the server for CONFIG['SERVER_MODE']"""
+    if CONFIG['SERVER_MODE'] == 'asyncio':
+        from async_server import AsyncChatServer
+        return AsyncChatServer()
+    return ChatServer()
 
 if __name__ == "__main__":
-    server = ChatServer()
+    take_over = '--upgrade' in sys.argv[1:]  # Replace the running server without dropping its clients
+    if CONFIG['SERVER_WORKERS'] > 1:
+        if take_over:
+            print_colored("Hot upgrades are not supported with several workers", "red")
+            sys.exit(1)
+        from workers import serve_workers
+        serve_workers(CONFIG['SERVER_WORKERS'])
+        sys.exit(0)
+
+    server = create_server()
+    server.take_over = take_over
     try:
         server.start()
     except KeyboardInterrupt:
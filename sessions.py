@@ -0,0 +1,36 @@
+# sessions.py
+import hmac
+import itertools
+import secrets
+from collections import deque
+from protocol import CONTROL_TYPES
+
+class Session:
+    """What a client needs to resume after losing its connection.
+
+    The token proves the reconnecting client is the same one; the buffer
+    holds the last messages it was sent, in the order it was sent them,
+    so it can be given whatever came after the last one it received.
+    """
+    def __init__(self, size, token=None):
+        self.token = token or secrets.token_urlsafe(16)  # Given when taken over from another process
+        self.sent = deque(maxlen=size)
+
+    def matches(self, token):
+        return hmac.compare_digest(self.token, token)
+
+    def record(self, messages):
+        for message in messages:
+            if message.type not in CONTROL_TYPES:
+                self.sent.append(message)
+
+    def missed(self, last_seq):
+        """Messages sent after last_seq, and whether the buffer still held all of them"""
+        if last_seq:
+            for index in range(len(self.sent) - 1, -1, -1):
+                if self.sent[index].seq == last_seq:
+                    return list(itertools.islice(self.sent, index + 1, None)), True
+            if not self.sent or last_seq >= self.sent[-1].seq:
+                return [], True  # Sequence numbers only grow, so it has seen everything buffered
+        # Nothing received yet, or the last message received has already been pushed out
+        return list(self.sent), not last_seq and len(self.sent) < self.sent.maxlen
@@ -0,0 +1,44 @@
+# spawn.py
+"""Start a chat server in a child process for the benchmarks and the load generator.
+
+The child applies the overrides to CONFIG before anything else imports
+it, then runs server.py as 'python server.py' would, so SERVER_WORKERS
+and --upgrade behave as they do for an operator. The overrides travel
+to the child as JSON in the environment.
+"""
+import json
+import os
+import runpy
+import subprocess
+import sys
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+OVERRIDES_VARIABLE = 'CHAT_CONFIG_OVERRIDES'
+
+# Bot replies, history and rate limits would measure more than the server
+BENCH_CONFIG = {
+    'MAX_CONNECTIONS': 4096,
+    'CHATBOT_BACKEND': None,
+    'HISTORY_FILE': None,
+    'METRICS_PORT': None,
+    'RATE_LIMITS': {},
+    'GLOBAL_RATE_LIMITS': {}
+}
+
+def spawn_server(take_over=False, stdout=subprocess.DEVNULL, **overrides):
+    """Start a server with BENCH_CONFIG and overrides applied to CONFIG; returns the Popen.
+
+    take_over starts it with --upgrade, to replace the server at UPGRADE_SOCKET.
+    """
+    environment = dict(os.environ)
+    environment[OVERRIDES_VARIABLE] = json.dumps(dict(BENCH_CONFIG, **overrides))
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__)] + (['--upgrade'] if take_over else []),
+        cwd=DIRECTORY, env=environment, stdout=stdout, stderr=subprocess.STDOUT
+    )
+
+if __name__ == "__main__":
+    from config import CONFIG
+    CONFIG.update(json.loads(os.environ.pop(OVERRIDES_VARIABLE, '{}')))
+    sys.argv[0] = os.path.join(DIRECTORY, 'server.py')
+    runpy.run_path(sys.argv[0], run_name='__main__')
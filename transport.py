@@ -0,0 +1,184 @@
+# transport.py
+import os
+import socket
+import ssl
+from config import CONFIG
+from protocol import send_frames
+
+class TCPTransport:
+    """Plain TCP: the server listens on a port and clients connect to host:port.
+
+    The transports only differ in how connections are made; once made,
+    every connection is a socket-like object with recv_into, sendall,
+    shutdown and close, written through send_frames.
+    """
+    name = 'tcp'
+    uses_port = True
+
+    def listen(self, port, backlog, reuse_port=False):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                # Workers share the port; the kernel spreads new connections across them
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(('0.0.0.0', port))
+            sock.listen(backlog)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def accept(self, listener):
+        conn, addr = listener.accept()
+        # Replies are already batched into one write; Nagle would only hold them back
+        # (asyncio servers set this themselves)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn, addr
+
+    def handshake(self, conn):
+        """Finish setting up an accepted connection (TLS negotiates here)"""
+
+    def connect(self, address, timeout=None):
+        return socket.create_connection(address, timeout)
+
+    def close(self, sock):
+        sock.close()
+
+    def close_listener(self, listener):
+        listener.close()
+
+    def send_frames(self, sock, frames):
+        """Write frames with one scatter-gather sendmsg"""
+        send_frames(sock, frames)
+
+    def server_ssl_context(self):
+        """SSLContext for asyncio servers, or None for plaintext"""
+        return None
+
+    def client_ssl_context(self):
+        return None
+
+    def describe(self, port):
+        return f"port {port}"
+
+class TLSTransport(TCPTransport):
+    """TCP wrapped in TLS.
+
+    The TLS handshake runs on the connection's own thread (or task), never
+    in the accept loop. Clients keep the last session so a reconnect can
+    resume it instead of repeating the full handshake.
+    """
+    name = 'tls'
+
+    def __init__(self):
+        self.server_context = None
+        self.client_context = None
+        self.session = None  # Last TLS session, offered on the next connect
+
+    def server_ssl_context(self):
+        if self.server_context is None:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(CONFIG['TLS_CERT_FILE'], CONFIG['TLS_KEY_FILE'])
+            self.server_context = context
+        return self.server_context
+
+    def client_ssl_context(self):
+        if self.client_context is None:
+            context = ssl.create_default_context(cafile=CONFIG['TLS_CA_FILE'])
+            if not CONFIG['TLS_VERIFY']:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            self.client_context = context
+        return self.client_context
+
+    def accept(self, listener):
+        conn, addr = super().accept(listener)
+        return self.server_ssl_context().wrap_socket(conn, server_side=True,
+                                                    do_handshake_on_connect=False), addr
+
+    def handshake(self, conn):
+        conn.do_handshake()
+
+    def connect(self, address, timeout=None):
+        sock = super().connect(address, timeout)
+        try:
+            return self.client_ssl_context().wrap_socket(sock, server_hostname=address[0],
+                                                         session=self.session)
+        except (OSError, ValueError):
+            sock.close()
+            raise
+
+    def close(self, sock):
+        # TLS 1.3 tickets arrive after the handshake, so take the session as late as possible
+        try:
+            if sock.session is not None:
+                self.session = sock.session
+        except (AttributeError, ValueError):
+            pass
+        sock.close()
+
+    def send_frames(self, sock, frames):
+        """SSL sockets have no sendmsg; one joined write also makes fewer TLS records"""
+        sock.sendall(frames[0] if len(frames) == 1 else b''.join(frames))
+
+class UnixTransport(TCPTransport):
+    """Unix-domain stream socket at CONFIG['UNIX_SOCKET_PATH'] for same-host clients"""
+    name = 'unix'
+    uses_port = False
+
+    def listen(self, port, backlog, reuse_port=False):
+        return listen_unix(CONFIG['UNIX_SOCKET_PATH'], backlog)
+
+    def accept(self, listener):
+        conn, _ = listener.accept()
+        return conn, CONFIG['UNIX_SOCKET_PATH']
+
+    def connect(self, address, timeout=None):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(CONFIG['UNIX_SOCKET_PATH'])
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def close_listener(self, listener):
+        listener.close()
+        try:
+            os.unlink(CONFIG['UNIX_SOCKET_PATH'])
+        except OSError:
+            pass
+
+    def describe(self, port):
+        return CONFIG['UNIX_SOCKET_PATH']
+
+def listen_unix(path, backlog):
+    """Listen on a Unix socket file, replacing one left by a process that did not shut down cleanly"""
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            raise OSError(f"{path} is in use by a running server")
+        except ConnectionRefusedError:
+            os.unlink(path)
+        finally:
+            probe.close()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(path)
+        sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+TRANSPORTS = {'tcp': TCPTransport, 'tls': TLSTransport, 'unix': UnixTransport}
+
+def create_transport(name=None):
+    """Transport for CONFIG['TRANSPORT'] (or name)"""
+    name = name or CONFIG['TRANSPORT']
+    if name not in TRANSPORTS:
+        raise ValueError(f"Unknown transport {name!r}; expected one of {', '.join(TRANSPORTS)}")
+    return TRANSPORTS[name]()
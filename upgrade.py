@@ -0,0 +1,73 @@
+# upgrade.py
+"""Hot upgrade: hand a running server's sockets and clients to a new process.
+
+A server with CONFIG['UPGRADE_SOCKET'] set listens there for its
+successor, started as 'python server.py --upgrade'. When one connects,
+the old server stops reading, flushes what it has queued, and sends the
+listening socket and every client's socket over the Unix socket
+(SCM_RIGHTS), followed by a JSON description of the clients. The new
+server adopts them and answers UPGRADE_ACK; the old one then exits
+without closing any connection, so clients only see a short pause.
+"""
+import json
+import os
+import socket
+import struct
+from config import CONFIG
+from transport import listen_unix
+
+LENGTH = struct.Struct('!I')
+FDS_PER_MESSAGE = 250  # Linux passes at most 253 descriptors in one message
+UPGRADE_ACK = b'ok'
+
+def upgrades_supported():
+    return hasattr(socket, 'send_fds') and hasattr(socket, 'AF_UNIX')
+
+def listen_for_successor():
+    return listen_unix(CONFIG['UPGRADE_SOCKET'], 1)
+
+def connect_to_predecessor(timeout):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(CONFIG['UPGRADE_SOCKET'])
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+def recv_exactly(sock, count):
+    data = b''
+    while len(data) < count:
+        chunk = sock.recv(count - len(data))
+        if not chunk:
+            raise ConnectionError("The other server process hung up during the upgrade")
+        data += chunk
+    return data
+
+def send_state(sock, state, fds):
+    """Send file descriptors, in batches the kernel accepts, then state as JSON"""
+    sock.sendall(LENGTH.pack(len(fds)))
+    for first in range(0, len(fds), FDS_PER_MESSAGE):
+        batch = fds[first:first + FDS_PER_MESSAGE]
+        socket.send_fds(sock, [LENGTH.pack(len(batch))], batch)
+    data = json.dumps(state).encode()
+    sock.sendall(LENGTH.pack(len(data)) + data)
+
+def receive_state(sock):
+    """Counterpart of send_state; returns (state, fds)"""
+    (count,) = LENGTH.unpack(recv_exactly(sock, LENGTH.size))
+    fds = []
+    try:
+        while len(fds) < count:
+            data, batch, flags, _ = socket.recv_fds(sock, LENGTH.size, FDS_PER_MESSAGE)
+            fds.extend(batch)
+            if len(data) != LENGTH.size or flags & socket.MSG_CTRUNC:
+                raise ConnectionError("File descriptors were lost in the upgrade")
+        (length,) = LENGTH.unpack(recv_exactly(sock, LENGTH.size))
+        state = json.loads(recv_exactly(sock, length))
+    except:
+        for fd in fds:
+            os.close(fd)
+        raise
+    return state, fds
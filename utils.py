@@ -1,40 +1,198 @@
 # utils.py
+import atexit
 import logging
-from datetime import datetime
+import logging.handlers
+import queue
+import threading
 from config import CONFIG
 from colorama import Fore, Style, init
 
 init()
 
+class SamplingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the log writer without blocking the caller.
+
+    Once the queue passes LOG_SAMPLE_THRESHOLD only every LOG_SAMPLE_RATE-th
+    info record is kept; when it is full, records are dropped and counted.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.threshold = int(CONFIG['LOG_QUEUE_SIZE'] * CONFIG['LOG_SAMPLE_THRESHOLD'])
+        self.sampled = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens on the writer thread; only resolve %-args here
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if record.levelno < logging.WARNING and self.queue.qsize() >= self.threshold:
+            self.sampled += 1
+            if self.sampled % CONFIG['LOG_SAMPLE_RATE']:
+                self.dropped += 1
+                return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class BatchingLogWriter:
+    """Background thread that writes queued records to the log file in batches"""
+    def __init__(self, log_queue, handler):
+        self.queue = log_queue
+        self.handler = handler
+        self.thread = threading.Thread(target=self.run, daemon=True, name="log-writer")
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < CONFIG['LOG_BATCH_SIZE']:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.write(batch)
+
+    def write(self, batch):
+        """One lock acquisition and one flush for the whole batch"""
+        flushed = [item for item in batch if isinstance(item, threading.Event)]
+        self.handler.acquire()
+        try:
+            for record in batch:
+                if isinstance(record, threading.Event):
+                    continue
+                if self.should_rollover(record):
+                    self.handler.doRollover()
+                if self.handler.stream is None:
+                    self.handler.stream = self.handler._open()
+                self.handler.stream.write(self.handler.format(record) + self.handler.terminator)
+            self.handler.flush()
+        except Exception:
+            self.handler.handleError(batch[-1])
+        finally:
+            self.handler.release()
+        for event in flushed:
+            event.set()
+
+    def should_rollover(self, record):
+        if isinstance(self.handler, logging.handlers.RotatingFileHandler):
+            return self.handler.maxBytes > 0 and self.handler.shouldRollover(record)
+        if isinstance(self.handler, logging.handlers.TimedRotatingFileHandler):
+            return self.handler.shouldRollover(record)
+        return False
+
+def create_log_handler():
+    """File handler for CONFIG['LOG_FILE'] with the configured rotation"""
+    if CONFIG['LOG_ROTATION'] == 'size':
+        handler = logging.handlers.RotatingFileHandler(
+            CONFIG['LOG_FILE'], maxBytes=CONFIG['LOG_MAX_BYTES'],
+            backupCount=CONFIG['LOG_BACKUP_COUNT'], delay=True)
+    elif CONFIG['LOG_ROTATION'] == 'time':
+        handler = logging.handlers.TimedRotatingFileHandler(
+            CONFIG['LOG_FILE'], when=CONFIG['LOG_ROTATE_WHEN'],
+            backupCount=CONFIG['LOG_BACKUP_COUNT'], delay=True)
+    else:
+        handler = logging.FileHandler(CONFIG['LOG_FILE'], delay=True)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    return handler
+
 # Setup logging
-logging.basicConfig(
-    filename=CONFIG['LOG_FILE'],
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+log_queue_handler = None
+if CONFIG['LOG_MODE'] == 'queue':
+    log_queue = queue.Queue(maxsize=CONFIG['LOG_QUEUE_SIZE'])
+    log_queue_handler = SamplingQueueHandler(log_queue)
+    log_writer = BatchingLogWriter(log_queue, create_log_handler())
+    log_writer.start()
+    logging.basicConfig(level=logging.INFO, handlers=[log_queue_handler])
+else:
+    logging.basicConfig(level=logging.INFO, handlers=[create_log_handler()])
+
+MESSAGE_COLORS = {
+    'chat': Fore.WHITE,
+    'status': Fore.YELLOW,
+    'command': Fore.BLUE,
+    'dm': Fore.GREEN
+}
+
+COLORS = {
+    'red': Fore.RED,
+    'green': Fore.GREEN,
+    'blue': Fore.BLUE,
+    'yellow': Fore.YELLOW,
+    'white': Fore.WHITE
+}
 
 def format_message(msg):
     """Format message with timestamp and color based on message type"""
-    color = {
-        'chat': Fore.WHITE,
-        'status': Fore.YELLOW,
-        'command': Fore.BLUE,
-        'dm': Fore.GREEN
-    }.get(msg.type, Fore.WHITE)
-
+    color = MESSAGE_COLORS.get(msg.type, Fore.WHITE)
     return f"{color}[{msg.timestamp}] {msg.sender}: {msg.content}{Style.RESET_ALL}"
 
+def colored(message, color):
+    """Message wrapped in the escape codes for a named color"""
+    return f"{COLORS.get(color, Fore.WHITE)}{message}{Style.RESET_ALL}"
+
 def print_colored(message, color):
     """Print colored message"""
-    colors = {
-        'red': Fore.RED,
-        'green': Fore.GREEN,
-        'blue': Fore.BLUE,
-        'yellow': Fore.YELLOW,
-        'white': Fore.WHITE
-    }
-    print(f"{colors.get(color, Fore.WHITE)}{message}{Style.RESET_ALL}")
+    print(colored(message, color))
 
 def log_message(message, level='info'):
     """Log message to file"""
     getattr(logging, level)(message)
+
+def forward_logs(log_queue):
+    """Send this process's log records to the one that writes LOG_FILE.
+
+    Worker processes use this so that only their supervisor opens and
+    rotates the file; several processes rotating it would rename it under
+    each other and lose lines. Full queues drop records as locally.
+    """
+    global log_queue_handler
+    log_queue_handler = SamplingQueueHandler(log_queue)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(log_queue_handler)
+
+def receive_logs(log_queue):
+    """Log the records other processes forward (see forward_logs) here; None ends it"""
+    def run():
+        while True:
+            record = log_queue.get()
+            if record is None:
+                break
+            logging.getLogger().handle(record)
+    thread = threading.Thread(target=run, daemon=True, name="log-receiver")
+    thread.start()
+    return thread
+
+def flush_logs(timeout=2.0):
+    """Wait until queued log records have been written to disk"""
+    if log_queue_handler is None or not isinstance(log_queue_handler.queue, queue.Queue):
+        return True  # Written synchronously, or forwarded to another process
+    done = threading.Event()
+    try:
+        log_queue_handler.queue.put(done, timeout=timeout)
+    except queue.Full:
+        return False
+    return done.wait(timeout)
+
+def log_stats():
+    """Queue depth and records shed under backpressure"""
+    if log_queue_handler is None:
+        return {'queued': 0, 'sampled': 0, 'dropped': 0}
+    try:
+        queued = log_queue_handler.queue.qsize()
+    except NotImplementedError:
+        queued = 0  # A worker's forwarding queue on macOS
+    return {
+        'queued': queued,
+        'sampled': log_queue_handler.sampled,
+        'dropped': log_queue_handler.dropped
+    }
+
+atexit.register(flush_logs)
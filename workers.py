@@ -0,0 +1,100 @@
+# workers.py
+import multiprocessing
+import os
+import signal
+import socket
+from config import CONFIG, candidate_ports, get_local_ip
+from bus import WorkerBus
+from utils import forward_logs, log_message, print_colored, receive_logs
+
+def run_worker(index, peers, config, log_queue):
+    """Entry point of a worker process: one server on the shared port, joined to the bus"""
+    # Spawned workers import config afresh, so carry over the supervisor's settings
+    CONFIG.update(config)
+    forward_logs(log_queue)
+    from server import create_server
+    server = create_server()
+    server.worker_id = index
+    server.bus = WorkerBus(index, peers, server.handle_bus_event)
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+def reserve_port():
+    """Bind a non-listening SO_REUSEPORT socket on the first free candidate port.
+
+    Holding it keeps the port ours while workers bind beside it; it never
+    listens, so it is not handed any connections.
+    """
+    for port in candidate_ports():
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        try:
+            sock.bind(('0.0.0.0', port))
+            return sock
+        except OSError:
+            sock.close()
+    return None
+
+def serve_workers(count):
+    """Run count server processes accepting on one port; returns once they have all exited.
+
+    Each worker owns the clients the kernel hands it. Broadcasts, DMs and
+    presence cross between workers over a mesh of Unix socket pairs.
+    """
+    if CONFIG['TRANSPORT'] == 'unix':
+        print_colored("Worker processes share a TCP port; use a single process with the unix transport", "red")
+        return
+    reservation = reserve_port()
+    if reservation is None:
+        print_colored(f"No available port among {CONFIG['SERVER_PORT']} and the fallback range", "red")
+        return
+    # Also resolves port 0 to the kernel's choice before the workers start
+    port = CONFIG['SERVER_PORT'] = reservation.getsockname()[1]
+
+    pairs = {}
+    for i in range(count):
+        for j in range(i + 1, count):
+            pairs[i, j], pairs[j, i] = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    # Spawn rather than fork: the parent already runs logging threads
+    context = multiprocessing.get_context('spawn')
+    # Workers log through this process, the only one that writes LOG_FILE
+    log_queue = context.Queue(CONFIG['LOG_QUEUE_SIZE'])
+    log_receiver = receive_logs(log_queue)
+    processes = []
+    for i in range(count):
+        peers = {j: pairs[i, j] for j in range(count) if j != i}
+        process = context.Process(target=run_worker, args=(i, peers, dict(CONFIG), log_queue),
+                                  name=f"chat-worker-{i}")
+        process.start()
+        processes.append(process)
+
+    # Workers hold their own copies now
+    for sock in pairs.values():
+        sock.close()
+
+    def forward(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    signal.signal(signal.SIGINT, forward)
+    signal.signal(signal.SIGTERM, forward)
+
+    print_colored("\n=== Chat Server Started ===", "green")
+    print_colored(f"Server IP: {get_local_ip()}", "blue")
+    print_colored(f"Port: {port} ({count} worker processes)", "blue")
+    print_colored("Share these details with clients to connect.", "yellow")
+    print_colored("Press Ctrl+C to shutdown server.", "yellow")
+    log_message(f"Started {count} workers on port {port}")
+
+    for process in processes:
+        process.join()
+        if process.exitcode:
+            log_message(f"{process.name} exited with code {process.exitcode}", 'warning')
+    log_queue.put(None)
+    log_receiver.join(2.0)
+    reservation.close()